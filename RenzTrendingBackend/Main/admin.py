@@ -1,21 +1,16 @@
 from django import forms
 from django.contrib import admin
 from django.utils.html import mark_safe, format_html
-from . import models
-from django.core.mail import send_mail
+from . import models, campaigns
 from django.utils import timezone
 from django.utils.text import slugify
-from django.db.models import Count
 from rest_framework.authtoken.admin import TokenAdmin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.admin import SimpleListFilter
 from django.utils.translation import gettext_lazy as _
 import csv
 from django.http import HttpResponse
-import base64
 from django.urls import reverse
-from matplotlib.figure import Figure
-import io
 
 
 TokenAdmin.raw_id_fields = ["user"]
@@ -213,6 +208,45 @@ class ProductGroupAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(models.RelatedProduct)
+class RelatedProductAdmin(admin.ModelAdmin):
+    list_display = ("product", "related", "score", "computed_at")
+    search_fields = ("product__name", "related__name")
+    raw_id_fields = ("product", "related")
+    ordering = ("product", "-score")
+
+@admin.register(models.ProductAffinity)
+class ProductAffinityAdmin(admin.ModelAdmin):
+    list_display = ("product", "other", "count", "updated_at")
+    search_fields = ("product__name", "other__name")
+    raw_id_fields = ("product", "other")
+    ordering = ("product", "-count")
+
+@admin.register(models.ProductEvent)
+class ProductEventAdmin(admin.ModelAdmin):
+    list_display = ("product", "kind", "quantity", "created_at")
+    list_filter = ("kind",)
+    raw_id_fields = ("product",)
+
+@admin.register(models.BatchCheckpoint)
+class BatchCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("name", "position", "updated_at")
+
+@admin.register(models.EmailJob)
+class EmailJobAdmin(admin.ModelAdmin):
+    list_display = ("to_email", "subject", "status", "attempts", "available_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("to_email", "subject")
+    readonly_fields = ("attempts", "last_error", "locked_at", "created_at", "sent_at")
+    actions = ["requeue"]
+
+    def requeue(self, request, queryset):
+        count = queryset.exclude(status=models.EmailJob.SENT).update(
+            status=models.EmailJob.QUEUED, available_at=timezone.now(), locked_at=None
+        )
+        self.message_user(request, f"{count} emails queued again.")
+    requeue.short_description = "Queue selected emails again"
+
 @admin.register(models.Customer)
 class CustomerAdmin(UserAdmin):
     """
@@ -324,7 +358,7 @@ class OrderStatusFilter(SimpleListFilter):
 class OrderItemInline(admin.TabularInline):
     model = models.OrderItem
     extra = 0
-    readonly_fields = ('variant', 'quantity', 'price')
+    readonly_fields = ('product', 'variant', 'name', 'sku', 'size', 'quantity', 'price', 'line_total')
 
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -547,8 +581,8 @@ class OrderAdmin(admin.ModelAdmin):
 
 @admin.register(models.OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ('order', 'variant', 'quantity', 'price')
-    search_fields = ('order__id', 'variant__sku', 'variant__product__name')
+    list_display = ('order', 'name', 'sku', 'size', 'quantity', 'price', 'line_total')
+    search_fields = ('order__id', 'sku', 'name')
 
 @admin.register(models.Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -556,6 +590,28 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'payment_method')
     search_fields = ('order__id', 'transaction_id')
 
+@admin.register(models.PaymentIntent)
+class PaymentIntentAdmin(admin.ModelAdmin):
+    list_display = ('gateway_order_id', 'user', 'amount', 'status', 'order', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('gateway_order_id', 'user__username')
+    raw_id_fields = ('user', 'order')
+
+@admin.register(models.PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event', 'received_at', 'processed_at', 'attempts', 'error')
+    list_filter = ('event',)
+    search_fields = ('event_id',)
+    readonly_fields = ('event_id', 'event', 'payload', 'received_at', 'processed_at', 'attempts', 'error')
+
+@admin.register(models.LoginIdentifier)
+class LoginIdentifierAdmin(admin.ModelAdmin):
+    # Maintained by signals (see identifiers.py); rebuild with manage.py rebuild_login_identifiers
+    list_display = ('value', 'kind', 'user')
+    list_filter = ('kind',)
+    search_fields = ('value', 'user__username')
+    readonly_fields = ('user', 'kind', 'value')
+
 @admin.register(models.Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = [
@@ -637,21 +693,66 @@ class SubscriptionAdmin(admin.ModelAdmin):
     actions = ["send_bulk_confirmation_email"]
 
     def send_bulk_confirmation_email(self, request, queryset):
-        for subscription in queryset:
-            send_mail(
-                'Subscription Confirmation',
-                'Thank you for subscribing to our newsletter!',
-                'from@example.com',
-                [subscription.email],
-                fail_silently=False,
-            )
-        self.message_user(request, "Confirmation emails sent successfully.")
+        campaign = models.EmailCampaign.objects.create(
+            subject='Subscription Confirmation',
+            text_body='Thank you for subscribing to our newsletter!',
+        )
+        campaigns.queue(campaign, queryset.filter(is_active=True))
+        url = reverse("admin:Main_emailcampaign_change", args=[campaign.pk])
+        self.message_user(
+            request,
+            format_html('Queued {} confirmation emails as <a href="{}">campaign #{}</a>.', campaign.total, url, campaign.pk),
+        )
     send_bulk_confirmation_email.short_description = "Send Confirmation Email to Selected"
     
     def send_confirmation_email(self, obj):
         return mark_safe(f'<a href="mailto:{obj.email}">Send Email</a>')
     send_confirmation_email.short_description = "Send Email"
 
+@admin.register(models.EmailCampaign)
+class EmailCampaignAdmin(admin.ModelAdmin):
+    list_display = ["subject", "status", "progress_bar", "total", "sent_count", "failed_count", "created_at", "finished_at"]
+    list_filter = ["status", "all_subscribers"]
+    search_fields = ["subject"]
+    readonly_fields = ["status", "progress_bar", "total", "sent_count", "failed_count", "started_at", "finished_at"]
+    actions = ["send_campaign", "pause_campaign", "retry_failed"]
+
+    def progress_bar(self, obj):
+        return format_html(
+            '<div style="width: 120px; background: #eee;"><div style="width: {}%; background: #4caf50; color: #fff; '
+            'text-align: center;">{}%</div></div>',
+            obj.progress, obj.progress,
+        )
+    progress_bar.short_description = "Progress"
+
+    def send_campaign(self, request, queryset):
+        count = 0
+        for campaign in queryset.filter(status__in=[models.EmailCampaign.DRAFT, models.EmailCampaign.PAUSED]):
+            campaigns.queue(campaign)
+            count += 1
+        self.message_user(request, f"{count} campaigns queued; `manage.py send_campaigns` sends them.")
+    send_campaign.short_description = "Send selected campaigns"
+
+    def pause_campaign(self, request, queryset):
+        count = queryset.filter(status__in=[models.EmailCampaign.QUEUED, models.EmailCampaign.SENDING]).update(
+            status=models.EmailCampaign.PAUSED
+        )
+        self.message_user(request, f"{count} campaigns paused.")
+    pause_campaign.short_description = "Pause selected campaigns"
+
+    def retry_failed(self, request, queryset):
+        count = sum(campaigns.retry_failed(campaign) for campaign in queryset)
+        self.message_user(request, f"{count} failed recipients queued again.")
+    retry_failed.short_description = "Retry failed recipients"
+
+@admin.register(models.CampaignRecipient)
+class CampaignRecipientAdmin(admin.ModelAdmin):
+    list_display = ["email", "campaign", "status", "sent_at"]
+    list_filter = ["status", "campaign"]
+    search_fields = ["email"]
+    raw_id_fields = ["campaign"]
+    readonly_fields = ["error", "locked_at", "sent_at"]
+
 @admin.register(models.Color)
 class ColorAdmin(admin.ModelAdmin):
     list_display = ["color", "id", "hexcode", "color_tag", "total_products"]
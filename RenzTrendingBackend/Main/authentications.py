@@ -1,36 +1,155 @@
 # yourapp/authentication.py
 
-from django.contrib.auth.backends import BaseBackend
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from . import identifiers
 from .models import Customer
 
-class CustomAuthBackend(BaseBackend):
-    def authenticate(self, request, username=None, password=None, **kwargs):
-        # Reference 'request' and 'kwargs' to prevent warnings or errors
-        _ = request
-        _ = kwargs
+class CustomAuthBackend(ModelBackend):
+    """
+    Log in by username, email or phone (see identifiers.py): one indexed
+    query, then one password check. It is the only authentication backend, so
+    a failed login costs one hash, and an unknown login hashes too, to take
+    as long as a wrong password.
+    """
 
-        try:
-            if '@' in username:
-                # Email login
-                user = User.objects.get(email=username)
-            elif "+" in username:
-                # Mobile number login
-                customer = Customer.objects.get(phone=username)
-                user = customer
-            else:
-                # Username login
-                user = User.objects.get(username=username)
-        except (User.DoesNotExist, Customer.DoesNotExist):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
             return None
-
-        # Safely check if 'user' has check_password
-        if hasattr(user, 'check_password') and user.check_password(password):
+        user = identifiers.find_user(username)
+        if user is None:
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
             return user
         return None
 
-    def get_user(self, user_id):
+
+class LocalLRU:
+    """A small thread-safe LRU whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TokenCache:
+    """
+    Token key -> ``(user, token)``, first from this process's LRU, then from
+    the shared cache. Entries are dropped from both on logout and whenever the
+    user is saved (password reset, deactivation, profile edits; see
+    signals.py). Other processes may keep serving a dropped entry from their
+    LRU for up to ``AUTH_TOKEN_LOCAL_TTL`` seconds.
+    """
+
+    def __init__(self):
+        self.local = LocalLRU(settings.AUTH_TOKEN_LOCAL_SIZE, settings.AUTH_TOKEN_LOCAL_TTL)
+
+    @staticmethod
+    def shared():
+        return caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+
+    @staticmethod
+    def shared_key(token_key):
+        # Tokens are credentials; keep them out of cache keys
+        return "auth-token:" + hashlib.sha256(token_key.encode()).hexdigest()
+
+    def get(self, token_key):
+        entry = self.local.get(token_key)
+        if entry is None:
+            entry = self.shared().get(self.shared_key(token_key))
+            if entry is not None:
+                self.local.set(token_key, entry)
+        return entry
+
+    def set(self, token_key, entry):
+        self.shared().set(self.shared_key(token_key), entry, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        self.local.set(token_key, entry)
+
+    def invalidate(self, token_keys):
+        for token_key in token_keys:
+            self.local.delete(token_key)
+        if token_keys:
+            self.shared().delete_many([self.shared_key(token_key) for token_key in token_keys])
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    ``TokenAuthentication`` that resolves the token to its user, as the
+    ``Customer`` row when there is one, in a single query, caches the result
+    (see ``TokenCache``), and sets ``request.customer``.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            user = result[0]
+            request._request.customer = user if isinstance(user, Customer) else None
+        return result
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            entry = self.load(key)
+            token_cache.set(key, entry)
+        user, token = entry
+        # A private copy, so nothing a view does to it leaks into the cache
+        return copy.copy(user), token
+
+    def load(self, key):
         try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+            token = Token.objects.select_related("user", "user__customer").get(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        try:
+            user = token.user.customer
+        except Customer.DoesNotExist:
+            user = token.user
+        return user, Token(key=token.key, user_id=token.user_id, created=token.created)
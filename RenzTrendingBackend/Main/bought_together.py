@@ -0,0 +1,144 @@
+"""
+"Frequently bought together" from order history.
+
+Order lines are streamed in chunks of orders and turned into pair counts held
+as flat NumPy arrays: each ordered pair ``(a, b)`` is encoded as the single
+int64 key ``a * width + b``, so a sparse co-occurrence matrix is just a sorted
+``keys`` array with a matching ``counts`` array. Memory is bounded by the
+chunk size plus the number of distinct pairs, never by the number of lines.
+
+Runs stop ``BOUGHT_TOGETHER_SAFETY_LAG`` behind the newest order. Order ids
+are handed out at insert, so a checkout still in its transaction can commit
+an id lower than one already mined; orders older than the lag have settled.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import models
+
+CHECKPOINT = "bought_together"
+
+# Baskets bigger than this are truncated so one bulk order can't add n^2 pairs.
+MAX_BASKET = 50
+
+
+def settled_order_id():
+    """The newest order id older than the safety lag; every order up to it has committed."""
+    cutoff = timezone.now() - settings.BOUGHT_TOGETHER_SAFETY_LAG
+    # Walks the primary key back from the tip, past only the orders within the lag
+    last = models.Order.objects.filter(created_at__lte=cutoff).order_by("-id").values_list("id", flat=True).first()
+    return last or 0
+
+
+def stream_baskets(after_order_id, chunk_size):
+    """Yield ``(last_order_id, [set of product ids, ...])`` for chunks of settled orders."""
+    order_products = models.Order.products.through.objects
+    last_id = settled_order_id()
+    start = after_order_id
+    while start < last_id:
+        stop = min(start + chunk_size, last_id)
+        baskets = {}
+        lines = (
+            order_products.filter(order_id__gt=start, order_id__lte=stop)
+            .values_list("order_id", "cartitem__product_id")
+            .iterator(chunk_size=5000)
+        )
+        for order_id, product_id in lines:
+            baskets.setdefault(order_id, set()).add(product_id)
+        lines = (
+            models.OrderItem.objects.filter(order_id__gt=start, order_id__lte=stop)
+            .exclude(product_id=None)
+            .values_list("order_id", "product_id")
+            .iterator(chunk_size=5000)
+        )
+        for order_id, product_id in lines:
+            baskets.setdefault(order_id, set()).add(product_id)
+        yield stop, [basket for basket in baskets.values() if len(basket) > 1]
+        start = stop
+
+
+def count_pairs(baskets, width):
+    """Co-occurrence counts for one chunk as ``(keys, counts)``."""
+    left, right = [], []
+    for basket in baskets:
+        items = np.fromiter(sorted(basket)[:MAX_BASKET], dtype=np.int64)
+        a, b = np.meshgrid(items, items, indexing="ij")
+        mask = a != b
+        left.append(a[mask])
+        right.append(b[mask])
+    if not left:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    keys = np.concatenate(left) * width + np.concatenate(right)
+    return np.unique(keys, return_counts=True)
+
+
+def merge_counts(keys, counts, more_keys, more_counts):
+    all_keys = np.concatenate([keys, more_keys])
+    merged, inverse = np.unique(all_keys, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate([counts, more_counts]))
+    return merged, totals.astype(np.int64)
+
+
+def top_k(keys, counts, width, k):
+    """Keep the ``k`` highest counts per product; returns ``(products, others, counts)``."""
+    products, others = keys // width, keys % width
+    order = np.lexsort((-counts, products))
+    products, others, counts = products[order], others[order], counts[order]
+    _, starts, sizes = np.unique(products, return_index=True, return_counts=True)
+    rank = np.arange(len(products)) - np.repeat(starts, sizes)
+    keep = rank < k
+    return products[keep], others[keep], counts[keep]
+
+
+def stored_counts(product_ids, width):
+    rows = models.ProductAffinity.objects.filter(product_id__in=product_ids.tolist()).values_list(
+        "product_id", "other_id", "count"
+    )
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+    return data[:, 0] * width + data[:, 1], data[:, 2]
+
+
+def build_affinities(full=False, chunk_size=5000, k=10):
+    """
+    Fold new orders into ProductAffinity; returns the last order id folded in.
+
+    Incremental runs add the new pair counts to the stored top-K counts of the
+    products they touch and re-truncate, so a pair that has already dropped
+    out of a product's top K starts again from its new count.
+    """
+    checkpoint, _ = models.BatchCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    start = 0 if full else checkpoint.position
+    width = (models.Product.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+
+    keys, counts = np.empty(0, np.int64), np.empty(0, np.int64)
+    last_order = start
+    for last_order, baskets in stream_baskets(start, chunk_size):
+        keys, counts = merge_counts(keys, counts, *count_pairs(baskets, width))
+
+    touched = np.unique(keys // width)
+    with transaction.atomic():
+        if full:
+            models.ProductAffinity.objects.all().delete()
+        elif len(touched):
+            keys, counts = merge_counts(keys, counts, *stored_counts(touched, width))
+            models.ProductAffinity.objects.filter(product_id__in=touched.tolist()).delete()
+
+        products, others, totals = top_k(keys, counts, width, k)
+        models.ProductAffinity.objects.bulk_create(
+            [
+                models.ProductAffinity(product_id=int(a), other_id=int(b), count=int(n))
+                for a, b, n in zip(products, others, totals)
+            ],
+            batch_size=1000,
+        )
+        checkpoint.position = last_order
+        checkpoint.save(update_fields=["position", "updated_at"])
+    return last_order
+
+
+def bought_together(queryset, slug, count=8):
+    """Products most often ordered with the product ``slug``, from one indexed join."""
+    return queryset.filter(affinity_from__product__slug=slug).order_by("-affinity_from__count")[:count]
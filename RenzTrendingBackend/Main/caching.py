@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Namespace for everything derived from Product, ProductImage and Category.
+CATALOG = "catalog"
+
+
+def get_cache():
+    """The configured backend: local memory by default, Redis in production."""
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def version_key(namespace):
+    return f"{namespace}:version"
+
+
+def get_version(namespace):
+    cache = get_cache()
+    version = cache.get(version_key(namespace))
+    if version is None:
+        cache.add(version_key(namespace), 1, timeout=None)
+        version = cache.get(version_key(namespace), 1)
+    return version
+
+
+def bump_version(namespace):
+    """
+    Move ``namespace`` to a new version.
+
+    Entries are stored under the version they were built for, so bumping
+    makes every older entry unreachable and it is never served again.
+    """
+    cache = get_cache()
+    try:
+        return cache.incr(version_key(namespace))
+    except ValueError:
+        cache.add(version_key(namespace), 1, timeout=None)
+        return cache.incr(version_key(namespace))
+
+
+def get_or_build(namespace, key, builder, timeout=None):
+    """Return the cached value for ``key`` in the current version, building it on a miss."""
+    cache = get_cache()
+    versioned_key = f"{namespace}:v{get_version(namespace)}:{key}"
+    value = cache.get(versioned_key)
+    if value is None:
+        value = builder()
+        cache.set(versioned_key, value, timeout=timeout or settings.CATALOG_CACHE_TIMEOUT)
+    return value
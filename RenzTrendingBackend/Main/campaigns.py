@@ -0,0 +1,193 @@
+"""
+Newsletter campaigns.
+
+Queuing a campaign only writes its CampaignRecipient rows, streamed from the
+subscriptions with ``.iterator()`` and inserted a chunk at a time, so the
+admin request never sends anything. ``manage.py send_campaigns`` does the
+sending: it claims recipients in batches (``SKIP LOCKED``, like the mail
+queue), sends each batch over one reused SMTP connection, paces itself to
+``CAMPAIGN_RATE_LIMIT`` messages a second and records every recipient's
+outcome plus running totals on the campaign, which is what the admin shows
+as progress. Pausing a campaign in the admin stops it after the current
+batch.
+"""
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import mailer, models
+
+RECIPIENT_CHUNK_SIZE = 2000
+
+
+def active_subscriptions():
+    return models.Subscription.objects.filter(is_active=True)
+
+
+def add_recipients(campaign, subscriptions):
+    """Stream ``subscriptions`` into the campaign's recipients; returns the new total."""
+    emails = subscriptions.order_by().values_list("email", flat=True).iterator(chunk_size=RECIPIENT_CHUNK_SIZE)
+    chunk = []
+    for email in emails:
+        chunk.append(models.CampaignRecipient(campaign=campaign, email=email))
+        if len(chunk) == RECIPIENT_CHUNK_SIZE:
+            models.CampaignRecipient.objects.bulk_create(chunk, ignore_conflicts=True)
+            chunk = []
+    if chunk:
+        models.CampaignRecipient.objects.bulk_create(chunk, ignore_conflicts=True)
+    campaign.total = campaign.recipients.count()
+    models.EmailCampaign.objects.filter(pk=campaign.pk).update(total=campaign.total)
+    return campaign.total
+
+
+def queue(campaign, subscriptions=None):
+    """
+    Hand ``campaign`` to the senders. With ``subscriptions`` its recipients
+    are added now; otherwise an ``all_subscribers`` campaign picks up every
+    active subscription when it starts sending.
+    """
+    if subscriptions is not None:
+        add_recipients(campaign, subscriptions)
+    campaign.status = models.EmailCampaign.QUEUED
+    campaign.save(update_fields=["status"])
+
+
+def start(campaign):
+    if campaign.all_subscribers and campaign.status == models.EmailCampaign.QUEUED:
+        add_recipients(campaign, active_subscriptions())
+    campaign.status = models.EmailCampaign.SENDING
+    campaign.started_at = campaign.started_at or timezone.now()
+    campaign.save(update_fields=["status", "started_at"])
+
+
+def claim(campaign, batch_size):
+    now = timezone.now()
+    stale = now - settings.MAIL_LOCK_TIMEOUT
+    with transaction.atomic():
+        recipients = list(
+            campaign.recipients.filter(
+                Q(status=models.CampaignRecipient.PENDING)
+                | Q(status=models.CampaignRecipient.SENDING, locked_at__lt=stale)
+            )
+            .order_by("id")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if recipients:
+            models.CampaignRecipient.objects.filter(pk__in=[r.pk for r in recipients]).update(
+                status=models.CampaignRecipient.SENDING, locked_at=now
+            )
+    return recipients
+
+
+def build_message(campaign, email):
+    message = EmailMultiAlternatives(
+        subject=campaign.subject,
+        body=campaign.text_body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email],
+    )
+    if campaign.html_body:
+        message.attach_alternative(campaign.html_body, "text/html")
+    return message
+
+
+def send_batch(campaign, recipients, sender):
+    sent = failed = 0
+    for recipient in recipients:
+        recipient.locked_at = None
+        try:
+            sender.send(build_message(campaign, recipient.email))
+        except Exception as error:
+            recipient.status = models.CampaignRecipient.FAILED
+            recipient.error = f"{type(error).__name__}: {error}"
+            failed += 1
+        else:
+            recipient.status = models.CampaignRecipient.SENT
+            recipient.sent_at = timezone.now()
+            recipient.error = ""
+            sent += 1
+    models.CampaignRecipient.objects.bulk_update(recipients, ["status", "error", "locked_at", "sent_at"])
+    models.EmailCampaign.objects.filter(pk=campaign.pk).update(
+        sent_count=F("sent_count") + sent, failed_count=F("failed_count") + failed
+    )
+    return sent
+
+
+class Throttle:
+    """Sleeps just enough to keep to ``rate`` messages a second (no limit when falsy)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.count = 0
+
+    def wait(self, count):
+        self.count += count
+        if not self.rate:
+            return
+        ahead = self.count / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def send(campaign, batch_size=None, rate=None, sender=None):
+    """Send ``campaign`` until no recipient is left or it is paused; returns how many were sent."""
+    batch_size = batch_size or settings.CAMPAIGN_BATCH_SIZE
+    rate = settings.CAMPAIGN_RATE_LIMIT if rate is None else rate
+    own_sender = sender is None
+    sender = sender or mailer.Sender()
+    throttle = Throttle(rate)
+    sent = 0
+    start(campaign)
+    try:
+        while True:
+            campaign.refresh_from_db(fields=["status"])
+            if campaign.status != models.EmailCampaign.SENDING:
+                return sent
+            recipients = claim(campaign, batch_size)
+            if not recipients:
+                break
+            sent += send_batch(campaign, recipients, sender)
+            throttle.wait(len(recipients))
+    finally:
+        if own_sender:
+            sender.close()
+    still_open = campaign.recipients.filter(
+        status__in=[models.CampaignRecipient.PENDING, models.CampaignRecipient.SENDING]
+    )
+    if not still_open.exists():
+        models.EmailCampaign.objects.filter(pk=campaign.pk, status=models.EmailCampaign.SENDING).update(
+            status=models.EmailCampaign.DONE, finished_at=timezone.now()
+        )
+    return sent
+
+
+def send_pending(batch_size=None, rate=None):
+    """Send every queued or interrupted campaign, oldest first, over one connection."""
+    sender = mailer.Sender()
+    sent = 0
+    try:
+        campaigns = models.EmailCampaign.objects.filter(
+            status__in=[models.EmailCampaign.QUEUED, models.EmailCampaign.SENDING]
+        ).order_by("created_at", "id")
+        for campaign in campaigns:
+            sent += send(campaign, batch_size, rate, sender)
+    finally:
+        sender.close()
+    return sent
+
+
+def retry_failed(campaign):
+    """Put failed recipients back in the queue; returns how many."""
+    count = campaign.recipients.filter(status=models.CampaignRecipient.FAILED).update(
+        status=models.CampaignRecipient.PENDING, error=""
+    )
+    if count:
+        models.EmailCampaign.objects.filter(pk=campaign.pk).update(
+            failed_count=F("failed_count") - count, status=models.EmailCampaign.QUEUED, finished_at=None
+        )
+    return count
@@ -0,0 +1,101 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from . import models
+
+
+# Columns a product card reads; everything else on Product stays deferred.
+CARD_FIELDS = (
+    "id",
+    "slug",
+    "name",
+    "category_id",
+    "market_price",
+    "selling_price",
+    "buy_count",
+    "rating",
+    "stock",
+)
+
+
+def card_queryset(queryset):
+    """Restrict a product queryset to the columns needed for cards."""
+    return queryset.only(*CARD_FIELDS)
+
+
+def get_badge(product):
+    if product.buy_count > 100:
+        return "Hot"
+    if product.market_price and product.market_price > 0:
+        market_price = Decimal(str(product.market_price))
+        selling_price = Decimal(str(product.selling_price))
+        discount_percentage = ((market_price - selling_price) * 100 / market_price).quantize(
+            Decimal(1), ROUND_HALF_UP
+        )
+        if discount_percentage > 0:
+            return f"-{discount_percentage}%"
+    return None
+
+
+def format_product_card(product, images, category_name):
+    image_url = models.ProductImage._meta.get_field("image").storage.url
+    return {
+        "id": product.pk,
+        "slug": product.slug,
+        "img1": image_url(images[0]) if len(images) > 0 else None,
+        "img2": image_url(images[1]) if len(images) > 1 else None,
+        "rating": int(product.rating) if product.rating else 4,
+        "oldPrice": product.market_price,
+        "newPrice": product.selling_price,
+        "badge": get_badge(product),
+        "category": category_name or "Uncategorized",
+        "name": product.name,
+        "stock": product.stock,
+    }
+
+
+def build_card_index(products):
+    """
+    Build cards for many products at once, keyed by product id.
+
+    Runs one query for the products (if a queryset is passed), one for their
+    images and one for their categories, however many products there are.
+    """
+    products = list(products)
+    if not products:
+        return {}
+
+    product_ids = [product.pk for product in products]
+    images = {}
+    image_rows = (
+        models.ProductImage.objects.filter(product_id__in=product_ids)
+        .order_by("-is_primary", "id")
+        .values_list("product_id", "image")
+    )
+    for product_id, image in image_rows:
+        images.setdefault(product_id, []).append(image)
+
+    categories = dict(
+        models.Category.objects.filter(
+            id__in={product.category_id for product in products}
+        ).values_list("id", "name")
+    )
+
+    return {
+        product.pk: format_product_card(
+            product, images.get(product.pk, []), categories.get(product.category_id)
+        )
+        for product in products
+    }
+
+
+def build_product_cards(products, card_type=None):
+    """Build cards for ``products`` in order, optionally tagged with a ``type``."""
+    products = list(products)
+    index = build_card_index(products)
+    return [with_type(index[product.pk], card_type) for product in products]
+
+
+def with_type(card, card_type):
+    if card_type is None:
+        return card
+    return {**card, "type": card_type}
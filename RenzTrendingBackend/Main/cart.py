@@ -0,0 +1,239 @@
+"""
+Cart mutations as single SQL statements.
+
+Every change to a line's quantity is applied by the database in one
+statement (an upsert or a conditional ``UPDATE``), so concurrent taps on the
+same line can't overwrite each other, and the per-line cap is part of the
+statement's ``WHERE`` clause rather than a read-then-check in Python. The
+``cartitem_quantity_cap`` check constraint backs it up for any other writer.
+"""
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import models
+
+MAX_QUANTITY = models.CART_MAX_QUANTITY
+
+
+def check_quantity(quantity):
+    if quantity <= 0:
+        raise ValidationError("Quantity must be greater than zero")
+    if quantity > MAX_QUANTITY:
+        raise ValidationError(f"Quantity cannot exceed {MAX_QUANTITY}")
+
+
+def add(customer_id, product_id, size_id=None, quantity=1, variant_id=None):
+    """
+    Add ``quantity`` to the customer's line for ``(product, size)``, creating
+    it if needed; returns ``(line_id, new_quantity)``.
+    """
+    check_quantity(quantity)
+    table = models.CartItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO "{table}" AS line (user_id, product_id, size_id, variant_id, quantity, created_at) '
+            f"VALUES (%s, %s, %s, %s, %s, now()) "
+            f"ON CONFLICT ON CONSTRAINT cartitem_user_product_size_uniq DO UPDATE "
+            f"SET quantity = line.quantity + EXCLUDED.quantity "
+            f"WHERE line.quantity + EXCLUDED.quantity <= %s "
+            f"RETURNING id, quantity",
+            [customer_id, product_id, size_id, variant_id, quantity, MAX_QUANTITY],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        raise ValidationError(f"Total quantity cannot exceed {MAX_QUANTITY}")
+    return row
+
+
+def lines(customer_id):
+    return models.CartItem.objects.filter(user_id=customer_id)
+
+
+def increment(customer_id, line_id, by=1):
+    """Raise a line's quantity by ``by``; returns the new quantity."""
+    check_quantity(by)
+    line = lines(customer_id).filter(pk=line_id)
+    updated = line.filter(quantity__lte=MAX_QUANTITY - by).update(quantity=F("quantity") + by)
+    if not updated:
+        if not line.exists():
+            raise models.CartItem.DoesNotExist
+        raise ValidationError(f"Total quantity cannot exceed {MAX_QUANTITY}")
+    return line.values_list("quantity", flat=True).get()
+
+
+def decrement(customer_id, line_id, by=1):
+    """
+    Lower a line's quantity by ``by``, deleting it when that would reach zero;
+    returns the new quantity (0 if deleted).
+    """
+    check_quantity(by)
+    line = lines(customer_id).filter(pk=line_id)
+    with transaction.atomic():
+        while True:
+            if line.filter(quantity__gt=by).update(quantity=F("quantity") - by):
+                return line.values_list("quantity", flat=True).get()
+            if line.filter(quantity__lte=by).delete()[0]:
+                return 0
+            # Both conditional statements missed: either the line is gone or a
+            # concurrent add raised it past ``by`` in between. Retry on the latter.
+            if not line.exists():
+                raise models.CartItem.DoesNotExist
+
+
+def set_quantity(customer_id, line_id, quantity):
+    """Set a line's quantity outright; 0 removes it. Returns the new quantity."""
+    if quantity == 0:
+        remove(customer_id, line_id)
+        return 0
+    check_quantity(quantity)
+    if not lines(customer_id).filter(pk=line_id).update(quantity=quantity):
+        raise models.CartItem.DoesNotExist
+    return quantity
+
+
+def remove(customer_id, line_id):
+    if not lines(customer_id).filter(pk=line_id).delete()[0]:
+        raise models.CartItem.DoesNotExist
+
+
+def merge_duplicate_lines():
+    """
+    Fold repeated ``(user, product, size)`` lines into the newest one, so that
+    ``cartitem_user_product_size_uniq`` can be added; returns how many lines
+    were removed. Lines used to double as order lines, so old data repeats.
+    Quantities are summed up to MAX_QUANTITY. Orders still linked to a line
+    being merged get it snapshotted into OrderItem and unlinked first, so
+    their history keeps its quantities; while OrderItem doesn't exist yet,
+    linked lines are left out of the merge instead. Plain SQL, since it runs
+    before Main's migrations (see signals.py).
+    """
+    table = models.CartItem._meta.db_table
+    links = models.Order.products.through._meta.db_table
+    items = models.OrderItem._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        snapshot = items in connection.introspection.table_names(cursor)
+        unlinked = "" if snapshot else (
+            f'WHERE NOT EXISTS (SELECT 1 FROM "{links}" link WHERE link.cartitem_id = line.id) '
+        )
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE cart_merge AS "
+            f"SELECT id, first_value(id) OVER w AS keep, sum(quantity) OVER w AS total, count(*) OVER w AS lines "
+            f'FROM "{table}" line {unlinked}'
+            f"WINDOW w AS (PARTITION BY user_id, product_id, size_id ORDER BY id DESC "
+            f"ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)"
+        )
+        if snapshot:
+            unit_price = "COALESCE(variant.price, product.selling_price)"
+            cursor.execute(
+                f'INSERT INTO "{items}" '
+                f"(order_id, product_id, variant_id, name, sku, size, quantity, price, line_total) "
+                f"SELECT link.order_id, line.product_id, line.variant_id, product.name, COALESCE(variant.sku, ''), "
+                f"COALESCE(size.size, ''), line.quantity, {unit_price}, {unit_price} * line.quantity "
+                f'FROM "{links}" link '
+                f"JOIN cart_merge dup ON dup.id = link.cartitem_id AND dup.lines > 1 "
+                f'JOIN "{table}" line ON line.id = dup.id '
+                f'JOIN "{models.Product._meta.db_table}" product ON product.id = line.product_id '
+                f'LEFT JOIN "{models.ProductVariant._meta.db_table}" variant ON variant.id = line.variant_id '
+                f'LEFT JOIN "{models.Size._meta.db_table}" size ON size.id = line.size_id '
+                f"ORDER BY link.id"
+            )
+            cursor.execute(
+                f'DELETE FROM "{links}" link USING cart_merge dup WHERE dup.id = link.cartitem_id AND dup.lines > 1'
+            )
+        cursor.execute(
+            f"UPDATE \"{table}\" line SET quantity = LEAST(dup.total, %s) FROM cart_merge dup "
+            f"WHERE line.id = dup.id AND dup.id = dup.keep AND line.quantity <> LEAST(dup.total, %s)",
+            [MAX_QUANTITY, MAX_QUANTITY],
+        )
+        cursor.execute(
+            f"DELETE FROM \"{table}\" line USING cart_merge dup WHERE line.id = dup.id AND dup.id <> dup.keep"
+        )
+        removed = cursor.rowcount
+        cursor.execute("DROP TABLE cart_merge")
+    return removed
+
+
+OPERATIONS = ("add", "set", "remove")
+
+
+def parse_operation(index, operation):
+    try:
+        op = operation.get("op", "add")
+        quantity = int(operation.get("quantity", 1 if op == "add" else 0))
+        key = (int(operation["product"]), int(operation["size"]) if operation.get("size") else None)
+        variant = int(operation["variant"]) if operation.get("variant") else None
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise ValidationError(f"Operation {index} needs a product and numeric quantity, size and variant")
+    if op not in OPERATIONS:
+        raise ValidationError(f"Operation {index} has unknown op {op!r}")
+    if op == "add" and quantity <= 0 or op == "set" and quantity < 0:
+        raise ValidationError(f"Operation {index} has an invalid quantity")
+    return op, key, quantity, variant
+
+
+def apply_operations(customer_id, operations):
+    """
+    Apply a list of ``{"op": "add"|"set"|"remove", "product", "size",
+    "quantity", "variant"}`` operations to the customer's cart at once.
+
+    The customer's affected lines are locked and the final quantity of every
+    ``(product, size)`` line is worked out in memory, then written with one
+    bulk INSERT, one bulk UPDATE and one DELETE. The batch is all or nothing:
+    any invalid operation, unknown product, size or variant, or line over
+    the cap rejects it.
+    Returns ``(created, updated, deleted)`` counts.
+    """
+    parsed = [parse_operation(index, operation) for index, operation in enumerate(operations)]
+    product_ids = {product for _, (product, _), _, _ in parsed}
+    size_ids = {size for _, (_, size), _, _ in parsed if size is not None}
+    if models.Product.objects.filter(pk__in=product_ids).count() != len(product_ids):
+        raise ValidationError("Unknown product in operations")
+    if size_ids and models.Size.objects.filter(pk__in=size_ids).count() != len(size_ids):
+        raise ValidationError("Unknown size in operations")
+    variant_ids = {variant for _, _, _, variant in parsed if variant is not None}
+    if variant_ids:
+        owners = dict(models.ProductVariant.objects.filter(pk__in=variant_ids).values_list("pk", "product_id"))
+        for index, (_, (product, _), _, variant) in enumerate(parsed):
+            if variant is not None and owners.get(variant) != product:
+                raise ValidationError(f"Operation {index} has a variant that is not one of product {product}'s")
+
+    with transaction.atomic():
+        existing = {
+            (line.product_id, line.size_id): line
+            for line in lines(customer_id).filter(product_id__in=product_ids).select_for_update()
+        }
+        quantities = {key: line.quantity for key, line in existing.items()}
+        variants = {key: line.variant_id for key, line in existing.items()}
+        for op, key, quantity, variant in parsed:
+            if op == "add":
+                quantities[key] = quantities.get(key, 0) + quantity
+            else:
+                quantities[key] = 0 if op == "remove" else quantity
+            if variant is not None:
+                variants[key] = variant
+
+        over = [key for key, quantity in quantities.items() if quantity > MAX_QUANTITY]
+        if over:
+            raise ValidationError(f"Total quantity cannot exceed {MAX_QUANTITY} (product {over[0][0]})")
+
+        created, updated, deleted = [], [], []
+        for key, quantity in quantities.items():
+            line = existing.get(key)
+            if line is None:
+                if quantity:
+                    created.append(models.CartItem(
+                        user_id=customer_id, product_id=key[0], size_id=key[1],
+                        variant_id=variants.get(key), quantity=quantity,
+                    ))
+            elif not quantity:
+                deleted.append(line.pk)
+            elif (line.quantity, line.variant_id) != (quantity, variants.get(key)):
+                line.quantity, line.variant_id = quantity, variants.get(key)
+                updated.append(line)
+
+        models.CartItem.objects.bulk_create(created)
+        models.CartItem.objects.bulk_update(updated, ["quantity", "variant"])
+        if deleted:
+            models.CartItem.objects.filter(pk__in=deleted).delete()
+    return len(created), len(updated), len(deleted)
@@ -0,0 +1,119 @@
+from django.db.models import Count
+
+from . import caching, models
+
+
+def annotated_categories():
+    """Categories with ``product_count`` filled in by one grouped query."""
+    return models.Category.objects.annotate(product_count=Count("products"))
+
+
+def build_category_tree():
+    """
+    Load every category in one query and assemble the nested tree in memory.
+
+    ``total_products`` on each node includes the products of all of its
+    subcategories; ``own_products`` counts only products filed directly
+    under it.
+    """
+    image_url = models.Category._meta.get_field("image").storage.url
+    rows = annotated_categories().order_by("name").values(
+        "id", "name", "slug", "image", "parent_id", "product_count"
+    )
+
+    nodes = {}
+    parents = {}
+    for row in rows:
+        nodes[row["id"]] = {
+            "id": row["id"],
+            "name": row["name"],
+            "slug": row["slug"],
+            "image": image_url(row["image"]) if row["image"] else None,
+            "own_products": row["product_count"],
+            "total_products": row["product_count"],
+            "children": [],
+        }
+        parents[row["id"]] = row["parent_id"]
+
+    roots = []
+    for category_id, node in nodes.items():
+        parent = nodes.get(parents[category_id])
+        (parent["children"] if parent else roots).append(node)
+
+    # Roll counts up from the leaves; an explicit stack keeps deep trees safe.
+    stack = [(node, False) for node in roots]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            node["total_products"] += sum(child["total_products"] for child in node["children"])
+            continue
+        stack.append((node, True))
+        stack.extend((child, False) for child in node["children"])
+
+    return {
+        "roots": roots,
+        "by_slug": {node["slug"]: node for node in nodes.values()},
+        "parents": {
+            nodes[category_id]["slug"]: nodes[parent_id]["slug"]
+            for category_id, parent_id in parents.items()
+            if parent_id in nodes
+        },
+    }
+
+
+def get_category_tree():
+    return caching.get_or_build(caching.CATALOG, "category_tree", build_category_tree)
+
+
+def get_subtree(slug):
+    """Return ``(node, ancestors)`` for ``slug`` or ``(None, [])`` if it doesn't exist."""
+    tree = get_category_tree()
+    node = tree["by_slug"].get(slug)
+    if node is None:
+        return None, []
+
+    ancestors = []
+    parent = tree["parents"].get(slug)
+    while parent is not None and len(ancestors) < len(tree["by_slug"]):
+        ancestor = tree["by_slug"][parent]
+        ancestors.append({"id": ancestor["id"], "name": ancestor["name"], "slug": ancestor["slug"]})
+        parent = tree["parents"].get(parent)
+    ancestors.reverse()
+    return node, ancestors
+
+
+def compute_paths(parents):
+    """
+    Materialized paths for ``{id: parent_id}``.
+
+    A parent cycle is cut where it closes, so the index is always a tree
+    even if the parent links are not.
+    """
+    paths = {}
+    for category_id in parents:
+        chain = []
+        current = category_id
+        while current is not None and current not in paths and current not in chain:
+            chain.append(current)
+            current = parents.get(current)
+        prefix = paths.get(current, "")
+        for node in reversed(chain):
+            prefix = f"{prefix}{node}/"
+            paths[node] = prefix
+    return paths
+
+
+def rebuild_paths(batch_size=500):
+    """Recompute ``Category.path``/``depth`` for every row; returns how many changed."""
+    categories = list(models.Category.objects.only("id", "parent_id", "path", "depth"))
+    paths = compute_paths({c.pk: c.parent_id for c in categories})
+
+    changed = []
+    for category in categories:
+        path = paths[category.pk]
+        depth = path.count("/") - 1
+        if (category.path, category.depth) != (path, depth):
+            category.path, category.depth = path, depth
+            changed.append(category)
+    models.Category.objects.bulk_update(changed, ["path", "depth"], batch_size=batch_size)
+    return len(changed)
@@ -0,0 +1,177 @@
+"""
+Turning a customer's cart into an order.
+
+Everything happens in one transaction:
+
+1. the customer's cart lines are locked, so the same cart can't be checked
+   out twice at once;
+2. the products and variants being bought are locked in primary-key order
+   (products first), so concurrent checkouts over overlapping items queue
+   up instead of deadlocking;
+3. stock is decremented with one conditional UPDATE per table whose WHERE
+   clause requires enough stock on every row, so if any row is short the
+   whole order is refused and nothing is decremented;
+4. the order is priced and its lines snapshotted (see pricing.py), and the
+   cart lines are deleted.
+
+Lines with a variant draw on ``ProductVariant.stock``; lines without one
+draw on ``Product.stock``. Orders paid online carry the gateway's payment id
+in ``Order.payment_reference``, which is unique, so replaying a payment
+returns the order it already created.
+
+``buy_now`` checks out a single product the same way from a line that is
+never saved, so the cart is left alone, even a line for the same product;
+``draft_order`` keeps the one unplaced order the product page's Buy Now
+shows, priced and snapshotted the same way but holding no stock.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from . import cart, models, pricing, trending
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__("Cart is empty")
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, names):
+        self.names = names
+        super().__init__(f"Not enough stock for {', '.join(names)}")
+
+
+def stock_demand(lines):
+    """``({product_id: qty}, {variant_id: qty})`` for cart line dicts."""
+    products, variants = {}, {}
+    for line in lines:
+        if line["variant_id"]:
+            variants[line["variant_id"]] = variants.get(line["variant_id"], 0) + line["quantity"]
+        else:
+            products[line["product_id"]] = products.get(line["product_id"], 0) + line["quantity"]
+    return products, variants
+
+
+def reserve(model, demand):
+    """
+    Lock ``model`` rows in id order and take ``demand`` ({pk: qty}) out of
+    their stock in one UPDATE; raises OutOfStock naming any short rows.
+    """
+    if not demand:
+        return
+    ids = sorted(demand)
+    list(model.objects.filter(pk__in=ids).order_by("pk").select_for_update().values_list("pk", flat=True))
+    enough = reduce(or_, (Q(pk=pk, stock__gte=qty) for pk, qty in demand.items()))
+    updated = model.objects.filter(enough).update(
+        stock=F("stock") - Case(*[When(pk=pk, then=Value(qty)) for pk, qty in demand.items()])
+    )
+    if updated != len(demand):
+        short = model.objects.filter(pk__in=ids).exclude(enough)
+        raise OutOfStock([str(row) for row in short])
+
+
+def place_order(customer, payment, status="pending", payment_reference=None, tracking_number=None):
+    """
+    Check out ``customer``'s cart; returns ``(order, created)``.
+
+    With a ``payment_reference`` that already has an order, that order is
+    returned with ``created=False`` and nothing else happens.
+    """
+    if payment_reference:
+        existing = models.Order.objects.filter(payment_reference=payment_reference).first()
+        if existing:
+            return existing, False
+    try:
+        with transaction.atomic():
+            return create_order(customer, payment, status, payment_reference, tracking_number), True
+    except IntegrityError:
+        # A concurrent request with the same payment id won the insert
+        if payment_reference:
+            existing = models.Order.objects.filter(payment_reference=payment_reference).first()
+            if existing:
+                return existing, False
+        raise
+
+
+def create_order(customer, payment, status, payment_reference, tracking_number):
+    lines = list(
+        models.CartItem.objects.filter(user=customer).select_for_update().order_by("id").values("id", "product_id", "variant_id", "quantity")
+    )
+    if not lines:
+        raise EmptyCart()
+
+    products, variants = stock_demand(lines)
+    reserve(models.Product, products)
+    reserve(models.ProductVariant, variants)
+
+    line_ids = [line["id"] for line in lines]
+    bought = models.CartItem.objects.filter(pk__in=line_ids)
+    order = models.Order.objects.create(
+        user=customer,
+        customer=customer,
+        status=status,
+        payment=payment,
+        payment_reference=payment_reference,
+        total_price=pricing.summarize(bought)["subtotal"],
+        tracking_number=tracking_number,
+    )
+    pricing.snapshot_order_items(order, bought)
+    trending.record_events([(line["product_id"], line["quantity"]) for line in lines], models.ProductEvent.ORDER)
+    bought.delete()
+    return order
+
+
+def buy_now(customer, product_id, size_id, quantity, payment="cod", status="pending", tracking_number=None):
+    """Check out ``quantity`` of one product on its own; returns the order."""
+    cart.check_quantity(quantity)
+    with transaction.atomic():
+        reserve(models.Product, {product_id: quantity})
+        line = models.CartItem(
+            user=customer, product=models.Product.objects.get(pk=product_id), size_id=size_id, quantity=quantity
+        )
+        order = models.Order.objects.create(
+            user=customer,
+            customer=customer,
+            status=status,
+            payment=payment,
+            total_price=line.price,
+            tracking_number=tracking_number,
+        )
+        pricing.snapshot_line(order, line)
+        trending.record_events([(product_id, quantity)], models.ProductEvent.ORDER)
+    return order
+
+
+def draft_order(customer, product_id, size_id):
+    """
+    The customer's one "not_placed" order, made to hold just one of this
+    product at today's price. Neither the cart nor stock is touched.
+    """
+    line = models.CartItem(
+        user=customer, product=models.Product.objects.get(pk=product_id), size_id=size_id, quantity=1
+    )
+    with transaction.atomic():
+        order = (
+            models.Order.objects.filter(customer=customer, status="not_placed")
+            .select_for_update()
+            .order_by("-id")
+            .first()
+        )
+        if order is None:
+            order = models.Order.objects.create(
+                user=customer, customer=customer, status="not_placed", total_price=line.price
+            )
+        else:
+            order.items.all().delete()
+            order.products.clear()
+            order.total_price = line.price
+            order.save(update_fields=["total_price"])
+        pricing.snapshot_line(order, line)
+    return order
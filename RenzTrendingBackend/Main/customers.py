@@ -0,0 +1,65 @@
+"""
+The ``Customer`` behind a request, as ``request.customer``.
+
+``Customer`` extends ``User`` (multi-table), so views used to re-fetch it with
+``Customer.objects.get(username=request.user.username)``: an unkeyed lookup
+through the join, repeated in every view. Now it is resolved once per request:
+
+* ``CachedTokenAuthentication`` already loads the token's user as its
+  ``Customer`` row and sets ``request.customer`` itself, at no extra cost;
+* for any other authentication (sessions in the browsable API and admin)
+  ``CustomerMiddleware`` sets a lazy ``request.customer`` that loads the row
+  by primary key the first time a view uses it, and never if none does.
+
+Views that need a customer are decorated with ``customer_required``, which
+answers the same 404 everywhere when the user has no ``Customer`` row.
+"""
+import functools
+
+from django.utils.functional import SimpleLazyObject
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import models
+
+
+def customer_of(user):
+    """The ``Customer`` row of ``user``, or ``None`` (anonymous, or staff without one)."""
+    if user is None or not user.is_authenticated:
+        return None
+    if isinstance(user, models.Customer):
+        return user
+    return models.Customer.objects.filter(pk=user.pk).first()
+
+
+class CustomerMiddleware:
+    """
+    Set a lazy ``request.customer``. Goes after ``AuthenticationMiddleware``;
+    it reads ``request.user`` only when evaluated, so inside a DRF view it sees
+    the user the API authentication settled on.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer = SimpleLazyObject(lambda: customer_of(request.user))
+        return self.get_response(request)
+
+
+def customer_required(view):
+    """
+    Answer 404 unless the request has a ``Customer``. Goes below
+    ``@permission_classes`` so it sees the authenticated user.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not hasattr(request, "customer"):
+            # Neither the authentication class nor the middleware ran (a bare request factory)
+            request._request.customer = customer_of(request.user)
+        customer = request.customer
+        if not isinstance(customer, models.Customer):
+            return Response({"error": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
+        return view(request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,131 @@
+import hashlib
+
+from django.db import connection
+from django.db.models import Count, Q
+
+from . import caching, models
+
+PRICE_BUCKETS = [(0, 500), (500, 1000), (1000, 2000), (2000, 5000), (5000, None)]
+
+# Facet name -> the ProductFilter params that facet's own selection is made with.
+# A facet is counted with its own params removed, so every value shows how many
+# products it would return when picked.
+FACET_PARAMS = {
+    "category": ["category"],
+    "color": ["color"],
+    "size": ["size"],
+    "product_type": ["product_type"],
+    "fit": ["fit"],
+    "sleeve": ["sleeve"],
+    "fabric": ["fabric"],
+    "price": ["min_price", "max_price"],
+}
+
+# Params that don't narrow the product set and must not split the cache.
+IGNORED_PARAMS = {"cursor", "page_size", "ordering", "facets"}
+
+
+def bucket_label(low, high):
+    return f"{low}+" if high is None else f"{low}-{high}"
+
+
+def count_field(products, field, label_field=None):
+    values = [field] + ([label_field] if label_field else [])
+    rows = (
+        products.exclude(**{f"{field}__isnull": True})
+        .values(*values)
+        .annotate(count=Count("id"))
+        .order_by("-count")
+    )
+    return [
+        {"value": row[field], "label": row[label_field] if label_field else row[field], "count": row["count"]}
+        for row in rows
+    ]
+
+
+def count_sizes(products):
+    rows = (
+        models.Product.avail_sizes.through.objects.filter(product__in=products)
+        .values("size_id", "size__size")
+        .annotate(count=Count("product_id", distinct=True))
+        .order_by("-count")
+    )
+    return [{"value": row["size_id"], "label": row["size__size"], "count": row["count"]} for row in rows]
+
+
+def count_fabrics(products):
+    subquery, params = products.order_by().values("id").query.sql_with_params()
+    table = models.Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT f.value, COUNT(*) FROM "{table}" p '
+            f"CROSS JOIN LATERAL unnest(p.fabric) AS f(value) "
+            f"WHERE p.id IN ({subquery}) GROUP BY f.value ORDER BY 2 DESC",
+            params,
+        )
+        return [{"value": value, "label": value, "count": count} for value, count in cursor.fetchall()]
+
+
+def count_prices(products):
+    counts = products.aggregate(**{
+        bucket_label(low, high): Count(
+            "id",
+            filter=Q(selling_price__gte=low) & (Q(selling_price__lt=high) if high is not None else Q()),
+        )
+        for low, high in PRICE_BUCKETS
+    })
+    return [
+        {"value": bucket_label(low, high), "min": low, "max": high, "count": counts[bucket_label(low, high)]}
+        for low, high in PRICE_BUCKETS
+    ]
+
+
+FACET_COUNTERS = {
+    "category": lambda products: count_field(products, "category_id", "category__name"),
+    "color": lambda products: count_field(products, "color_id", "color__color"),
+    "size": count_sizes,
+    "product_type": lambda products: count_field(products, "product_type"),
+    "fit": lambda products: count_field(products, "fit"),
+    "sleeve": lambda products: count_field(products, "sleeve"),
+    "fabric": count_fabrics,
+    "price": count_prices,
+}
+
+
+def compute_facets(filterset_class, data, queryset):
+    """
+    Facet counts for ``queryset`` filtered by ``data``: one grouped query per facet.
+    """
+    facets = {}
+    for facet, params in FACET_PARAMS.items():
+        facet_data = data.copy()
+        for param in params:
+            facet_data.pop(param, None)
+        filtered = filterset_class(facet_data, queryset=queryset).qs
+        products = models.Product.objects.filter(pk__in=filtered.values("pk"))
+        facets[facet] = FACET_COUNTERS[facet](products)
+    return facets
+
+
+def cache_key(data):
+    items = sorted(
+        (key, value)
+        for key in data
+        if key not in IGNORED_PARAMS
+        for value in data.getlist(key)
+    )
+    return f"facets:{hashlib.md5(repr(items).encode()).hexdigest()}"
+
+
+def get_facets(filterset_class, data, queryset):
+    """
+    Cached ``compute_facets``. Every request param except IGNORED_PARAMS is
+    part of the key, so params applied to ``queryset`` outside the filterset
+    (such as ``search``) are covered too.
+    """
+    return caching.get_or_build(
+        caching.CATALOG,
+        cache_key(data),
+        lambda: compute_facets(filterset_class, data, queryset),
+        timeout=60 * 5,
+    )
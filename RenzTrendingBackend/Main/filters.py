@@ -1,37 +1,37 @@
 import django_filters
-from django_filters import rest_framework as filters
 from .models import Product, Category, Color, Size
+from . import search
 
 class ProductFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(lookup_expr='icontains')
-    min_price = django_filters.NumberFilter(field_name="sellingPrice", lookup_expr='gte')
-    max_price = django_filters.NumberFilter(field_name="sellingPrice", lookup_expr='lte')
+    name = django_filters.CharFilter(method='filter_by_name')
+    min_price = django_filters.NumberFilter(field_name="selling_price", lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name="selling_price", lookup_expr='lte')
     category = django_filters.ModelChoiceFilter(queryset=Category.objects.all(), method='filter_by_category',field_name='category')
     color = django_filters.ModelChoiceFilter(queryset=Color.objects.all(), method='filter_by_color',field_name='color')
     size = django_filters.ModelChoiceFilter(queryset=Size.objects.all(), method='filter_by_size',field_name='size')
-    ordering = filters.OrderingFilter(
-        fields=(
-            ('name', 'name'),
-            ('sellingPrice', 'sellingPrice'),
-            ('stock', 'stock'),
-        ),
-        field_labels={
-            'name': 'Name',
-            'sellingPrice': 'Price',
-            'stock': 'Stock',
-        }
-    )
+    product_type = django_filters.CharFilter(field_name='product_type', lookup_expr='iexact')
+    fit = django_filters.CharFilter(field_name='fit', lookup_expr='iexact')
+    sleeve = django_filters.CharFilter(field_name='sleeve', lookup_expr='iexact')
+    fabric = django_filters.CharFilter(method='filter_by_fabric')
+    # Ordering is applied by pagination.ProductCursorPagination so cursors stay stable.
 
     class Meta:
         model = Product
-        fields = ['name', 'min_price', 'max_price', 'category', 'color', 'size']
+        fields = ['name', 'min_price', 'max_price', 'category', 'color', 'size', 'product_type', 'fit', 'sleeve', 'fabric']
+
+    def filter_by_name(self, queryset, name, value):
+        return search.match_products(queryset, value)
 
     def filter_by_category(self, queryset, name, value):
-        return queryset.filter(category=value)
+        # The category and all of its subcategories, via the materialized path index
+        return queryset.filter(**value.get_descendant_filter(prefix="category__"))
 
     def filter_by_color(self, queryset, name, value):
         return queryset.filter(color=value)
 
     def filter_by_size(self, queryset, name, value):
-        return queryset.filter(size__in=self.data.getlist('size')).distinct()
+        return queryset.filter(avail_sizes__in=self.data.getlist('size')).distinct()
+
+    def filter_by_fabric(self, queryset, name, value):
+        return queryset.filter(fabric__contains=[value])
 
@@ -0,0 +1,110 @@
+"""
+Request idempotency for endpoints that create orders or take payments.
+
+A client sends an ``Idempotency-Key`` header; the first request with a given
+``(user, key)`` runs the view and stores its status and body, and repeats
+within the TTL get that stored response back without the view running again.
+
+The key row is created and locked before the view runs, in the same
+transaction as the view's own writes. A concurrent duplicate therefore waits
+on that one row (not on the tables the view touches), and once the first
+request commits it sees the stored response. If the view fails with a 5xx,
+the transaction is rolled back, key included, so a retry runs afresh.
+"""
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import models
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def response_body(response):
+    if hasattr(response, "data"):
+        return response.data
+    return json.loads(response.content or b"null")
+
+
+def replay(record):
+    response = Response(record.response, status=record.status_code)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(view):
+    """
+    Make a function view idempotent per ``(request.user, Idempotency-Key)``.
+
+    Goes below ``@permission_classes`` so it sees the authenticated user.
+    Requests without the header, or from anonymous users, run as usual.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        now = timezone.now()
+        request_hash = fingerprint(request)
+        with transaction.atomic():
+            record, created = models.IdempotencyKey.objects.select_for_update().get_or_create(
+                user=request.user,
+                key=key,
+                defaults={"request_hash": request_hash, "expires_at": now + settings.IDEMPOTENCY_KEY_TTL},
+            )
+            if not created and record.expires_at > now:
+                if record.request_hash != request_hash:
+                    return Response(
+                        {"error": f"{HEADER} was already used for a different request"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record.status_code is not None:
+                    return replay(record)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code >= 500:
+                transaction.set_rollback(True)
+                return response
+
+            record.request_hash = request_hash
+            record.status_code = response.status_code
+            record.response = response_body(response)
+            record.expires_at = now + settings.IDEMPOTENCY_KEY_TTL
+            record.save(update_fields=["request_hash", "status_code", "response", "expires_at"])
+        return response
+
+    return wrapper
+
+
+def evict_expired(batch_size=5000):
+    """Delete expired keys in batches; returns how many were removed."""
+    removed = 0
+    while True:
+        ids = list(
+            models.IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += models.IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,115 @@
+"""
+Login identifiers.
+
+Customers log in with their username, email address or phone number. Email
+and phone have no index on ``auth_user`` / ``Main_customer``, so looking them
+up there scanned the tables. ``LoginIdentifier`` keeps every user's
+identifiers, normalized, under one index:
+
+* usernames as they are (Django usernames are case-sensitive);
+* email addresses lowercased;
+* phone numbers in E.164, whatever format they were typed in.
+
+``find_user`` resolves a login in one indexed query. Signals keep the rows in
+step with ``User`` and ``Customer`` saves (see signals.py); writes that skip
+signals (``QuerySet.update``, raw SQL, fixtures) need
+``manage.py rebuild_login_identifiers`` afterwards.
+
+Deploying: ``manage.py migrate`` fills the table for existing users when it
+is created (``backfill_login_identifiers`` in signals.py). Logins only work
+once that has finished. On a large user table, check that it ran before
+taking traffic, or run ``rebuild_login_identifiers`` by hand.
+"""
+import phonenumbers
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from . import models
+
+USERNAME = models.LoginIdentifier.USERNAME
+EMAIL = models.LoginIdentifier.EMAIL
+PHONE = models.LoginIdentifier.PHONE
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def normalize_phone(number):
+    """``number`` in E.164, or ``None`` if it is not a valid international number."""
+    try:
+        parsed = phonenumbers.parse(str(number), None)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(parsed):
+        return None
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+
+
+def candidates(login):
+    """``[(kind, value)]`` to look ``login`` up by, most preferred first."""
+    found = [(USERNAME, login)]
+    if "@" in login:
+        found.append((EMAIL, normalize_email(login)))
+    elif "+" in login and (phone := normalize_phone(login)):
+        found.append((PHONE, phone))
+    return found
+
+
+def find_user(login):
+    """
+    The user ``login`` names, or ``None``. A username wins over an email or
+    phone that happens to look like it; an email or phone shared by several
+    users names none of them.
+    """
+    wanted = candidates(login)
+    query = Q()
+    for kind, value in wanted:
+        query |= Q(kind=kind, value=value)
+    # "username" sorts after "phone" and "email", so a username match comes first
+    rows = models.LoginIdentifier.objects.select_related("user").filter(query).order_by("-kind")[:3]
+    users = {}
+    for row in rows:
+        users.setdefault(row.kind, []).append(row.user)
+    for kind, _ in wanted:
+        if kind in users:
+            return users[kind][0] if len(users[kind]) == 1 else None
+    return None
+
+
+def identifiers_of(user_id, username, email, phone):
+    found = [(USERNAME, username)]
+    if email:
+        found.append((EMAIL, normalize_email(email)))
+    if phone and (phone := normalize_phone(phone)):
+        found.append((PHONE, phone))
+    return [models.LoginIdentifier(user_id=user_id, kind=kind, value=value) for kind, value in found]
+
+
+def sync(user):
+    """Replace ``user``'s identifiers with their current username, email and phone."""
+    if isinstance(user, models.Customer):
+        phone = user.phone
+    else:
+        phone = models.Customer.objects.filter(pk=user.pk).values_list("phone", flat=True).first()
+    with transaction.atomic():
+        models.LoginIdentifier.objects.filter(user_id=user.pk).delete()
+        models.LoginIdentifier.objects.bulk_create(identifiers_of(user.pk, user.username, user.email, phone))
+
+
+def rebuild(batch_size=5000):
+    """Recreate every user's identifiers; returns how many were written."""
+    users = User.objects.order_by("pk").values_list("pk", "username", "email", "customer__phone")
+    written = 0
+    batch = []
+    with transaction.atomic():
+        models.LoginIdentifier.objects.all().delete()
+        for user_id, username, email, phone in users.iterator(chunk_size=batch_size):
+            batch.extend(identifiers_of(user_id, username, email, phone))
+            if len(batch) >= batch_size:
+                models.LoginIdentifier.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        models.LoginIdentifier.objects.bulk_create(batch)
+    return written + len(batch)
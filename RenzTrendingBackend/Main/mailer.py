@@ -0,0 +1,186 @@
+"""
+Outbound mail queue.
+
+Request handlers call ``enqueue`` (with bodies rendered by notifications.py,
+say), which only inserts an ``EmailJob`` row. ``run_mail_worker`` starts a
+pool of worker threads; each claims batches of due jobs with ``SELECT ...
+FOR UPDATE SKIP LOCKED``, so workers never pick the same job, and sends them
+over one SMTP connection that it opens and authenticates once and keeps for
+as long as it works.
+
+A failed send is retried with exponential backoff (``MAIL_RETRY_DELAY``
+doubling per attempt, capped at ``MAIL_MAX_RETRY_DELAY``) until
+``MAIL_MAX_ATTEMPTS``; a refused recipient fails at once. Jobs left in
+"sending" by a worker that died are picked up again after
+``MAIL_LOCK_TIMEOUT``. So that a live worker's jobs are never taken over,
+each outcome is saved as soon as that job is sent, and batches are kept
+small enough to finish within the lock timeout even if every send times out.
+"""
+import logging
+import random
+import smtplib
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Errors that retrying won't fix
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+def enqueue(to_email, subject, html_body="", text_body="", from_email=""):
+    return models.EmailJob.objects.create(
+        to_email=to_email,
+        subject=subject,
+        html_body=html_body,
+        text_body=text_body,
+        from_email=from_email,
+    )
+
+
+def retry_delay(attempts):
+    delay = settings.MAIL_RETRY_DELAY * 2 ** (attempts - 1)
+    delay = min(delay, settings.MAIL_MAX_RETRY_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def max_batch_size():
+    """The largest batch that finishes within MAIL_LOCK_TIMEOUT if every send takes EMAIL_TIMEOUT."""
+    return max(1, int(settings.MAIL_LOCK_TIMEOUT.total_seconds() // settings.EMAIL_TIMEOUT) - 1)
+
+
+def claim(batch_size):
+    """Mark up to ``batch_size`` due jobs (capped by ``max_batch_size``) as sending and return them."""
+    batch_size = min(batch_size, max_batch_size())
+    now = timezone.now()
+    stale = now - settings.MAIL_LOCK_TIMEOUT
+    with transaction.atomic():
+        jobs = list(
+            models.EmailJob.objects.filter(
+                Q(status=models.EmailJob.QUEUED, available_at__lte=now)
+                | Q(status=models.EmailJob.SENDING, locked_at__lt=stale)
+            )
+            .order_by("id")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if jobs:
+            models.EmailJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=models.EmailJob.SENDING, locked_at=now
+            )
+    return jobs
+
+
+def build_message(job):
+    message = EmailMultiAlternatives(
+        subject=job.subject,
+        body=job.text_body,
+        from_email=job.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=[job.to_email],
+    )
+    if job.html_body:
+        message.attach_alternative(job.html_body, "text/html")
+    return message
+
+
+class Sender:
+    """One worker's SMTP connection: opened on first use, reused until it breaks."""
+
+    def __init__(self):
+        self.connection = None
+
+    def send(self, message):
+        if self.connection is None:
+            self.connection = get_connection(settings.MAIL_QUEUE_BACKEND, fail_silently=False)
+            self.connection.open()
+        message.connection = self.connection
+        try:
+            message.send()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+def deliver(jobs, sender):
+    """Send claimed ``jobs``, saving each outcome as it happens; returns how many were sent."""
+    sent = 0
+    for job in jobs:
+        job.attempts += 1
+        job.locked_at = None
+        try:
+            sender.send(build_message(job))
+        except Exception as error:
+            job.last_error = f"{type(error).__name__}: {error}"
+            if isinstance(error, PERMANENT_ERRORS) or job.attempts >= settings.MAIL_MAX_ATTEMPTS:
+                job.status = models.EmailJob.FAILED
+            else:
+                job.status = models.EmailJob.QUEUED
+                job.available_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            logger.warning("Email job %s failed (attempt %s): %s", job.pk, job.attempts, job.last_error)
+        else:
+            job.status = models.EmailJob.SENT
+            job.sent_at = timezone.now()
+            job.last_error = ""
+            sent += 1
+        job.save(update_fields=["attempts", "status", "available_at", "locked_at", "sent_at", "last_error"])
+    return sent
+
+
+def work(stop, batch_size=50, poll_interval=2.0, drain=False):
+    """
+    One worker loop: claim, send, repeat, sleeping ``poll_interval`` when idle.
+    Stops when ``stop`` is set, or with ``drain`` as soon as nothing is due.
+    """
+    sender = Sender()
+    sent = 0
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            jobs = claim(batch_size)
+            if jobs:
+                sent += deliver(jobs, sender)
+                continue
+            if drain:
+                break
+            stop.wait(poll_interval)
+    finally:
+        sender.close()
+        connection.close()
+    return sent
+
+
+def run_workers(workers=2, batch_size=50, poll_interval=2.0, drain=False, stop=None):
+    """Run ``workers`` threads of ``work`` until ``stop`` is set (or drained); returns how many were sent."""
+    stop = stop or threading.Event()
+    totals = []
+
+    def target():
+        totals.append(work(stop, batch_size, poll_interval, drain))
+
+    threads = [threading.Thread(target=target, name=f"mail-worker-{index}") for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return sum(totals)
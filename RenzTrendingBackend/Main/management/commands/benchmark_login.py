@@ -0,0 +1,84 @@
+import random
+import time
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from Main import identifiers, models
+
+PASSWORD = "benchmark-pass-123"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic users inside a rolled-back transaction and time login lookups "
+        "as the user count grows: the LoginIdentifier probe against the old email lookup "
+        "on auth_user, and a full authenticate() for a hit and a miss"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--runs", type=int, default=200, help="Lookups timed per login kind")
+        parser.add_argument("--logins", type=int, default=5, help="Full authenticate() calls timed")
+        parser.add_argument("--batch-size", type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        # One hash for everyone; hashing a million passwords would take hours
+        self.password = make_password(PASSWORD)
+        with transaction.atomic():
+            seeded = 0
+            for size in sorted(options["sizes"]):
+                seeded = self.seed(seeded, size, options["batch_size"])
+                with connection.cursor() as cursor:
+                    for model in (User, models.LoginIdentifier):
+                        cursor.execute(f"ANALYZE {model._meta.db_table}")
+                self.report(size, options["runs"], options["logins"])
+            transaction.set_rollback(True)
+
+    def seed(self, start, stop, batch_size):
+        for offset in range(start, stop, batch_size):
+            users = User.objects.bulk_create([
+                User(username=f"bench-{index}", email=f"Bench.{index}@Example.com", password=self.password)
+                for index in range(offset, min(offset + batch_size, stop))
+            ])
+            rows = []
+            for user in users:
+                index = int(user.username.split("-")[1])
+                # Customers can't be bulk-created (multi-table), so phones go straight into the index
+                rows.extend(identifiers.identifiers_of(user.pk, user.username, user.email, f"+9198{index:08d}"))
+            models.LoginIdentifier.objects.bulk_create(rows)
+        return stop
+
+    def time(self, runs, lookup, logins):
+        timings = []
+        for _ in range(runs):
+            login = random.choice(logins)
+            started = time.perf_counter()
+            lookup(login)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+    def report(self, size, runs, logins):
+        sample = random.sample(range(size), min(size, 1000))
+        kinds = {
+            "username": [f"bench-{index}" for index in sample],
+            "email": [f"bench.{index}@example.com" for index in sample],
+            "phone": [f"+91 98{index:08d}" for index in sample],
+            "unknown": [f"nobody-{index}@example.com" for index in sample],
+        }
+        for kind, values in kinds.items():
+            p50, p99 = self.time(runs, identifiers.find_user, values)
+            self.stdout.write(f"{size:>9} users  {kind:<9} identifier p50 {p50:7.3f} ms  p99 {p99:7.3f} ms")
+        # The lookup the old backend did for email logins (case-sensitive, no index)
+        p50, p99 = self.time(
+            max(runs // 10, 1), lambda email: User.objects.filter(email=email).first(),
+            [f"Bench.{index}@Example.com" for index in sample],
+        )
+        self.stdout.write(f"{size:>9} users  {'email':<9} auth_user  p50 {p50:7.3f} ms  p99 {p99:7.3f} ms")
+        for kind, values in (("hit", kinds["email"]), ("miss", kinds["unknown"])):
+            p50, p99 = self.time(logins, lambda login: authenticate(username=login, password=PASSWORD), values)
+            self.stdout.write(f"{size:>9} users  {kind:<9} authenticate p50 {p50:7.1f} ms  p99 {p99:7.1f} ms")
@@ -0,0 +1,47 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Main import notifications
+
+
+class Command(BaseCommand):
+    help = "Render synthetic order emails (HTML and text) from snapshots and report emails per second"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--emails", type=int, default=10000)
+        parser.add_argument("--lines", type=int, default=3, help="Order lines per email")
+
+    def handle(self, *args, **options):
+        snapshots = [self.snapshot(index, options["lines"]) for index in range(options["emails"])]
+        started = time.perf_counter()
+        for snapshot in snapshots:
+            notifications.order_confirmation(snapshot)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{len(snapshots)} emails x {options['lines']} lines in {elapsed:.2f}s: "
+            f"{len(snapshots) / elapsed:,.0f} emails/s, {elapsed * 1e6 / len(snapshots):.1f} us/email"
+        )
+
+    def snapshot(self, index, lines):
+        price = Decimal("799.00")
+        return notifications.OrderSnapshot(
+            order_id=index,
+            customer_name=f"Customer {index}",
+            email=f"customer{index}@example.com",
+            status="confirmed",
+            ordered_at=timezone.now(),
+            total=price * 2 * lines,
+            lines=tuple(
+                notifications.OrderLine(
+                    name=f"Cotton Shirt {line}", quantity=2, unit_price=price, line_total=price * 2,
+                    size="M", sku=f"SKU-{index}-{line}",
+                )
+                for line in range(lines)
+            ),
+            address="12 MG Road, Bengaluru",
+            phone="+919876543210",
+            landmark="Near the metro",
+        )
@@ -0,0 +1,79 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from Main import models, search
+
+WORDS = [
+    "cotton", "linen", "denim", "slim", "regular", "oversized", "printed", "striped",
+    "checked", "polo", "shirt", "tshirt", "kurta", "jeans", "chinos", "hoodie",
+    "jacket", "summer", "casual", "formal", "navy", "black", "white", "olive",
+]
+QUERIES = ["cotton shirt", "denim", "slim chinos", "oversized hoodie", "polo"]
+TYPO_QUERIES = ["coton", "hodie", "chnos"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic products inside a rolled-back transaction and compare "
+        "name__icontains against the ranked full-text search"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            category = models.Category.objects.create(name="Benchmark", slug="benchmark-search")
+            seeded = 0
+            for size in sorted(options["sizes"]):
+                seeded = self.seed(category, seeded, size, options["batch_size"])
+                with connection.cursor() as cursor:
+                    cursor.execute(f"ANALYZE {models.Product._meta.db_table}")
+                self.report(size, options["runs"])
+            transaction.set_rollback(True)
+
+    def seed(self, category, start, stop, batch_size):
+        for offset in range(start, stop, batch_size):
+            batch = []
+            for index in range(offset, min(offset + batch_size, stop)):
+                words = random.sample(WORDS, 4)
+                batch.append(models.Product(
+                    name=" ".join(words[:3]),
+                    slug=f"benchmark-search-{index}",
+                    description=" ".join(random.sample(WORDS, 8)),
+                    category=category,
+                    brand=random.choice(["Renz", "Aslam", "Titan"]),
+                    tags=words[2:],
+                    fabric=[random.choice(["cotton", "linen", "polyester"])],
+                    market_price=1000,
+                    selling_price=800,
+                ))
+            created = models.Product.objects.bulk_create(batch)
+            search.refresh_search_vectors(
+                models.Product.objects.filter(pk__in=[p.pk for p in created])
+            )
+        return stop
+
+    def time(self, runs, build):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            list(build()[:24])
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2]
+
+    def report(self, size, runs):
+        products = models.Product.objects.all()
+        for text in QUERIES + TYPO_QUERIES:
+            icontains = self.time(runs, lambda: products.filter(name__icontains=text))
+            ranked = self.time(runs, lambda: search.search_products(products, text))
+            self.stdout.write(
+                f"{size:>9} products  {text!r:<20} icontains {icontains:8.2f} ms"
+                f"   search {ranked:8.2f} ms"
+            )
@@ -0,0 +1,113 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Main import models, read_models, serializers
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a customer with cart lines, orders and wishlist items inside a "
+        "rolled-back transaction and compare the planned serializers with the "
+        "compact read path, per item"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=200)
+        parser.add_argument("--runs", type=int, default=5)
+
+    def handle(self, *args, **options):
+        count = options["items"]
+        with transaction.atomic():
+            customer = self.seed(count)
+            orders = models.Order.objects.filter(customer=customer).order_by("-created_at")
+            cases = [
+                (
+                    "cart",
+                    lambda: serializers.CartItemDetailSerializer(
+                        serializers.CartItemDetailSerializer.setup_queryset(
+                            models.CartItem.objects.filter(user=customer)
+                        ),
+                        many=True,
+                    ).data,
+                    lambda: read_models.cart_lines(customer.pk),
+                ),
+                (
+                    "orders",
+                    lambda: serializers.OrderSerializer(
+                        serializers.OrderSerializer.setup_queryset(orders), many=True
+                    ).data,
+                    lambda: read_models.order_summaries(orders),
+                ),
+                (
+                    "wishlist",
+                    lambda: serializers.WishlistItemSerializer(
+                        serializers.WishlistItemSerializer.setup_queryset(
+                            models.WishlistItem.objects.filter(wishlist__user=customer)
+                        ),
+                        many=True,
+                    ).data,
+                    lambda: read_models.wishlist_items(customer.pk),
+                ),
+            ]
+            for name, full, compact in cases:
+                full_ms = self.time(options["runs"], full)
+                compact_ms = self.time(options["runs"], compact)
+                self.stdout.write(
+                    f"{name:<9} {count} items  serializer {full_ms * 1000 / count:8.1f} us/item"
+                    f"   compact {compact_ms * 1000 / count:8.1f} us/item"
+                )
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        customer = models.Customer.objects.create_user(
+            username="benchmark-serializers", email="benchmark@example.com", password="unused"
+        )
+        category = models.Category.objects.create(name="Benchmark", slug="benchmark-serializers")
+        sizes = [models.Size.objects.create(size=size) for size, _ in models.Size.size_opt]
+        products = models.Product.objects.bulk_create([
+            models.Product(
+                name=f"Benchmark {index}", slug=f"benchmark-serializers-{index}", category=category,
+                market_price=1000, selling_price=800, size=sizes[0],
+            )
+            for index in range(count)
+        ])
+        models.ProductImage.objects.bulk_create([
+            models.ProductImage(product=product, image=f"product_images/benchmark-{product.pk}.jpg")
+            for product in products
+        ])
+        models.Product.avail_sizes.through.objects.bulk_create([
+            models.Product.avail_sizes.through(product=product, size=size)
+            for product in products
+            for size in sizes
+        ])
+        variants = models.ProductVariant.objects.bulk_create([
+            models.ProductVariant(product=product, sku=f"benchmark-{product.pk}", price=750)
+            for product in products
+        ])
+        models.CartItem.objects.bulk_create([
+            models.CartItem(user=customer, product=product, variant=variant, size=sizes[1])
+            for product, variant in zip(products, variants)
+        ])
+        orders = models.Order.objects.bulk_create([
+            models.Order(user=customer, customer=customer, total_price=750) for _ in products
+        ])
+        models.OrderItem.objects.bulk_create([
+            models.OrderItem(order=order, variant=variant, quantity=1, price=750)
+            for order, variant in zip(orders, variants)
+        ])
+        wishlist = models.Wishlist.objects.create(user=customer)
+        models.WishlistItem.objects.bulk_create([
+            models.WishlistItem(wishlist=wishlist, product=product) for product in products
+        ])
+        return customer
+
+    def time(self, runs, build):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            build()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2]
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from Main import models
+from Main.authentications import CachedTokenAuthentication, token_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/s and queries per request of an authenticated no-op view "
+        "under DRF TokenAuthentication and CachedTokenAuthentication"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--users", type=int, default=50, help="Distinct tokens to cycle through")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tokens = self.seed(options["users"])
+            factory = APIRequestFactory()
+            requests = [
+                factory.get("/benchmark/", HTTP_AUTHORIZATION=f"Token {tokens[index % len(tokens)]}")
+                for index in range(options["requests"])
+            ]
+            for authentication in (TokenAuthentication, CachedTokenAuthentication):
+                token_cache.local.clear()
+                token_cache.invalidate(tokens)
+                view = self.view(authentication)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for request in requests:
+                        view(request)
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{authentication.__name__:<27} {len(requests) / elapsed:10,.0f} req/s"
+                    f"   {len(queries) / len(requests):.2f} queries/request"
+                )
+            token_cache.invalidate(tokens)
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        customers = [
+            models.Customer.objects.create(username=f"benchmark-auth-{index}", phone="+919876543210")
+            for index in range(count)
+        ]
+        return [Token.objects.get_or_create(user=customer)[0].key for customer in customers]
+
+    def view(self, authentication):
+        class Benchmark(APIView):
+            authentication_classes = [authentication]
+            permission_classes = [IsAuthenticated]
+
+            def get(self, request):
+                return Response({"username": request.user.username})
+
+        return Benchmark.as_view()
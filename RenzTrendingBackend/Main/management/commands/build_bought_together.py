@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from Main import bought_together
+
+
+class Command(BaseCommand):
+    help = "Mine order history for products that are frequently bought together"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Rebuild from the first order instead of the checkpoint")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Orders read per chunk")
+        parser.add_argument("--top-k", type=int, default=10, help="Pairs kept per product")
+
+    def handle(self, *args, **options):
+        last_order = bought_together.build_affinities(
+            full=options["full"], chunk_size=options["chunk_size"], k=options["top_k"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Affinities current up to order {last_order}"))
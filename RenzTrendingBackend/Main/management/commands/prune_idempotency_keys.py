@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from Main import idempotency
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records whose replay window has passed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        removed = idempotency.evict_expired(batch_size=options["batch_size"])
+        self.stdout.write(f"Removed {removed} expired idempotency keys")
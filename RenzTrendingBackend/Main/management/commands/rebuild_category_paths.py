@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Main import categories
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized path index on Category from the parent links"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = categories.rebuild_paths()
+        self.stdout.write(self.style.SUCCESS(f"Updated paths for {changed} categories"))
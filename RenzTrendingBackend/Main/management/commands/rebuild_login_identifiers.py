@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from Main import identifiers
+
+
+class Command(BaseCommand):
+    help = "Recreate the LoginIdentifier index from every user's username, email and phone"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        written = identifiers.rebuild(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} login identifiers"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from Main import recommendations
+
+
+class Command(BaseCommand):
+    help = "Score related products and rewrite the RelatedProduct neighbour table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=12, help="Neighbours kept per product")
+        parser.add_argument("--window", type=int, default=200, help="Candidates compared per shared feature")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        written = recommendations.rebuild_related_products(
+            top_k=options["top_k"], window=options["window"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} related product rows"))
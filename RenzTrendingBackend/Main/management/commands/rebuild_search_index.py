@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from Main import search
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.search_vector for every product"
+
+    def handle(self, *args, **options):
+        updated = search.refresh_search_vectors()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search vectors for {updated} products"))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Main import payments, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply stored payment webhooks, then sweep unpaid payment intents against "
+        "the gateway; with --interval, keep doing so"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--no-sweep", action="store_true", help="Only process stored webhook events")
+        parser.add_argument("--interval", type=float, default=0, help="Seconds between runs; 0 runs once")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            events = reconcile.process_all(batch_size=options["batch_size"])
+            message = f"Processed {events} payment events"
+            if not options["no_sweep"]:
+                try:
+                    settled, expired = reconcile.sweep()
+                    message += f"; sweep settled {settled} payments and expired {expired} intents"
+                except payments.GatewayUnavailable as error:
+                    message += f"; sweep skipped: {error}"
+            self.stdout.write(message)
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
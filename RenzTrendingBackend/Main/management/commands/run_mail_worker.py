@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from Main import mailer
+
+
+class Command(BaseCommand):
+    help = "Send queued email from a pool of workers, each holding one SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument(
+            "--batch-size", type=int, default=50,
+            help="Capped so a batch finishes within MAIL_LOCK_TIMEOUT even if every send times out",
+        )
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--drain", action="store_true", help="Exit once no job is due instead of polling")
+
+    def handle(self, *args, **options):
+        sent = mailer.run_workers(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            drain=options["drain"],
+        )
+        self.stdout.write(f"Sent {sent} emails")
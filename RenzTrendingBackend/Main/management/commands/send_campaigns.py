@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from Main import campaigns
+
+
+class Command(BaseCommand):
+    help = "Send queued newsletter campaigns in rate-limited batches over one SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--rate", type=float, default=None, help="Messages per second (0 for no limit)")
+
+    def handle(self, *args, **options):
+        sent = campaigns.send_pending(batch_size=options["batch_size"], rate=options["rate"])
+        self.stdout.write(f"Sent {sent} campaign emails")
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Main import trending
+
+
+class Command(BaseCommand):
+    help = "Fold new product events into the time-decayed trending scores"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--loop", type=int, metavar="SECONDS", help="Keep running, sleeping this long between passes")
+
+    def handle(self, *args, **options):
+        while True:
+            applied = trending.apply_events(batch_size=options["batch_size"])
+            self.stdout.write(f"Applied {applied} events")
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils import timezone
 from django.urls import reverse
@@ -8,6 +12,7 @@ from django.utils.text import slugify
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
 import re
 
 
@@ -115,16 +120,54 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Materialized path of ancestor ids, e.g. "1/4/9/" for Men > Topwear > Shirts.
+    # Maintained by save(); rebuild with `manage.py rebuild_category_paths`.
+    path = models.CharField(max_length=255, blank=True, default="", editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Work from the stored path: this instance may predate a move of an ancestor.
+            stored = Category.objects.filter(pk=self.pk).values_list("path", "depth").first() if self.pk else None
+            self.path, self.depth = stored or ("", 0)
+            parent_path = ""
+            if self.parent_id:
+                parent_path = Category.objects.filter(pk=self.parent_id).values_list("path", flat=True).get()
+                if self.path and parent_path.startswith(self.path):
+                    raise ValidationError(_("A category cannot be moved under itself or its subcategories."))
+            super().save(*args, **kwargs)
+            self.move_path(f"{parent_path}{self.pk}/")
+
+    def move_path(self, new_path):
+        """Store ``new_path`` for this category and re-root every descendant under it."""
+        old_path, old_depth = self.path, self.depth
+        new_depth = new_path.count("/") - 1
+        if new_path == old_path:
+            return
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr("path", len(old_path) + 1)),
+                depth=F("depth") + (new_depth - old_depth),
+            )
+        self.path, self.depth = new_path, new_depth
 
     def __str__(self):
         return self.name
 
+    def get_descendant_filter(self, prefix=""):
+        """Lookup kwargs matching this category and everything below it."""
+        if not self.path:
+            return {f"{prefix}pk": self.pk}
+        return {f"{prefix}path__startswith": self.path}
+
     @property
     def total_products(self) -> int:
+        # Set by categories.annotated_categories() to avoid a COUNT per row
+        if hasattr(self, 'product_count'):
+            return self.product_count
         if hasattr(self, 'products'):
             return self.products.count()
         return 0
@@ -133,6 +176,8 @@ class Category(models.Model):
         verbose_name_plural = "Categories"
         indexes = [
             models.Index(fields=['slug']),
+            # varchar_pattern_ops lets path LIKE 'prefix%' use a range scan
+            models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
         ]
 
 
@@ -222,6 +267,8 @@ class Product(models.Model):
     # Additional attributes
     rating = models.FloatField(default=0)
     buy_count = models.PositiveIntegerField(default=0)
+    # Time-decayed popularity, scaled to a fixed epoch; see trending.py
+    trending_score = models.FloatField(default=0, editable=False)
     tags = ArrayField(models.CharField(max_length=200), blank=True, null=True, default=list)
     fabric = ArrayField(models.CharField(max_length=200), blank=True, null=True, default=list)
     gsm = models.FloatField(null=True, blank=True, help_text="Thickness of the material")
@@ -230,6 +277,9 @@ class Product(models.Model):
     fit = models.CharField(max_length=50, blank=True, null=True)
     ideal_for = models.CharField(max_length=50, blank=True, null=True)
     net_weight = models.FloatField(null=True, blank=True, help_text="Net weight in grams")
+
+    # Maintained by signals.update_product_search_vector, see search.py
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -265,6 +315,14 @@ class Product(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['slug']),
+            # Keyset pagination: one (ordering field, id) index per cursor ordering
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['selling_price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['stock', 'id'], name='product_stock_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(fields=['name'], name='product_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['trending_score', 'id'], name='product_trending_id_idx'),
         ]
         ordering = ["-created_at"]
 
@@ -311,6 +369,69 @@ class ProductGroup(models.Model):
         verbose_name_plural = "Product Groups"
 
 
+class RelatedProduct(models.Model):
+    """Precomputed neighbour of a product, written by recommendations.rebuild_related_products."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbours')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_from')
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.score:.2f})"
+
+    class Meta:
+        unique_together = ('product', 'related')
+        indexes = [
+            models.Index(fields=['product', '-score'], name='related_product_score_idx'),
+        ]
+
+
+class ProductAffinity(models.Model):
+    """How often two products were ordered together, top pairs only; see bought_together.py."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='affinities')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='affinity_from')
+    count = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id} (x{self.count})"
+
+    class Meta:
+        verbose_name_plural = "Product Affinities"
+        unique_together = ('product', 'other')
+        indexes = [
+            models.Index(fields=['product', '-count'], name='product_affinity_count_idx'),
+        ]
+
+
+class ProductEvent(models.Model):
+    """Append-only popularity signal, folded into Product.trending_score by trending.apply_events."""
+    VIEW = "view"
+    WISHLIST = "wishlist"
+    ORDER = "order"
+    KIND_CHOICES = [
+        (VIEW, "View"),
+        (WISHLIST, "Wishlist add"),
+        (ORDER, "Order"),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} of {self.product_id} at {self.created_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'], name='productevent_unapplied_idx', condition=models.Q(applied_at__isnull=True)
+            ),
+        ]
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -320,6 +441,10 @@ class Cart(models.Model):
         return f"Cart of {self.user.username}"
 
 
+# Most a cart line may hold; cart.py enforces it and cartitem_quantity_cap backs it up
+CART_MAX_QUANTITY = 20
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items', null=True, blank=True)
     user = models.ForeignKey(Customer, on_delete=models.CASCADE, null=True, blank=True)
@@ -334,12 +459,24 @@ class CartItem(models.Model):
 
     @property
     def price(self):
+        # Use the annotation from pricing.priced() when it's there
+        if hasattr(self, 'line_total'):
+            return self.line_total
         if self.variant:
             return self.variant.price * self.quantity
         return self.product.selling_price * self.quantity
 
     class Meta:
         unique_together = ('cart', 'variant')
+        constraints = [
+            # One line per (customer, product, size); cart.add upserts on it.
+            models.UniqueConstraint(
+                fields=['user', 'product', 'size'],
+                name='cartitem_user_product_size_uniq',
+                nulls_distinct=False,
+            ),
+            models.CheckConstraint(condition=models.Q(quantity__lte=CART_MAX_QUANTITY), name='cartitem_quantity_cap'),
+        ]
 
 
 class Order(models.Model):
@@ -373,6 +510,8 @@ class Order(models.Model):
     order_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='Pending')
     payment = models.CharField(max_length=200, choices=PAYMENT_CHOICES, default="cod")
+    # Gateway payment id; unique so a replayed payment can't create a second order
+    payment_reference = models.CharField(max_length=100, unique=True, null=True, blank=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
     carrier = models.CharField(max_length=200, blank=True, null=True)
@@ -393,7 +532,8 @@ class Order(models.Model):
 
     @property
     def cart_total(self):
-        return sum(item.price for item in self.products.all())
+        # total_price is fixed when the order is placed, see pricing.snapshot_order_items
+        return self.total_price
 
     @property
     def is_delivered(self):
@@ -401,7 +541,7 @@ class Order(models.Model):
 
     @property
     def total_products(self):
-        return self.products.aggregate(models.Sum("quantity"))["quantity__sum"] or 0
+        return self.items.aggregate(models.Sum("quantity"))["quantity__sum"] or 0
 
     class Meta:
         indexes = [
@@ -411,12 +551,19 @@ class Order(models.Model):
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='order_items')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, related_name='order_items', null=True, blank=True)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.SET_NULL, related_name='order_items', null=True, blank=True)
+
+    # Snapshot taken when the order is placed; never recomputed from live prices
+    name = models.CharField(max_length=255, blank=True)
+    sku = models.CharField(max_length=100, blank=True)
+    size = models.CharField(max_length=50, blank=True)
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
-    price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], help_text="Unit price")
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, validators=[MinValueValidator(0)])
 
     def __str__(self):
-        return f"{self.quantity} x {self.variant.product.name}"
+        return f"{self.quantity} x {self.name}"
 
 
 class Payment(models.Model):
@@ -495,4 +642,227 @@ class Subscription(models.Model):
         return self.email
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+class BatchCheckpoint(models.Model):
+    """High-water mark of an incremental batch job, e.g. the last order id it processed."""
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class IdempotencyKey(models.Model):
+    """A client's Idempotency-Key and the response it got; see idempotency.py."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} for {self.user_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+
+
+class EmailJob(models.Model):
+    """An outgoing email waiting for, or sent by, the mail workers; see mailer.py."""
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField()
+    from_email = models.CharField(max_length=255, blank=True)
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Not picked up before this time")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.to_email} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at', 'id'], name='emailjob_pickup_idx'),
+        ]
+
+
+class EmailCampaign(models.Model):
+    """
+    One newsletter send. Recipients are materialised as CampaignRecipient
+    rows (from the selected or all active subscriptions) and sent in batches
+    by ``manage.py send_campaigns``; see campaigns.py.
+    """
+    DRAFT = 'draft'
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    PAUSED = 'paused'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (DRAFT, 'Draft'),
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (PAUSED, 'Paused'),
+        (DONE, 'Done'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    all_subscribers = models.BooleanField(default=False, help_text="Send to every active subscription when started")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=DRAFT)
+    total = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.subject
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 0
+        return round(100 * (self.sent_count + self.failed_count) / self.total)
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class CampaignRecipient(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    campaign = models.ForeignKey(EmailCampaign, on_delete=models.CASCADE, related_name='recipients')
+    email = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.email} ({self.status})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'email'], name='campaignrecipient_campaign_email_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'status', 'id'], name='campaignrecipient_pickup_idx'),
+        ]
+
+
+class PaymentIntent(models.Model):
+    """
+    A gateway order created for a customer's checkout. It lets a payment that
+    reaches us only by webhook or sweep be matched to the customer and turned
+    into an Order; see reconcile.py.
+    """
+    CREATED = 'created'
+    PAID = 'paid'
+    FAILED = 'failed'
+    EXPIRED = 'expired'
+    NEEDS_REVIEW = 'needs_review'
+    STATUS_CHOICES = [
+        (CREATED, 'Created'),
+        (PAID, 'Paid'),
+        (FAILED, 'Failed'),
+        (EXPIRED, 'Expired'),
+        (NEEDS_REVIEW, 'Needs review'),
+    ]
+
+    user = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='payment_intents')
+    gateway_order_id = models.CharField(max_length=100, unique=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    currency = models.CharField(max_length=3, default='INR')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=CREATED)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_intents')
+    note = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.gateway_order_id} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='paymentintent_status_idx'),
+        ]
+
+
+class PaymentEvent(models.Model):
+    """Raw gateway webhook, stored as received and applied later by the reconciler."""
+    event_id = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.event} {self.event_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'], name='paymentevent_unprocessed_idx', condition=models.Q(processed_at__isnull=True)
+            ),
+        ]
+
+
+class LoginIdentifier(models.Model):
+    """A username, email or phone a user logs in with, normalized; see identifiers.py."""
+    USERNAME = 'username'
+    EMAIL = 'email'
+    PHONE = 'phone'
+    KIND_CHOICES = [
+        (USERNAME, 'Username'),
+        (EMAIL, 'Email'),
+        (PHONE, 'Phone'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_identifiers')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    value = models.CharField(max_length=254)
+
+    def __str__(self):
+        return f"{self.kind} {self.value}"
+
+    class Meta:
+        constraints = [
+            # Also the login index: (kind, value) is its prefix
+            models.UniqueConstraint(fields=['kind', 'value', 'user'], name='loginidentifier_kind_value_user_uniq'),
+        ]
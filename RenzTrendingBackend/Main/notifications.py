@@ -0,0 +1,250 @@
+"""
+Order notification emails.
+
+The markup below is compiled once, at import: class attributes are replaced
+with the matching inline ``style`` (mail clients drop most ``<style>``
+blocks) and ``$name`` placeholders become ``str.format`` fields. Rendering is
+then only escaping and ``format_map``, one row per order line.
+
+Renderers take an ``OrderSnapshot``, a plain copy of what the mail shows;
+``order_snapshots`` builds them for any number of orders in two queries, so
+nothing touches the database while rendering.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from html import escape
+
+import pytz
+
+from . import models
+
+TIME_ZONE = pytz.timezone("Asia/Kolkata")
+COMPANY = "Renz Trending"
+
+STYLES = {
+    "body": "font-family:'Helvetica Neue',Helvetica,Arial,sans-serif;margin:0;padding:0;"
+            "background-color:#f2f2f2;line-height:1.6;color:#333333",
+    "container": "width:100%;max-width:600px;margin:20px auto;background-color:#ffffff;padding:15px;"
+                 "border-radius:10px;box-sizing:border-box",
+    "header": "background-color:#0056b3;padding:20px;border-radius:10px 10px 0 0;color:#ffffff;"
+              "text-align:center;font-size:22px;font-weight:bold;letter-spacing:1px",
+    "content": "padding:20px",
+    "text": "margin:0 0 10px;font-size:14px;line-height:1.5",
+    "items": "width:100%;border-collapse:collapse;margin-bottom:20px;font-size:14px",
+    "th": "text-align:left;padding:8px;border-bottom:2px solid #e2e2e2;color:#555555",
+    "td": "padding:8px;border-bottom:1px solid #e2e2e2",
+    "num": "text-align:right",
+    "muted": "color:#888888;font-size:12px",
+    "total": "padding:8px;font-weight:bold;text-align:right",
+    "details": "background-color:#f7f7f7;padding:15px;border-radius:8px;margin-bottom:20px;"
+               "border:1px solid #e2e2e2",
+    "detail": "margin:8px 0;font-size:14px;color:#555555",
+    "footer": "text-align:center;color:#aaaaaa;font-size:12px;margin-top:20px;padding:15px;"
+              "border-top:1px solid #e2e2e2",
+}
+
+PAGE = """<!DOCTYPE html>
+<html>
+<body class="body">
+<div class="container">
+<div class="header">$heading</div>
+<div class="content">
+<p class="text">Dear $name,</p>
+<p class="text">$intro</p>
+<table class="items">
+<tr><th class="th">Item</th><th class="th num">Qty</th><th class="th num">Price</th><th class="th num">Total</th></tr>
+$rows
+<tr><td class="total" colspan="3">Order total</td><td class="total">$total</td></tr>
+</table>
+<div class="details">
+<p class="detail"><strong>Order:</strong> #$order_id</p>
+<p class="detail"><strong>Status:</strong> $status</p>
+<p class="detail"><strong>Address:</strong> $address</p>
+<p class="detail"><strong>Phone:</strong> $phone</p>
+<p class="detail"><strong>Landmark:</strong> $landmark</p>
+<p class="detail"><strong>Time:</strong> $ordered_at</p>
+</div>
+<p class="text">We hope to see you again soon.</p>
+</div>
+<div class="footer">&copy; $year $company. All rights reserved.</div>
+</div>
+</body>
+</html>
+"""
+
+ROW = """<tr><td class="td">$name<br><span class="muted">$variant</span></td><td class="td num">$quantity</td><td class="td num">$price</td><td class="td num">$line_total</td></tr>"""
+
+TEXT = """Dear $name,
+
+$intro
+
+$rows
+Order total: $total
+
+Order: #$order_id
+Status: $status
+Address: $address
+Phone: $phone
+Landmark: $landmark
+Time: $ordered_at
+"""
+
+TEXT_ROW = "- $name$variant x $quantity @ $price = $line_total"
+
+CLASS_ATTRIBUTE = re.compile(r'class="([^"]+)"')
+PLACEHOLDER = re.compile(r"\$(\w+)")
+
+
+def inline_css(markup, styles):
+    """Replace every ``class="a b"`` with the concatenated inline styles of a and b."""
+    def style(match):
+        return 'style="{}"'.format(escape(";".join(styles[name] for name in match.group(1).split()), quote=False))
+
+    return CLASS_ATTRIBUTE.sub(style, markup)
+
+
+def compile_template(source):
+    """Turn ``$name`` placeholders into a ``str.format`` string."""
+    return PLACEHOLDER.sub(r"{\1}", source.replace("{", "{{").replace("}", "}}"))
+
+
+PAGE_TEMPLATE = compile_template(inline_css(PAGE, STYLES))
+ROW_TEMPLATE = compile_template(inline_css(ROW, STYLES))
+TEXT_TEMPLATE = compile_template(TEXT)
+TEXT_ROW_TEMPLATE = compile_template(TEXT_ROW)
+
+
+@dataclass(slots=True, frozen=True)
+class OrderLine:
+    name: str
+    quantity: int
+    unit_price: Decimal
+    line_total: Decimal
+    size: str = ""
+    sku: str = ""
+
+
+@dataclass(slots=True, frozen=True)
+class OrderSnapshot:
+    order_id: int
+    customer_name: str
+    email: str
+    status: str
+    ordered_at: datetime
+    total: Decimal
+    lines: tuple
+    address: str = ""
+    phone: str = ""
+    landmark: str = ""
+
+
+def money(amount):
+    return f"₹{amount:,.2f}"
+
+
+def variant_label(line):
+    return " / ".join(part for part in (line.size, line.sku) if part)
+
+
+def order_context(snapshot, heading, intro):
+    return {
+        "heading": heading,
+        "intro": intro,
+        "name": snapshot.customer_name,
+        "order_id": snapshot.order_id,
+        "status": snapshot.status,
+        "total": money(snapshot.total),
+        "address": snapshot.address or "N/A",
+        "phone": snapshot.phone or "N/A",
+        "landmark": snapshot.landmark or "N/A",
+        "ordered_at": snapshot.ordered_at.astimezone(TIME_ZONE).strftime("%Y-%m-%d %H:%M:%S %Z%z"),
+        "year": snapshot.ordered_at.year,
+        "company": COMPANY,
+    }
+
+
+def render_html(snapshot, heading, intro):
+    context = {key: escape(str(value)) for key, value in order_context(snapshot, heading, intro).items()}
+    context["rows"] = "\n".join(
+        ROW_TEMPLATE.format(
+            name=escape(line.name),
+            variant=escape(variant_label(line)),
+            quantity=line.quantity,
+            price=escape(money(line.unit_price)),
+            line_total=escape(money(line.line_total)),
+        )
+        for line in snapshot.lines
+    )
+    return PAGE_TEMPLATE.format_map(context)
+
+
+def render_text(snapshot, heading, intro):
+    context = order_context(snapshot, heading, intro)
+    context["rows"] = "\n".join(
+        TEXT_ROW_TEMPLATE.format(
+            name=line.name,
+            variant=f" ({label})" if (label := variant_label(line)) else "",
+            quantity=line.quantity,
+            price=money(line.unit_price),
+            line_total=money(line.line_total),
+        )
+        for line in snapshot.lines
+    )
+    return TEXT_TEMPLATE.format_map(context)
+
+
+def order_confirmation(snapshot):
+    """``(subject, text, html)`` for a newly placed order."""
+    heading, intro = "Order Confirmation", "Thank you for your order. Here are the details:"
+    return (
+        f"Order #{snapshot.order_id} confirmed",
+        render_text(snapshot, heading, intro),
+        render_html(snapshot, heading, intro),
+    )
+
+
+def order_update(snapshot):
+    """``(subject, text, html)`` for a status change."""
+    status = snapshot.status.replace("_", " ").title()
+    heading, intro = f"Order Update - {status}", f"Your order is now {status.lower()}. Here are the details:"
+    return (
+        f"Order Update - {status}",
+        render_text(snapshot, heading, intro),
+        render_html(snapshot, heading, intro),
+    )
+
+
+def order_snapshots(order_ids):
+    """``{order_id: OrderSnapshot}`` in two queries, however many orders."""
+    rows = models.Order.objects.filter(id__in=order_ids).values(
+        "id", "status", "created_at", "total_price",
+        "user__first_name", "user__username", "user__email",
+        "shipping_address__address", "shipping_address__city", "shipping_address__phone",
+        "shipping_address__landmark",
+    )
+    lines = {}
+    items = models.OrderItem.objects.filter(order_id__in=order_ids).order_by("id").values_list(
+        "order_id", "name", "quantity", "price", "line_total", "size", "sku",
+    )
+    for order_id, name, quantity, price, total, size, sku in items:
+        lines.setdefault(order_id, []).append(
+            OrderLine(name=name, quantity=quantity, unit_price=price, line_total=total, size=size or "", sku=sku or "")
+        )
+    snapshots = {}
+    for row in rows:
+        address = ", ".join(part for part in (row["shipping_address__address"], row["shipping_address__city"]) if part)
+        snapshots[row["id"]] = OrderSnapshot(
+            order_id=row["id"],
+            customer_name=row["user__first_name"] or row["user__username"],
+            email=row["user__email"],
+            status=row["status"],
+            ordered_at=row["created_at"],
+            total=row["total_price"],
+            lines=tuple(lines.get(row["id"], ())),
+            address=address,
+            phone=str(row["shipping_address__phone"] or ""),
+            landmark=row["shipping_address__landmark"] or "",
+        )
+    return snapshots
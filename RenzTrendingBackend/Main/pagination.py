@@ -0,0 +1,130 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination keyed on ``(ordering field, id)``.
+
+    Each page is fetched with a ``WHERE (field, id) > (last field, last id)``
+    condition on an indexed column pair, so deep pages cost the same as the
+    first one and there is never an OFFSET scan.
+    """
+
+    page_size = 24
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    results_key = "results"
+
+    # Public ordering name -> model field. Every field must be NOT NULL.
+    orderings = {"created_at": "created_at"}
+    default_ordering = "-created_at"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request)
+        self.page_size = self.get_page_size(request)
+
+        name = self.ordering.lstrip("-")
+        self.field = self.orderings[name]
+        self.descending = self.ordering.startswith("-")
+        sign = "-" if self.descending else ""
+        queryset = queryset.order_by(f"{sign}{self.field}", f"{sign}id")
+
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            value, pk = cursor
+            lookup = "lt" if self.descending else "gt"
+            queryset = queryset.filter(
+                Q(**{f"{self.field}__{lookup}": value})
+                | Q(**{self.field: value, f"id__{lookup}": pk})
+            )
+
+        rows = list(queryset[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        if ordering.lstrip("-") not in self.orderings:
+            return self.default_ordering
+        return ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if data["o"] != self.ordering:
+                raise ValueError("Cursor was issued for a different ordering")
+            value = model._meta.get_field(self.field).to_python(data["v"])
+            return value, int(data["id"])
+        except (TypeError, ValueError, KeyError, json.JSONDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, instance):
+        value = getattr(instance, self.field)
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        elif not isinstance(value, (int, float, str)):
+            value = str(value)
+        data = {"o": self.ordering, "v": value, "id": instance.pk}
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("ordering", self.ordering),
+                    (self.results_key, data),
+                ]
+            )
+        )
+
+
+class ProductCursorPagination(KeysetPagination):
+    page_size = 48
+    results_key = "products"
+    orderings = {
+        "created_at": "created_at",
+        "sellingPrice": "selling_price",
+        "stock": "stock",
+        "name": "name",
+        "trending": "trending_score",
+    }
+    default_ordering = "-created_at"
+
+
+class SearchPagination(PageNumberPagination):
+    """Ranked search results are short, so plain page numbers are enough."""
+
+    page_size = 24
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,367 @@
+"""
+Payment gateway access.
+
+Views talk to a ``PaymentGateway`` from ``get_gateway()``, never to the
+Razorpay SDK directly. The gateway is built once per process (per
+``PAYMENT_GATEWAY`` setting) and shared by all threads:
+
+* ``RazorpayGateway`` keeps one ``razorpay.Client`` on a pooled
+  ``requests`` session, so connections and TLS sessions are reused, and every
+  call gets the ``PAYMENT_GATEWAY_TIMEOUT`` (connect, read) timeouts;
+* ``FakeGateway`` answers in-process with the same signature scheme, so
+  checkout can be exercised and load-tested with no network.
+
+Every remote call goes through a circuit breaker: after
+``PAYMENT_BREAKER_THRESHOLD`` consecutive failures calls fail fast with
+``GatewayUnavailable`` for ``PAYMENT_BREAKER_RESET`` seconds, then one trial
+call decides whether it closes again. Call latencies are kept in per-call
+histograms (``LATENCY``), served by the payment metrics endpoint.
+"""
+import bisect
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+import uuid
+
+import razorpay
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit is open, or the gateway timed out or failed."""
+
+
+class SignatureError(GatewayError):
+    pass
+
+
+class LatencyHistogram:
+    """Cumulative-bucket latency histogram, Prometheus style; thread-safe."""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, name, seconds, ok=True):
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = {"counts": [0] * (len(self.BUCKETS) + 1), "sum": 0.0, "errors": 0}
+            series["counts"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            series["sum"] += seconds
+            if not ok:
+                series["errors"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for name, series in self.series.items():
+                cumulative = list(itertools.accumulate(series["counts"]))
+                result[name] = {
+                    "buckets": {str(bound): count for bound, count in zip(self.BUCKETS + ("+Inf",), cumulative)},
+                    "count": cumulative[-1],
+                    "sum": round(series["sum"], 6),
+                    "errors": series["errors"],
+                }
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+
+LATENCY = LatencyHistogram()
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold, reset_after, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_after:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == self.OPEN or (state == self.HALF_OPEN and self.trial_running):
+                raise GatewayUnavailable("Payment gateway is unavailable, try again shortly")
+            if state == self.HALF_OPEN:
+                self.trial_running = True
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+
+
+class PaymentGateway:
+    """
+    What checkout needs from a payment provider. Amounts are in paise.
+    Subclasses implement the ``_create_order``/``_fetch_payment`` calls; the
+    public methods add the breaker and latency recording.
+    """
+    name = "gateway"
+    public_key = ""
+    secret = ""
+    webhook_secret = ""
+    # Exceptions that count against the breaker; anything else is the caller's fault
+    transient_errors = (GatewayUnavailable,)
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.PAYMENT_BREAKER_THRESHOLD, settings.PAYMENT_BREAKER_RESET)
+
+    def call(self, operation, function, *args):
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            result = function(*args)
+        except self.transient_errors as error:
+            LATENCY.observe(f"{self.name}.{operation}", time.perf_counter() - started, ok=False)
+            self.breaker.failed()
+            if isinstance(error, GatewayUnavailable):
+                raise
+            raise GatewayUnavailable(f"{self.name} {operation} failed: {error}") from error
+        except Exception:
+            LATENCY.observe(f"{self.name}.{operation}", time.perf_counter() - started, ok=False)
+            self.breaker.succeeded()
+            raise
+        LATENCY.observe(f"{self.name}.{operation}", time.perf_counter() - started)
+        self.breaker.succeeded()
+        return result
+
+    def create_order(self, amount, currency="INR", receipt=None):
+        """Returns the gateway's order dict (``id``, ``amount``, ``currency``, ...)."""
+        return self.call("create_order", self._create_order, amount, currency, receipt)
+
+    def fetch_payment(self, payment_id):
+        return self.call("fetch_payment", self._fetch_payment, payment_id)
+
+    def list_payments(self, since, until):
+        """Every payment created between the two epoch seconds, as gateway payment dicts."""
+        return self.call("list_payments", self._list_payments, since, until)
+
+    def verify_signature(self, order_id, payment_id, signature):
+        """Raises SignatureError unless ``signature`` signs ``order_id|payment_id``."""
+        expected = hmac.new(self.secret.encode(), f"{order_id}|{payment_id}".encode(), hashlib.sha256).hexdigest()
+        if not signature or not hmac.compare_digest(expected, signature):
+            raise SignatureError("Payment signature mismatch")
+
+    def verify_webhook(self, body, signature):
+        """Raises SignatureError unless ``signature`` is the webhook secret's HMAC of the raw ``body``."""
+        if not self.webhook_secret:
+            raise SignatureError("No webhook secret configured")
+        expected = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+        if not signature or not hmac.compare_digest(expected, signature):
+            raise SignatureError("Webhook signature mismatch")
+
+    def _create_order(self, amount, currency, receipt):
+        raise NotImplementedError
+
+    def _fetch_payment(self, payment_id):
+        raise NotImplementedError
+
+    def _list_payments(self, since, until):
+        raise NotImplementedError
+
+
+class TimeoutSession(requests.Session):
+    """A session whose requests default to ``timeout``; the Razorpay SDK passes none."""
+
+    def __init__(self, timeout, pool_size):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class RazorpayGateway(PaymentGateway):
+    name = "razorpay"
+    transient_errors = (GatewayUnavailable, requests.RequestException, razorpay.errors.ServerError)
+
+    def __init__(self):
+        super().__init__()
+        self.public_key = settings.RAZORPAY_KEY_ID
+        self.secret = settings.RAZORPAY_KEY_SECRET or ""
+        self.webhook_secret = settings.RAZORPAY_WEBHOOK_SECRET or ""
+        self.session = TimeoutSession(settings.PAYMENT_GATEWAY_TIMEOUT, settings.PAYMENT_GATEWAY_POOL_SIZE)
+        self.client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET), session=self.session)
+
+    def _create_order(self, amount, currency, receipt):
+        data = {"amount": amount, "currency": currency, "payment_capture": "1"}
+        if receipt:
+            data["receipt"] = receipt
+        try:
+            return self.client.order.create(data)
+        except razorpay.errors.BadRequestError as error:
+            raise GatewayError(str(error)) from error
+
+    def _fetch_payment(self, payment_id):
+        try:
+            return self.client.payment.fetch(payment_id)
+        except razorpay.errors.BadRequestError as error:
+            raise GatewayError(str(error)) from error
+
+    def _list_payments(self, since, until):
+        payments, page = [], 100
+        while True:
+            try:
+                result = self.client.payment.all({"from": since, "to": until, "count": page, "skip": len(payments)})
+            except razorpay.errors.BadRequestError as error:
+                raise GatewayError(str(error)) from error
+            payments.extend(result["items"])
+            if len(result["items"]) < page:
+                return payments
+
+
+class FakeGateway(PaymentGateway):
+    """
+    In-process stand-in for Razorpay. ``latency`` (seconds) is added to every
+    call and ``fail_next(n)`` makes the next n calls fail as a gateway outage
+    would; ``pay`` simulates the customer paying and returns what the browser
+    would post to ``verify_payment``, and ``webhook`` builds the signed
+    request the gateway would send about a payment.
+    """
+    name = "fake"
+    public_key = "rzp_test_fake"
+    secret = "fake-secret"
+    webhook_secret = "fake-webhook-secret"
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.payments = {}
+        self.failures = 0
+
+    def fail_next(self, count=1):
+        with self.lock:
+            self.failures = count
+
+    def simulate(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise GatewayUnavailable("Simulated gateway outage")
+
+    def _create_order(self, amount, currency, receipt):
+        self.simulate()
+        order = {
+            "id": f"order_{uuid.uuid4().hex[:14]}", "entity": "order", "amount": amount, "amount_paid": 0,
+            "currency": currency, "receipt": receipt, "status": "created",
+        }
+        with self.lock:
+            self.orders[order["id"]] = order
+        return dict(order)
+
+    def _fetch_payment(self, payment_id):
+        self.simulate()
+        with self.lock:
+            payment = self.payments.get(payment_id)
+        if payment is None:
+            raise GatewayError(f"No payment {payment_id}")
+        return dict(payment)
+
+    def _list_payments(self, since, until):
+        self.simulate()
+        with self.lock:
+            return [dict(p) for p in self.payments.values() if since <= p["created_at"] <= until]
+
+    def sign(self, order_id, payment_id):
+        return hmac.new(self.secret.encode(), f"{order_id}|{payment_id}".encode(), hashlib.sha256).hexdigest()
+
+    def pay(self, order_id, method="upi"):
+        with self.lock:
+            order = self.orders[order_id]
+            payment_id = f"pay_{uuid.uuid4().hex[:14]}"
+            self.payments[payment_id] = {
+                "id": payment_id, "entity": "payment", "order_id": order_id, "amount": order["amount"],
+                "currency": order["currency"], "status": "captured", "method": method,
+                "created_at": int(time.time()),
+            }
+            order.update(status="paid", amount_paid=order["amount"])
+        return {
+            "razorpay_order_id": order_id,
+            "razorpay_payment_id": payment_id,
+            "razorpay_signature": self.sign(order_id, payment_id),
+        }
+
+    def webhook(self, payment_id, event="payment.captured"):
+        """``(body, headers)`` of the webhook Razorpay would post for ``payment_id``."""
+        with self.lock:
+            payment = dict(self.payments[payment_id])
+        body = json.dumps({
+            "entity": "event", "event": event, "contains": ["payment"],
+            "payload": {"payment": {"entity": payment}}, "created_at": int(time.time()),
+        }).encode()
+        headers = {
+            "X-Razorpay-Signature": hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest(),
+            "X-Razorpay-Event-Id": f"evt_{uuid.uuid4().hex[:14]}",
+        }
+        return body, headers
+
+
+GATEWAYS = {"razorpay": RazorpayGateway, "fake": FakeGateway}
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway named by ``PAYMENT_GATEWAY``."""
+    name = settings.PAYMENT_GATEWAY
+    gateway = _gateways.get(name)
+    if gateway is None:
+        with _gateways_lock:
+            gateway = _gateways.get(name)
+            if gateway is None:
+                gateway = _gateways[name] = GATEWAYS[name]()
+    return gateway
+
+
+def reset_gateways():
+    with _gateways_lock:
+        _gateways.clear()
+
+
+def breaker_states():
+    with _gateways_lock:
+        return {gateway.name: gateway.breaker.state for gateway in _gateways.values()}
@@ -0,0 +1,103 @@
+"""
+Cart and order pricing, computed by the database.
+
+A line's unit price is its variant's price when it has a variant and the
+product's selling price otherwise; the list ("market") price follows the
+same rule and falls back to the unit price. These are expressions over
+``CartItem`` rows, so totals for a whole cart are one aggregate query and
+never touch line, product or variant objects in Python.
+
+Orders don't use these: ``snapshot_order_items`` copies each line's name,
+SKU, size and prices into ``OrderItem`` when the order is placed, and
+everything after that reads the snapshot. ``snapshot_line`` does the same
+for a single unsaved line, for orders that skip the cart.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import models
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+ZERO = Decimal("0.00")
+
+
+def unit_price():
+    return Coalesce(F("variant__price"), F("product__selling_price"), output_field=MONEY)
+
+
+def list_price():
+    return Coalesce(
+        F("variant__market_price"), F("variant__price"), F("product__market_price"), output_field=MONEY
+    )
+
+
+def line_total():
+    return ExpressionWrapper(unit_price() * F("quantity"), output_field=MONEY)
+
+
+def priced(lines):
+    """Annotate a CartItem queryset with ``unit_price`` and ``line_total``."""
+    return lines.annotate(unit_price=unit_price(), line_total=line_total())
+
+
+def summarize(lines):
+    """Subtotal, list total, discount, item and line counts for CartItem rows, in one query."""
+    totals = lines.aggregate(
+        subtotal=Coalesce(Sum(line_total()), Value(ZERO), output_field=MONEY),
+        list_total=Coalesce(
+            Sum(ExpressionWrapper(list_price() * F("quantity"), output_field=MONEY)),
+            Value(ZERO),
+            output_field=MONEY,
+        ),
+        item_count=Coalesce(Sum("quantity"), Value(0)),
+        line_count=Count("id"),
+    )
+    totals["discount"] = max(totals["list_total"] - totals["subtotal"], ZERO)
+    return totals
+
+
+def cart_summary(customer_id):
+    return summarize(models.CartItem.objects.filter(user_id=customer_id))
+
+
+def snapshot_order_items(order, lines):
+    """
+    Copy CartItem ``lines`` into ``order`` as OrderItem rows priced at this
+    moment; one read and one bulk INSERT. Returns the created items.
+    """
+    rows = priced(lines).order_by("id").values_list(
+        "product_id", "variant_id", "product__name", "variant__sku", "size__size",
+        "quantity", "unit_price", "line_total",
+    )
+    return models.OrderItem.objects.bulk_create([
+        models.OrderItem(
+            order=order,
+            product_id=product_id,
+            variant_id=variant_id,
+            name=name,
+            sku=sku or "",
+            size=size or "",
+            quantity=quantity,
+            price=price,
+            line_total=total,
+        )
+        for product_id, variant_id, name, sku, size, quantity, price, total in rows
+    ])
+
+
+def snapshot_line(order, line):
+    """Copy one unsaved CartItem ``line`` into ``order`` as an OrderItem, priced like a saved one."""
+    price = line.variant.price if line.variant else line.product.selling_price
+    return models.OrderItem.objects.create(
+        order=order,
+        product=line.product,
+        variant=line.variant,
+        name=line.product.name,
+        sku=line.variant.sku if line.variant else "",
+        size=line.size.size if line.size else "",
+        quantity=line.quantity,
+        price=price,
+        line_total=price * line.quantity,
+    )
@@ -0,0 +1,94 @@
+"""
+Compact read path for the hot account listings (cart, orders, wishlist).
+
+Rows are fetched with ``.values()`` restricted to the columns the response
+shows and shaped by plain functions, and products are rendered with the
+shared card builder. Nothing here instantiates models or serializer fields
+per row; the full serializers remain the write path and the default shape.
+"""
+from . import cards, models, pricing
+
+
+def wants_compact(request):
+    return request.query_params.get("compact") in ("1", "true")
+
+
+def product_cards(product_ids):
+    """Cards keyed by product id: three queries for any number of products."""
+    if not product_ids:
+        return {}
+    return cards.build_card_index(cards.card_queryset(models.Product.objects.filter(id__in=product_ids)))
+
+
+def cart_lines(customer_id):
+    rows = list(
+        models.CartItem.objects.filter(user_id=customer_id)
+        .order_by("id")
+        .values(
+            "id", "product_id", "quantity", "size_id", "size__size", "variant_id", "variant__sku",
+            unit_price=pricing.unit_price(), line_total=pricing.line_total(),
+        )
+    )
+    index = product_cards({row["product_id"] for row in rows})
+    lines = []
+    for row in rows:
+        lines.append({
+            "id": row["id"],
+            "product": index[row["product_id"]],
+            "variant": {"id": row["variant_id"], "sku": row["variant__sku"]} if row["variant_id"] else None,
+            "size": {"id": row["size_id"], "size": row["size__size"]} if row["size_id"] else None,
+            "quantity": row["quantity"],
+            "unit_price": row["unit_price"],
+            "price": row["line_total"],
+        })
+    return lines
+
+
+ORDER_FIELDS = (
+    "id", "status", "payment", "total_price", "tracking_number", "carrier",
+    "expected_delivery_date", "created_at",
+)
+
+
+def order_lines(order_ids):
+    """``{order_id: [line, ...]}`` from OrderItem rows and the legacy cart-item link."""
+    lines = {}
+    items = models.OrderItem.objects.filter(order_id__in=order_ids).order_by("id").values_list(
+        "order_id", "product_id", "name", "sku", "quantity", "line_total"
+    )
+    for order_id, product_id, name, sku, quantity, total in items:
+        lines.setdefault(order_id, []).append({
+            "product_id": product_id, "name": name, "sku": sku, "quantity": quantity, "price": total,
+        })
+    linked = models.Order.products.through.objects.filter(order_id__in=order_ids).order_by("id").values_list(
+        "order_id", "cartitem__product_id", "cartitem__product__name", "cartitem__quantity",
+        "cartitem__product__selling_price",
+    )
+    for order_id, product_id, name, quantity, unit_price in linked:
+        lines.setdefault(order_id, []).append({
+            "product_id": product_id, "name": name, "sku": None, "quantity": quantity,
+            "price": unit_price * quantity,
+        })
+    return lines
+
+
+def order_summaries(orders):
+    """Compact rows for an Order queryset, in its ordering, with their lines attached."""
+    rows = list(orders.values(*ORDER_FIELDS))
+    lines = order_lines([row["id"] for row in rows])
+    for row in rows:
+        row["items"] = lines.get(row["id"], [])
+    return rows
+
+
+def wishlist_items(user_id):
+    rows = list(
+        models.WishlistItem.objects.filter(wishlist__user_id=user_id)
+        .order_by("-created_at", "-id")
+        .values("id", "product_id", "created_at")
+    )
+    index = product_cards({row["product_id"] for row in rows})
+    return [
+        {"id": row["id"], "product": index[row["product_id"]], "created_at": row["created_at"]}
+        for row in rows
+    ]
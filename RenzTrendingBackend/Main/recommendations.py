@@ -0,0 +1,173 @@
+import bisect
+import heapq
+import math
+import random
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+from . import models
+
+CATEGORY_WEIGHT = 3.0
+PRODUCT_TYPE_WEIGHT = 2.0
+TAG_WEIGHT = 1.0
+FABRIC_WEIGHT = 0.5
+SAME_PRICE_BAND_WEIGHT = 1.0
+NEAR_PRICE_BAND_WEIGHT = 0.5
+
+# Prices are banded on a log scale, each band 1.5x wider than the previous one.
+PRICE_BAND_RATIO = 1.5
+
+
+@dataclass(slots=True)
+class ProductFeatures:
+    id: int
+    category_id: int
+    product_type: str
+    tags: frozenset
+    fabric: frozenset
+    price: float
+    price_band: int
+
+
+def price_band(price):
+    return int(math.log(max(float(price), 1.0), PRICE_BAND_RATIO))
+
+
+def normalize(values):
+    return frozenset(value.strip().lower() for value in values or [] if value and value.strip())
+
+
+def load_features():
+    rows = models.Product.objects.order_by().values_list(
+        "id", "category_id", "product_type", "tags", "fabric", "selling_price"
+    )
+    return [
+        ProductFeatures(
+            id=pk,
+            category_id=category_id,
+            product_type=(product_type or "").strip().lower(),
+            tags=normalize(tags),
+            fabric=normalize(fabric),
+            price=float(price),
+            price_band=price_band(price),
+        )
+        for pk, category_id, product_type, tags, fabric, price in rows
+    ]
+
+
+def score_pair(a, b):
+    score = 0.0
+    if a.category_id == b.category_id:
+        score += CATEGORY_WEIGHT
+    if a.product_type and a.product_type == b.product_type:
+        score += PRODUCT_TYPE_WEIGHT
+    score += TAG_WEIGHT * len(a.tags & b.tags)
+    score += FABRIC_WEIGHT * len(a.fabric & b.fabric)
+    band_distance = abs(a.price_band - b.price_band)
+    if band_distance == 0:
+        score += SAME_PRICE_BAND_WEIGHT
+    elif band_distance == 1:
+        score += NEAR_PRICE_BAND_WEIGHT
+    return score
+
+
+def feature_keys(features):
+    yield ("category", features.category_id)
+    if features.product_type:
+        yield ("type", features.product_type)
+    for tag in features.tags:
+        yield ("tag", tag)
+    for fabric in features.fabric:
+        yield ("fabric", fabric)
+
+
+def build_postings(catalog):
+    """Feature -> products carrying it, sorted by price for windowed lookups."""
+    postings = {}
+    for features in catalog:
+        for key in feature_keys(features):
+            postings.setdefault(key, []).append((features.price, features.id))
+    for posting in postings.values():
+        posting.sort()
+    return postings
+
+
+def candidate_ids(features, postings, window):
+    """Ids sharing a feature with ``features``, at most ``window`` nearest-priced per feature."""
+    candidates = set()
+    half = window // 2
+    for key in feature_keys(features):
+        posting = postings[key]
+        position = bisect.bisect_left(posting, (features.price, features.id))
+        start = max(0, position - half)
+        candidates.update(pk for _, pk in posting[start:start + window + 1])
+    candidates.discard(features.id)
+    return candidates
+
+
+def compute_neighbours(catalog, top_k=12, window=200):
+    """
+    Yield ``(product_id, [(related_id, score), ...])`` for every product.
+
+    Candidates come from an inverted index over category, product type, tags
+    and fabric, so each product is compared with a bounded window of similar
+    products instead of the whole catalog.
+    """
+    by_id = {features.id: features for features in catalog}
+    postings = build_postings(catalog)
+    for features in catalog:
+        scored = (
+            (score_pair(features, by_id[pk]), pk)
+            for pk in candidate_ids(features, postings, window)
+        )
+        best = heapq.nlargest(top_k, scored)
+        yield features.id, [(pk, score) for score, pk in best if score > 0]
+
+
+def rebuild_related_products(top_k=12, window=200, batch_size=500):
+    """Recompute the RelatedProduct table; returns the number of rows written."""
+    written = 0
+    batch_ids, batch_rows = [], []
+
+    def flush():
+        with transaction.atomic():
+            models.RelatedProduct.objects.filter(product_id__in=batch_ids).delete()
+            models.RelatedProduct.objects.bulk_create(batch_rows)
+        batch_ids.clear()
+        batch_rows.clear()
+
+    for product_id, neighbours in compute_neighbours(load_features(), top_k, window):
+        batch_ids.append(product_id)
+        batch_rows.extend(
+            models.RelatedProduct(product_id=product_id, related_id=pk, score=score)
+            for pk, score in neighbours
+        )
+        written += len(neighbours)
+        if len(batch_ids) >= batch_size:
+            flush()
+    if batch_ids:
+        flush()
+    return written
+
+
+def related_products(queryset, slug, count=8):
+    """Neighbours of the product with ``slug``, best first, from one indexed join."""
+    return queryset.filter(related_from__product__slug=slug).order_by("-related_from__score")[:count]
+
+
+def sample_products(queryset, exclude_id, count=8):
+    """
+    A cheap random sample for products without neighbours yet: start at a
+    random id and walk the primary key index instead of sorting the table.
+    """
+    bounds = models.Product.objects.aggregate(low=Min("id"), high=Max("id"))
+    if bounds["low"] is None:
+        return []
+    start = random.randint(bounds["low"], bounds["high"])
+    queryset = queryset.exclude(id=exclude_id)
+    picks = list(queryset.filter(id__gte=start).order_by("id")[:count])
+    if len(picks) < count:
+        picks += list(queryset.filter(id__lt=start).order_by("id")[: count - len(picks)])
+    return picks
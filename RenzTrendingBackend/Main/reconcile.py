@@ -0,0 +1,250 @@
+"""
+Payment reconciliation.
+
+The webhook view only verifies the signature and appends the raw event to
+``PaymentEvent``; everything else happens here, in batches, from
+``manage.py reconcile_payments``:
+
+* ``process_events`` claims unprocessed events (``SKIP LOCKED``, so several
+  reconcilers can run), and hands their payments to ``settle``;
+* ``sweep`` asks the gateway, in one listing call for the whole window,
+  about intents still unpaid some time after checkout started, which catches
+  payments whose webhook never arrived; intents left unpaid past
+  ``PAYMENT_INTENT_EXPIRY`` are expired;
+* ``settle`` applies gateway payments, for ``verify_payment`` as well: a
+  captured payment without an order places the order from the customer's
+  cart through ``checkout.place_order``, which is idempotent on the payment
+  id; then ``Payment`` rows are upserted and the orders confirmed, each in
+  one statement for the batch. A payment whose amount is not the order's
+  total (the cart changed after the gateway order was created) confirms
+  nothing: its intent is left for a person as ``NEEDS_REVIEW``.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import checkout, models, payments, pricing
+
+logger = logging.getLogger(__name__)
+
+CAPTURED = "captured"
+PAYMENT_EVENTS = {"payment.captured", "payment.failed", "order.paid"}
+# Order statuses a captured payment moves on to "confirmed"
+UNPAID_ORDER_STATUSES = ("pending", "Pending", "not_placed")
+
+
+@dataclass(slots=True)
+class GatewayPayment:
+    id: str
+    order_id: str
+    amount: Decimal
+    method: str
+    status: str
+
+    @classmethod
+    def from_entity(cls, entity):
+        return cls(
+            id=entity["id"],
+            order_id=entity.get("order_id") or "",
+            amount=Decimal(entity.get("amount") or 0) / 100,
+            method=entity.get("method") or "online",
+            status=entity.get("status") or "",
+        )
+
+
+def ingest(event_id, body):
+    """Store one verified webhook; a redelivered event is ignored. Returns whether it was new."""
+    _, created = models.PaymentEvent.objects.get_or_create(
+        event_id=event_id, defaults={"event": body.get("event", ""), "payload": body}
+    )
+    return created
+
+
+GATEWAY_METHODS = {"upi": "UPI", "netbanking": "Net Banking", "card": "Razorpay"}
+
+
+def payment_method(method):
+    """``Payment.payment_method`` choice for a Razorpay payment method."""
+    return GATEWAY_METHODS.get(method, "online")
+
+
+def amount_mismatch(paid, total):
+    return f"Paid {paid} against a total of {total}"
+
+
+def settle(gateway_payments):
+    """
+    Apply ``gateway_payments`` (GatewayPayment); returns ``{payment id: error}``
+    for those that could not be applied.
+    """
+    by_id = {payment.id: payment for payment in gateway_payments}
+    if not by_id:
+        return {}
+    intents = {
+        intent.gateway_order_id: intent
+        for intent in models.PaymentIntent.objects.select_related("user").filter(
+            gateway_order_id__in={payment.order_id for payment in by_id.values()}
+        )
+    }
+    orders = {order.payment_reference: order for order in models.Order.objects.filter(payment_reference__in=by_id)}
+
+    errors = {}
+    settled = []
+    touched = {}
+    for payment in by_id.values():
+        intent = intents.get(payment.order_id)
+        if payment.status != CAPTURED:
+            # A declined attempt; the customer may still pay on the same gateway order
+            if intent is not None and intent.status == models.PaymentIntent.CREATED:
+                intent.status = models.PaymentIntent.FAILED
+                touched[intent.pk] = intent
+            continue
+        order = orders.get(payment.id)
+        if order is None:
+            if intent is None:
+                errors[payment.id] = f"No payment intent for gateway order {payment.order_id}"
+                continue
+            # Checked again against the order below; this spares the stock of a cart the payment can't cover
+            subtotal = pricing.cart_summary(intent.user_id)["subtotal"]
+            error = None if payment.amount == subtotal else amount_mismatch(payment.amount, subtotal)
+            if error is None:
+                try:
+                    order, _ = checkout.place_order(
+                        intent.user,
+                        payment="online",
+                        status="pending",
+                        payment_reference=payment.id,
+                        tracking_number=f"AG{payment.id[-8:]}",
+                    )
+                except checkout.CheckoutError as checkout_error:
+                    error = str(checkout_error)
+            if error is not None:
+                # Paid, but the cart can no longer be fulfilled: needs a person (refund or manual order)
+                intent.status, intent.note = models.PaymentIntent.NEEDS_REVIEW, error
+                touched[intent.pk] = intent
+                errors[payment.id] = error
+                continue
+        if payment.amount != order.total_price:
+            errors[payment.id] = amount_mismatch(payment.amount, order.total_price)
+            if intent is not None:
+                intent.status, intent.order, intent.note = (
+                    models.PaymentIntent.NEEDS_REVIEW, order, errors[payment.id]
+                )
+                touched[intent.pk] = intent
+            continue
+        settled.append((payment, order))
+        if intent is not None:
+            intent.status, intent.order = models.PaymentIntent.PAID, order
+            touched[intent.pk] = intent
+
+    if settled:
+        models.Payment.objects.bulk_create(
+            [
+                models.Payment(
+                    order=order,
+                    payment_method=payment_method(payment.method),
+                    amount=payment.amount,
+                    status="Paid",
+                    transaction_id=payment.id,
+                )
+                for payment, order in settled
+            ],
+            update_conflicts=True,
+            unique_fields=["order"],
+            update_fields=["payment_method", "amount", "status", "transaction_id"],
+        )
+        models.Order.objects.filter(
+            pk__in=[order.pk for _, order in settled], status__in=UNPAID_ORDER_STATUSES
+        ).update(status="confirmed")
+    if touched:
+        now = timezone.now()
+        for intent in touched.values():
+            intent.updated_at = now
+        models.PaymentIntent.objects.bulk_update(touched.values(), ["order", "status", "note", "updated_at"])
+    return errors
+
+
+def event_payment(event):
+    entity = (event.payload.get("payload", {}).get("payment") or {}).get("entity")
+    return GatewayPayment.from_entity(entity) if entity else None
+
+
+def process_events(batch_size=200):
+    """Apply one batch of unprocessed events; returns how many were claimed."""
+    with transaction.atomic():
+        events = list(
+            models.PaymentEvent.objects.filter(processed_at__isnull=True)
+            .order_by("id")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not events:
+            return 0
+        found = {
+            event.pk: event_payment(event) for event in events if event.event in PAYMENT_EVENTS
+        }
+        # Later events about the same payment win (failed, then captured on a retry)
+        latest = {payment.id: payment for payment in found.values() if payment is not None}
+        try:
+            with transaction.atomic():
+                errors = settle(list(latest.values()))
+        except Exception as error:
+            logger.exception("Reconciling payment events failed")
+            errors = {payment_id: f"{type(error).__name__}: {error}" for payment_id in latest}
+
+        now = timezone.now()
+        for event in events:
+            payment = found.get(event.pk)
+            error = errors.get(payment.id) if payment is not None else None
+            event.attempts += 1
+            event.error = error or ""
+            if not error or event.attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS:
+                event.processed_at = now
+        models.PaymentEvent.objects.bulk_update(events, ["attempts", "error", "processed_at"])
+    return len(events)
+
+
+def process_all(batch_size=200):
+    """
+    Process batches until one comes back short; returns how many events were
+    claimed. Events that failed stay unprocessed for a later run.
+    """
+    total = 0
+    while True:
+        claimed = process_events(batch_size)
+        total += claimed
+        if claimed < batch_size:
+            return total
+
+
+def sweep(gateway=None):
+    """
+    Reconcile unpaid intents older than ``PAYMENT_SWEEP_AFTER`` against the
+    gateway's payment listing; returns ``(settled, expired)`` counts.
+    """
+    gateway = gateway or payments.get_gateway()
+    now = timezone.now()
+    pending = models.PaymentIntent.objects.filter(
+        status__in=[models.PaymentIntent.CREATED, models.PaymentIntent.FAILED],
+        created_at__lte=now - settings.PAYMENT_SWEEP_AFTER,
+    )
+    oldest = pending.order_by("created_at").values_list("created_at", flat=True).first()
+    if oldest is None:
+        return 0, 0
+    order_ids = set(pending.values_list("gateway_order_id", flat=True))
+    listed = gateway.list_payments(int((oldest - timedelta(minutes=5)).timestamp()), int(now.timestamp()))
+    found = [
+        GatewayPayment.from_entity(entity)
+        for entity in listed
+        if entity.get("order_id") in order_ids and entity.get("status") == CAPTURED
+    ]
+    errors = settle(found)
+    # Settled intents are no longer pending, so this only expires ones nobody paid
+    expired = pending.filter(created_at__lte=now - settings.PAYMENT_INTENT_EXPIRY).update(
+        status=models.PaymentIntent.EXPIRED
+    )
+    return len(found) - len(errors), expired
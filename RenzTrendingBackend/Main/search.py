@@ -0,0 +1,61 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db.models import F, Func, Q, TextField, Value
+
+from . import models
+
+SEARCH_CONFIG = "english"
+
+
+def array_to_text(field):
+    return Func(F(field), Value(" "), function="array_to_string", output_field=TextField())
+
+
+def product_search_vector():
+    """Weighted document over name, brand, tags, fabric and description."""
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("brand", array_to_text("tags"), weight="B", config=SEARCH_CONFIG)
+        + SearchVector(array_to_text("fabric"), weight="C", config=SEARCH_CONFIG)
+        + SearchVector("description", weight="D", config=SEARCH_CONFIG)
+    )
+
+
+def refresh_search_vectors(queryset=None):
+    """Recompute ``Product.search_vector`` in a single UPDATE."""
+    if queryset is None:
+        queryset = models.Product.objects.all()
+    return queryset.update(search_vector=product_search_vector())
+
+
+def build_query(text):
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+
+
+def match_products(queryset, text):
+    """
+    Products whose document matches ``text``, or whose name is close to it.
+
+    Both branches are served by GIN indexes (the search vector and the
+    trigram index on name), so neither one scans the product table.
+    """
+    return queryset.filter(
+        Q(search_vector=build_query(text)) | Q(name__trigram_word_similar=text)
+    )
+
+
+def search_products(queryset, text):
+    """Matching products ordered by full-text rank plus name similarity."""
+    query = build_query(text)
+    return (
+        match_products(queryset, text)
+        .annotate(
+            rank=SearchRank(F("search_vector"), query)
+            + TrigramWordSimilarity(text, "name")
+        )
+        .order_by("-rank", "-id")
+    )
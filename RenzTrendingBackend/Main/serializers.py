@@ -1,9 +1,78 @@
+import functools
+
 from rest_framework import serializers
 from . import models
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, Prefetch
+
+
+class QueryPlanMixin:
+    """
+    Lets a serializer load everything its nested fields read in a fixed
+    number of queries.
+
+    ``setup_queryset`` follows the serializer's fields: forward foreign keys
+    and one-to-ones to nested planned serializers become ``select_related``,
+    reverse and many-to-many relations become ``Prefetch`` objects built from
+    the nested serializer's own plan. ``queryset_annotations`` are added
+    wherever the serializer's model is loaded, so a relation to a serializer
+    that declares any is prefetched rather than joined.
+    """
+    queryset_annotations = {}
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        select, prefetch = query_plan(cls)
+        if cls.queryset_annotations:
+            queryset = queryset.annotate(**cls.queryset_annotations)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*[
+                Prefetch(lookup, queryset=child.setup_queryset(model._default_manager.all())) if child else lookup
+                for lookup, model, child in prefetch
+            ])
+        return queryset
+
+
+@functools.cache
+def query_plan(serializer_class):
+    """``(select_related lookups, [(prefetch lookup, model, serializer or None)])`` for a planned serializer."""
+    opts = serializer_class.Meta.model._meta
+    select, prefetch = [], []
+    for field in serializer_class().fields.values():
+        if field.write_only or field.source == "*" or "." in field.source:
+            continue
+        try:
+            relation = opts.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not relation.is_relation:
+            continue
+
+        if isinstance(field, serializers.ManyRelatedField):
+            prefetch.append((field.source, relation.related_model, None))
+            continue
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if not isinstance(nested, QueryPlanMixin):
+            continue
+
+        child = type(nested)
+        if (relation.many_to_one or relation.one_to_one) and not child.queryset_annotations:
+            child_select, child_prefetch = query_plan(child)
+            select.append(field.source)
+            select.extend(f"{field.source}__{lookup}" for lookup in child_select)
+            prefetch.extend(
+                (f"{field.source}__{lookup}", model, grandchild)
+                for lookup, model, grandchild in child_prefetch
+            )
+        else:
+            prefetch.append((field.source, relation.related_model, child))
+    return tuple(select), tuple(prefetch)
 
 
-class LocationSerializer(serializers.ModelSerializer):
+class LocationSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Location
         fields = "__all__"
@@ -56,53 +125,54 @@ class GetUserSerializer(serializers.ModelSerializer):
         fields = ["username", "email"]
 
 
-class ColorSerializer(serializers.ModelSerializer):
+class ColorSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Color
         fields = "__all__"
 
 
-class SizeSerializer(serializers.ModelSerializer):
+class SizeSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Size
         fields = "__all__"
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(QueryPlanMixin, serializers.ModelSerializer):
     parent = serializers.PrimaryKeyRelatedField(queryset=models.Category.objects.all(), required=False, allow_null=True)
-    
+    queryset_annotations = {"product_count": Count("products")}
+
     class Meta:
         model = models.Category
         fields = ["id", "name", "parent", "slug", "image", "total_products", "created_at", "updated_at"]
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.ProductImage
         fields = ["id", "image", "alt_text", "is_primary"]
 
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class ProductVariantSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.ProductVariant
         fields = "__all__"
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(QueryPlanMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     category = CategorySerializer(read_only=True)
     color = ColorSerializer(read_only=True)
     size = SizeSerializer(read_only=True)
-    avail_sizes = SizeSerializer(many=True, read_only=True, source='avail_sizes')
+    avail_sizes = SizeSerializer(many=True, read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
     SKU = serializers.CharField(read_only=True)
 
     class Meta:
         model = models.Product
-        fields = "__all__"
+        exclude = ["search_vector", "trending_score"]
 
 
-class HomeProductSerializer(serializers.ModelSerializer):
+class HomeProductSerializer(QueryPlanMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     
     class Meta:
@@ -110,7 +180,7 @@ class HomeProductSerializer(serializers.ModelSerializer):
         fields = ["id", "name", "description", "selling_price", "market_price", "images", "rating", "buy_count", "slug"]
 
 
-class ProductGroupSerializer(serializers.ModelSerializer):
+class ProductGroupSerializer(QueryPlanMixin, serializers.ModelSerializer):
     product = ProductSerializer(many=True, read_only=True)
 
     class Meta:
@@ -118,7 +188,7 @@ class ProductGroupSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Address
         fields = "__all__"
@@ -127,7 +197,7 @@ class AddressSerializer(serializers.ModelSerializer):
         }
 
 
-class ShippingAddressSerializer(serializers.ModelSerializer):
+class ShippingAddressSerializer(QueryPlanMixin, serializers.ModelSerializer):
     location = LocationSerializer(required=False)
     
     class Meta:
@@ -153,7 +223,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ["product", "variant", "quantity", "size"]
 
 
-class CartItemDetailSerializer(serializers.ModelSerializer):
+class CartItemDetailSerializer(QueryPlanMixin, serializers.ModelSerializer):
     product = ProductSerializer()
     variant = ProductVariantSerializer()
     size = SizeSerializer()
@@ -163,7 +233,7 @@ class CartItemDetailSerializer(serializers.ModelSerializer):
         fields = ["id", "product", "variant", "quantity", "size", "price"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(QueryPlanMixin, serializers.ModelSerializer):
     items = CartItemDetailSerializer(many=True, read_only=True)
     
     class Meta:
@@ -171,15 +241,15 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "items", "created_at", "updated_at"]
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(QueryPlanMixin, serializers.ModelSerializer):
     variant = ProductVariantSerializer(read_only=True)
     
     class Meta:
         model = models.OrderItem
-        fields = ["id", "variant", "quantity", "price"]
+        fields = ["id", "product", "variant", "name", "sku", "size", "quantity", "price", "line_total"]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(QueryPlanMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     shipping_address = ShippingAddressSerializer(read_only=True)
     billing_address = AddressSerializer(read_only=True)
@@ -195,7 +265,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class WishlistItemSerializer(serializers.ModelSerializer):
+class WishlistItemSerializer(QueryPlanMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     
     class Meta:
@@ -203,7 +273,7 @@ class WishlistItemSerializer(serializers.ModelSerializer):
         fields = ["id", "product", "created_at"]
 
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(QueryPlanMixin, serializers.ModelSerializer):
     items = WishlistItemSerializer(many=True, read_only=True)
     
     class Meta:
@@ -217,13 +287,13 @@ class WishlistCreateSerializer(serializers.ModelSerializer):
         fields = ["product"]
 
 
-class ReviewUserSerializer(serializers.ModelSerializer):
+class ReviewUserSerializer(QueryPlanMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Customer
         fields = ["pic", "username"]
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(QueryPlanMixin, serializers.ModelSerializer):
     user = ReviewUserSerializer(read_only=True)
     
     class Meta:
@@ -1,9 +1,98 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate
 from django.dispatch import receiver
+from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
+from . import models, search, caching, identifiers
+from . import cart
+from .authentications import token_cache
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance=None, **kwargs):
+    # Logout deletes the token
+    token_cache.invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=models.Customer)
+def forget_cached_user(sender, instance=None, created=False, update_fields=None, **kwargs):
+    """Any change to a user (password reset, deactivation, profile) drops their cached token entry."""
+    if created or (update_fields is not None and set(update_fields) == {"last_login"}):
+        return
+    token_cache.invalidate(list(Token.objects.filter(user_id=instance.pk).values_list("key", flat=True)))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=models.Customer)
+def sync_login_identifiers(sender, instance=None, update_fields=None, **kwargs):
+    """Keep the username, email and phone a user logs in with indexed."""
+    if update_fields is not None and not {"username", "email", "phone"} & set(update_fields):
+        return
+    identifiers.sync(instance)
+
+
+@receiver(pre_migrate)
+def enable_postgres_extensions(sender, using="default", **kwargs):
+    """The trigram index on Product.name needs pg_trgm before Main migrates."""
+    if sender.name != "Main":
+        return
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+@receiver(pre_migrate)
+def merge_duplicate_cart_lines(sender, using="default", **kwargs):
+    """cartitem_user_product_size_uniq can't be added while old cart lines repeat; fold them first."""
+    if sender.name != "Main":
+        return
+    connection = connections[using]
+    table = models.CartItem._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return
+        if "cartitem_user_product_size_uniq" in connection.introspection.get_constraints(cursor, table):
+            return
+    cart.merge_duplicate_lines()
+
+
+@receiver(post_migrate)
+def backfill_login_identifiers(sender, using="default", **kwargs):
+    """
+    Fill LoginIdentifier on the migrate that creates it. CustomAuthBackend
+    only reads that table, so existing users could not log in until it is.
+    """
+    if sender.name != "Main":
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if models.LoginIdentifier._meta.db_table not in connection.introspection.table_names(cursor):
+            return
+    if models.LoginIdentifier.objects.exists() or not User.objects.exists():
+        return
+    identifiers.rebuild()
+
+
+@receiver(post_save, sender=models.Product)
+def update_product_search_vector(sender, instance=None, **kwargs):
+    search.refresh_search_vectors(models.Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+@receiver(post_save, sender=models.ProductImage)
+@receiver(post_delete, sender=models.ProductImage)
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    # Bump after commit so a concurrent reader can't cache pre-commit rows
+    # under the new version.
+    transaction.on_commit(lambda: caching.bump_version(caching.CATALOG))
@@ -1,3 +1,1712 @@
-from django.test import TestCase
+import socketserver
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from .authentications import CachedTokenAuthentication, LocalLRU, token_cache
+from . import (
+    campaigns, cart, caching, cards, checkout, facets, idempotency, identifiers, mailer, models, notifications,
+    payments, pricing, read_models, reconcile, serializers, signals, trending, views,
+)
+
+
+def make_products(count, category=None, **extra):
+    category = category or models.Category.objects.create(name="Men", slug="men")
+    products = []
+    for index in range(count):
+        product = models.Product.objects.create(
+            name=f"Shirt {index}",
+            slug=f"shirt-{category.slug}-{index}",
+            category=category,
+            market_price=1000,
+            selling_price=800,
+            **extra,
+        )
+        models.ProductImage.objects.create(product=product, image=f"product_images/{index}-a.jpg")
+        models.ProductImage.objects.create(product=product, image=f"product_images/{index}-b.jpg", is_primary=True)
+        products.append(product)
+    return products
+
+
+class ProductCardTests(TestCase):
+    def test_card_fields(self):
+        product = make_products(1)[0]
+        card = cards.build_product_cards(models.Product.objects.all(), "Popular")[0]
+        self.assertEqual(card["id"], product.id)
+        self.assertEqual(card["category"], "Men")
+        self.assertEqual(card["badge"], "-20%")
+        self.assertEqual(card["type"], "Popular")
+        self.assertTrue(card["img1"].endswith("0-b.jpg"))
+        self.assertTrue(card["img2"].endswith("0-a.jpg"))
+
+    def test_card_query_count_is_flat(self):
+        """Products, images and categories: three queries for any page size."""
+        category = models.Category.objects.create(name="Women", slug="women")
+        make_products(12, category=category)
+        with self.assertNumQueries(3):
+            cards.build_product_cards(cards.card_queryset(models.Product.objects.all()))
+
+        make_products(36, category=models.Category.objects.create(name="Kids", slug="kids"))
+        with self.assertNumQueries(3):
+            result = cards.build_product_cards(cards.card_queryset(models.Product.objects.all()))
+        self.assertEqual(len(result), 48)
+
+    def test_product_list_endpoint_does_not_scale_with_page(self):
+        make_products(4)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse("product_list"))
+        make_products(44, category=models.Category.objects.create(name="Kids", slug="kids"))
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.json()["products"]), 48)
+        self.assertEqual(len(small), len(large))
+
+
+class KeysetPaginationTests(TestCase):
+    def collect(self, **params):
+        """Follow ``next`` links until the catalog is exhausted."""
+        seen = []
+        response = self.client.get(reverse("product_list"), params)
+        while True:
+            body = response.json()
+            seen.extend(card["id"] for card in body["products"])
+            if not body["next"]:
+                return seen
+            response = self.client.get(body["next"])
+
+    def test_walks_catalog_without_gaps_or_duplicates(self):
+        products = make_products(7)
+        models.Product.objects.filter(pk__in=[p.pk for p in products[:4]]).update(selling_price=500)
+        for ordering in ["-created_at", "sellingPrice", "-sellingPrice", "stock", "name", "-name"]:
+            ids = self.collect(ordering=ordering, page_size=2)
+            self.assertEqual(sorted(ids), sorted(p.pk for p in products), ordering)
+
+    def test_deep_page_costs_the_same_as_first_page(self):
+        make_products(10)
+        first = self.client.get(reverse("product_list"), {"page_size": 3}).json()
+        with CaptureQueriesContext(connection) as page_one:
+            self.client.get(reverse("product_list"), {"page_size": 3})
+        with CaptureQueriesContext(connection) as page_two:
+            self.client.get(first["next"])
+        self.assertEqual(len(page_one), len(page_two))
+        self.assertNotIn("OFFSET", page_two.captured_queries[0]["sql"])
+
+    def test_cursor_is_bound_to_its_ordering(self):
+        make_products(3)
+        first = self.client.get(reverse("product_list"), {"page_size": 1}).json()
+        cursor = first["next"].split("cursor=")[1].split("&")[0]
+        response = self.client.get(reverse("product_list"), {"cursor": cursor, "ordering": "name"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        category = models.Category.objects.create(name="Men", slug="men")
+        self.linen = models.Product.objects.create(
+            name="Relaxed Shirt", slug="relaxed-shirt", category=category,
+            description="Breathable summer shirt", fabric=["linen"],
+            market_price=1000, selling_price=900,
+        )
+        self.hoodie = models.Product.objects.create(
+            name="Oversized Hoodie", slug="oversized-hoodie", category=category,
+            tags=["winter"], market_price=1500, selling_price=1200,
+        )
+
+    def search(self, text):
+        response = self.client.get(reverse("product_search"), {"q": text})
+        return [card["id"] for card in response.json()["results"]]
+
+    def test_matches_array_fields(self):
+        self.assertEqual(self.search("linen"), [self.linen.id])
+        self.assertEqual(self.search("winter"), [self.hoodie.id])
+
+    def test_name_ranks_above_description(self):
+        models.Product.objects.create(
+            name="Linen Trousers", slug="linen-trousers", category=self.linen.category,
+            market_price=1000, selling_price=900,
+        )
+        self.assertEqual(self.search("linen")[0], models.Product.objects.get(slug="linen-trousers").id)
+
+    def test_trigram_fallback_handles_typos(self):
+        self.assertEqual(self.search("hodie"), [self.hoodie.id])
+
+
+class HomeCacheTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+
+    def test_second_load_hits_no_tables(self):
+        make_products(6)
+        self.client.get(reverse("home"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(len(response.json()["newly_added"]), 6)
+
+    def test_product_changes_invalidate(self):
+        product = make_products(1)[0]
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = "Renamed"
+            product.save()
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.json()["newly_added"][0]["name"], "Renamed")
+
+    def test_category_delete_invalidates(self):
+        category = models.Category.objects.create(name="Sale", slug="sale")
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            category.delete()
+        names = [c["name"] for c in self.client.get(reverse("home")).json()["categories"]]
+        self.assertNotIn("Sale", names)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.men = models.Category.objects.create(name="Men", slug="men")
+        self.topwear = models.Category.objects.create(name="Topwear", slug="men-topwear", parent=self.men)
+        self.shirts = models.Category.objects.create(name="Shirts", slug="men-shirts", parent=self.topwear)
+        make_products(2, category=self.topwear)
+        make_products(3, category=self.shirts)
+
+    def test_counts_roll_up(self):
+        roots = self.client.get(reverse("category_tree")).json()["data"]
+        self.assertEqual(len(roots), 1)
+        men = roots[0]
+        self.assertEqual((men["own_products"], men["total_products"]), (0, 5))
+        topwear = men["children"][0]
+        self.assertEqual((topwear["own_products"], topwear["total_products"]), (2, 5))
+
+    def test_subtree_by_slug(self):
+        body = self.client.get(reverse("category_tree"), {"slug": "men-shirts"}).json()
+        self.assertEqual(body["data"]["total_products"], 3)
+        self.assertEqual([c["slug"] for c in body["path"]], ["men", "men-topwear"])
+        self.assertEqual(self.client.get(reverse("category_tree"), {"slug": "nope"}).status_code, 404)
+
+    def test_tree_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse("category_tree"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("category_tree"), {"slug": "men-topwear"})
+
+    def test_flat_listing_has_no_count_per_row(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse("categories")).json()["data"]
+        self.assertEqual({c["slug"]: c["total_products"] for c in data}["men-shirts"], 3)
+
+
+class CategoryPathTests(TestCase):
+    def setUp(self):
+        self.men = models.Category.objects.create(name="Men", slug="men")
+        self.women = models.Category.objects.create(name="Women", slug="women")
+        self.topwear = models.Category.objects.create(name="Topwear", slug="topwear", parent=self.men)
+        self.shirts = models.Category.objects.create(name="Shirts", slug="shirts", parent=self.topwear)
+        self.formal = models.Category.objects.create(name="Formal", slug="formal", parent=self.shirts)
+
+    def assertPathsConsistent(self):
+        rows = {c.pk: c for c in models.Category.objects.all()}
+        for category in rows.values():
+            expected, node = "", category
+            while node is not None:
+                expected = f"{node.pk}/{expected}"
+                node = rows.get(node.parent_id)
+            self.assertEqual(category.path, expected, category.slug)
+            self.assertEqual(category.depth, expected.count("/") - 1, category.slug)
+
+    def test_paths_on_create(self):
+        self.assertPathsConsistent()
+        self.assertEqual(models.Category.objects.get(pk=self.formal.pk).depth, 3)
+
+    def test_reparenting_moves_the_whole_subtree(self):
+        self.topwear.parent = self.women
+        self.topwear.save()
+        self.assertPathsConsistent()
+
+        self.shirts.refresh_from_db()
+        self.shirts.parent = None
+        self.shirts.save()
+        self.assertPathsConsistent()
+
+    def test_stale_instance_still_moves_correctly(self):
+        stale_shirts = models.Category.objects.get(pk=self.shirts.pk)
+        self.topwear.parent = self.women
+        self.topwear.save()
+        stale_shirts.parent = self.men
+        stale_shirts.save()
+        self.assertPathsConsistent()
+
+    def test_cannot_move_under_own_descendant(self):
+        self.men.parent = self.formal
+        with self.assertRaises(ValidationError):
+            self.men.save()
+        self.assertPathsConsistent()
+
+    def test_rebuild_repairs_bulk_updates(self):
+        models.Category.objects.filter(pk=self.topwear.pk).update(parent=self.women)
+        call_command("rebuild_category_paths", stdout=StringIO())
+        self.assertPathsConsistent()
+
+    def test_filter_includes_descendants_in_one_query(self):
+        make_products(2, category=self.topwear)
+        make_products(1, category=self.formal)
+        make_products(1, category=self.women)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("product_list"), {"category": self.men.pk})
+        self.assertEqual(len(response.json()["products"]), 3)
+        product_query = [q["sql"] for q in queries if "main_product" in q["sql"].lower()][0]
+        self.assertIn("LIKE", product_query)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.red = models.Color.objects.create(color="Red", hexcode="#f00")
+        self.blue = models.Color.objects.create(color="Blue", hexcode="#00f")
+        self.m = models.Size.objects.create(size="M")
+        category = models.Category.objects.create(name="Men", slug="men")
+        for product in make_products(3, category=category, color=self.red, fit="Slim", fabric=["cotton"]):
+            product.avail_sizes.add(self.m)
+        make_products(2, category=models.Category.objects.create(name="Kids", slug="kids"),
+                      color=self.blue, fit="Regular", fabric=["cotton", "linen"])
+
+    def get_facets(self, **params):
+        return self.client.get(reverse("product_list"), {"facets": 1, **params}).json()["facets"]
+
+    def counts(self, facet):
+        return {row["value"]: row["count"] for row in facet}
+
+    def test_counts_every_facet(self):
+        facets = self.get_facets()
+        self.assertEqual(self.counts(facets["color"]), {self.red.id: 3, self.blue.id: 2})
+        self.assertEqual(self.counts(facets["size"]), {self.m.id: 3})
+        self.assertEqual(self.counts(facets["fit"]), {"Slim": 3, "Regular": 2})
+        self.assertEqual(self.counts(facets["fabric"]), {"cotton": 5, "linen": 2})
+        self.assertEqual(self.counts(facets["price"])["500-1000"], 5)
+
+    def test_facet_ignores_its_own_selection(self):
+        facets = self.get_facets(color=self.red.id)
+        self.assertEqual(self.counts(facets["color"]), {self.red.id: 3, self.blue.id: 2})
+        self.assertEqual(self.counts(facets["fit"]), {"Slim": 3})
+
+    def test_one_query_per_facet_then_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            self.get_facets(fit="Slim")
+        with CaptureQueriesContext(connection) as second:
+            self.get_facets(fit="Slim")
+        self.assertEqual(len(first) - len(second), len(facets.FACET_PARAMS))
+
+
+class RelatedProductTests(TestCase):
+    def setUp(self):
+        self.men = models.Category.objects.create(name="Men", slug="men")
+        self.kids = models.Category.objects.create(name="Kids", slug="kids")
+        self.shirt = make_products(1, category=self.men, product_type="shirt", tags=["summer"], fabric=["linen"])[0]
+        self.twin = models.Product.objects.create(
+            name="Linen Shirt", slug="linen-shirt", category=self.men, product_type="shirt",
+            tags=["summer"], fabric=["linen"], market_price=1000, selling_price=850,
+        )
+        self.cousin = models.Product.objects.create(
+            name="Kids Tee", slug="kids-tee", category=self.kids, product_type="shirt",
+            market_price=300, selling_price=200,
+        )
+        self.stranger = models.Product.objects.create(
+            name="Wallet", slug="wallet", category=self.kids,
+            market_price=99999, selling_price=90000,
+        )
+
+    def related(self, slug):
+        response = self.client.get(reverse("related_products", args=[slug]))
+        return [card["id"] for card in response.json()["related_products"]]
+
+    def test_scores_shared_attributes(self):
+        call_command("rebuild_related_products", stdout=StringIO())
+        self.assertEqual(self.related(self.shirt.slug), [self.twin.id, self.cousin.id])
+
+    def test_lookup_is_a_single_query(self):
+        call_command("rebuild_related_products", stdout=StringIO())
+        with self.assertNumQueries(3):  # neighbours joined to products, images, categories
+            self.related(self.shirt.slug)
+
+    def test_falls_back_to_sample_without_neighbours(self):
+        ids = self.related(self.shirt.slug)
+        self.assertEqual(len(ids), 3)
+        self.assertNotIn(self.shirt.id, ids)
+        self.assertEqual(self.client.get(reverse("related_products", args=["missing"])).status_code, 404)
+
+
+def make_customer(username="asha", **extra):
+    return models.Customer.objects.create_user(
+        username=username, email=f"{username}@example.com", password="pass12345",
+        phone="+919876543210", **extra,
+    )
+
+
+def place_order(customer, products):
+    order = models.Order.objects.create(user=customer, customer=customer, total_price=0)
+    models.OrderItem.objects.bulk_create([
+        models.OrderItem(
+            order=order, product=product, name=product.name, quantity=1,
+            price=product.selling_price, line_total=product.selling_price,
+        )
+        for product in products
+    ])
+    return order
+
+
+@override_settings(BOUGHT_TOGETHER_SAFETY_LAG=timedelta(0))
+class BoughtTogetherTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.shirt, self.jeans, self.belt, self.cap = make_products(4)
+
+    def together(self, product):
+        response = self.client.get(reverse("bought_together", args=[product.slug]))
+        return [card["id"] for card in response.json()["bought_together"]]
+
+    def build(self, **options):
+        call_command("build_bought_together", stdout=StringIO(), **options)
+
+    def test_ranks_by_co_occurrence(self):
+        place_order(self.customer, [self.shirt, self.jeans, self.belt])
+        place_order(self.customer, [self.shirt, self.jeans])
+        place_order(self.customer, [self.cap])
+        self.build()
+        self.assertEqual(self.together(self.shirt), [self.jeans.id, self.belt.id])
+        self.assertEqual(self.together(self.cap), [])
+
+    def test_incremental_runs_only_read_new_orders(self):
+        place_order(self.customer, [self.shirt, self.belt])
+        self.build()
+        place_order(self.customer, [self.shirt, self.jeans])
+        place_order(self.customer, [self.shirt, self.jeans])
+        self.build()
+        self.assertEqual(self.together(self.shirt), [self.jeans.id, self.belt.id])
+        pair = models.ProductAffinity.objects.get(product=self.shirt, other=self.belt)
+        self.assertEqual(pair.count, 1)
+
+    def test_chunking_matches_single_pass(self):
+        for _ in range(3):
+            place_order(self.customer, [self.shirt, self.jeans, self.cap])
+        self.build(chunk_size=1, full=True)
+        chunked = set(models.ProductAffinity.objects.values_list("product", "other", "count"))
+        self.build(full=True)
+        self.assertEqual(chunked, set(models.ProductAffinity.objects.values_list("product", "other", "count")))
+
+    @override_settings(BOUGHT_TOGETHER_SAFETY_LAG=timedelta(minutes=10))
+    def test_recent_orders_wait_for_the_safety_lag(self):
+        settled = place_order(self.customer, [self.shirt, self.belt])
+        models.Order.objects.filter(pk=settled.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        place_order(self.customer, [self.shirt, self.jeans])
+        place_order(self.customer, [self.shirt, self.jeans])
+        self.build()
+        self.assertEqual(self.together(self.shirt), [self.belt.id])
+        models.Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        self.build()
+        self.assertEqual(self.together(self.shirt), [self.jeans.id, self.belt.id])
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.now = timezone.now()
+        self.old_hit, self.rising, self.quiet = make_products(3)
+
+    def emit(self, product, kind, count, days_ago):
+        models.ProductEvent.objects.bulk_create([
+            models.ProductEvent(product=product, kind=kind, created_at=self.now - timedelta(days=days_ago))
+            for _ in range(count)
+        ])
+
+    def scores(self):
+        return {p.pk: trending.current_score(p.trending_score, self.now) for p in models.Product.objects.all()}
+
+    def test_recent_activity_beats_old_volume(self):
+        self.emit(self.old_hit, models.ProductEvent.ORDER, 20, days_ago=21)  # 200 points, 7 half-lives old
+        self.emit(self.rising, models.ProductEvent.VIEW, 5, days_ago=0)
+        self.emit(self.rising, models.ProductEvent.WISHLIST, 1, days_ago=3)  # 3 points, one half-life old
+        trending.apply_events()
+        scores = self.scores()
+        self.assertAlmostEqual(scores[self.old_hit.pk], 200 / 2 ** 7, places=3)
+        self.assertAlmostEqual(scores[self.rising.pk], 5 + 1.5, places=3)
+        self.assertEqual(trending.trending_ids(), [self.rising.pk, self.old_hit.pk])
+
+    def test_batches_are_incremental_and_idempotent(self):
+        self.emit(self.rising, models.ProductEvent.VIEW, 7, days_ago=1)
+        self.assertEqual(trending.apply_events(batch_size=3), 7)
+        self.assertEqual(trending.apply_events(batch_size=3), 0)
+        self.emit(self.rising, models.ProductEvent.VIEW, 2, days_ago=1)
+        trending.apply_events(batch_size=3)
+        self.assertAlmostEqual(self.scores()[self.rising.pk], 9 * 2 ** (-1 / 3), places=3)
+
+    def test_events_committed_late_are_still_applied(self):
+        self.emit(self.rising, models.ProductEvent.VIEW, 2, days_ago=0)
+        first = models.ProductEvent.objects.order_by("id").first()
+        first.delete()
+        trending.apply_events()
+        # A lower id than one already applied, as when a long checkout commits after a view
+        models.ProductEvent.objects.create(id=first.id, product=self.rising, kind=models.ProductEvent.VIEW)
+        self.assertEqual(trending.apply_events(), 1)
+        self.assertAlmostEqual(self.scores()[self.rising.pk], 2, places=3)
+
+    def test_endpoint_and_home_read_the_score(self):
+        self.emit(self.quiet, models.ProductEvent.ORDER, 1, days_ago=0)
+        trending.apply_events()
+        response = self.client.get(reverse("trending_products"), {"category": "men"})
+        self.assertEqual([card["id"] for card in response.json()["trending"]], [self.quiet.pk])
+        self.assertEqual(views.build_home_sections()["popular"][0]["id"], self.quiet.pk)
+
+
+class QueryScalingMixin:
+    """Query-count harness: an endpoint's queries must not grow with the rows it returns."""
+
+    def assertQueriesDoNotScale(self, fetch, grow):
+        fetch()  # warm per-process state such as content types
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(fetch().status_code, 200)
+        grow()
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(fetch().status_code, 200)
+        self.assertEqual(
+            len(small), len(large), "\n".join(query["sql"] for query in large.captured_queries)
+        )
+
+
+class AccountFixtureMixin:
+    def setUp(self):
+        self.customer = make_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.color = models.Color.objects.create(color="Blue", hexcode="#00f")
+        self.sizes = [models.Size.objects.create(size=size) for size in ("S", "M")]
+        self.categories = iter(models.Category.objects.create(name=f"C{i}", slug=f"c{i}") for i in range(10))
+
+    def products(self, count):
+        products = make_products(count, category=next(self.categories), color=self.color, size=self.sizes[0], stock=50)
+        for product in products:
+            product.avail_sizes.set(self.sizes)
+            models.ProductVariant.objects.create(product=product, sku=f"sku-{product.pk}", price=700, stock=50)
+        return products
+
+    def fill_cart(self, count):
+        for product in self.products(count):
+            models.CartItem.objects.create(
+                user=self.customer, product=product, size=self.sizes[1], variant=product.variants.first()
+            )
+
+
+class SerializerQueryPlanTests(AccountFixtureMixin, QueryScalingMixin, TestCase):
+    def test_plan_follows_nested_serializers(self):
+        select, prefetch = serializers.query_plan(serializers.CartItemDetailSerializer)
+        self.assertEqual(select, ("product", "product__color", "product__size", "variant", "size"))
+        self.assertEqual(
+            [lookup for lookup, _, _ in prefetch],
+            ["product__images", "product__category", "product__avail_sizes", "product__variants"],
+        )
+
+    def test_category_count_comes_from_annotation(self):
+        self.fill_cart(1)
+        item = serializers.CartItemDetailSerializer.setup_queryset(models.CartItem.objects.all()).get()
+        with self.assertNumQueries(0):
+            self.assertEqual(item.product.category.total_products, 1)
+
+    def test_cart(self):
+        self.fill_cart(1)
+        self.assertQueriesDoNotScale(lambda: self.client.get(reverse("cart")), lambda: self.fill_cart(9))
+
+    def test_orders(self):
+        def add_orders(count):
+            for _ in range(count):
+                order = place_order(self.customer, self.products(2))
+                models.OrderItem.objects.create(
+                    order=order, variant=models.ProductVariant.objects.first(), quantity=1, price=700
+                )
+
+        add_orders(1)
+        self.assertQueriesDoNotScale(lambda: self.client.get(reverse("user_orders")), lambda: add_orders(5))
+
+    def test_wishlist(self):
+        wishlist = models.Wishlist.objects.create(user=self.customer)
+
+        def add_items(count):
+            for product in self.products(count):
+                models.WishlistItem.objects.create(wishlist=wishlist, product=product)
+
+        add_items(1)
+        self.assertQueriesDoNotScale(lambda: self.client.get(reverse("wishlist")), lambda: add_items(9))
+
+    def test_product_detail(self):
+        product = self.products(1)[0]
+
+        def add_images():
+            for index in range(5):
+                models.ProductImage.objects.create(product=product, image=f"product_images/extra-{index}.jpg")
+            product.avail_sizes.add(models.Size.objects.create(size="L"))
+
+        self.assertQueriesDoNotScale(
+            lambda: self.client.get(reverse("product_detail", args=[product.slug])), add_images
+        )
+
+
+class CompactReadTests(AccountFixtureMixin, TestCase):
+    def test_cart_lines(self):
+        self.fill_cart(2)
+        response = self.client.get(reverse("cart"), {"compact": 1})
+        line = response.json()[0]
+        self.assertEqual(line["product"]["name"], "Shirt 0")
+        self.assertEqual(line["size"]["size"], "M")
+        self.assertEqual(float(line["price"]), 700)
+
+    def test_compact_cart_is_four_queries(self):
+        self.fill_cart(10)
+        with self.assertNumQueries(4):  # cart rows, then products, images and categories for the cards
+            read_models.cart_lines(self.customer.pk)
+
+    def test_compact_orders(self):
+        order = place_order(self.customer, self.products(2))
+        # An order from before OrderItem, whose lines are linked cart items
+        order.products.add(models.CartItem.objects.create(product=self.products(1)[0], quantity=2))
+        with self.assertNumQueries(3):
+            rows = read_models.order_summaries(models.Order.objects.filter(customer=self.customer))
+        self.assertEqual([line["quantity"] for line in rows[0]["items"]], [1, 1, 2])
+
+    def test_compact_wishlist_matches_items(self):
+        wishlist = models.Wishlist.objects.create(user=self.customer)
+        for product in self.products(3):
+            models.WishlistItem.objects.create(wishlist=wishlist, product=product)
+        response = self.client.get(reverse("wishlist"), {"compact": "true"})
+        self.assertEqual(response.json()["count"], 3)
+
+
+class CartServiceTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.products(1)[0]
+
+    def test_add_upserts_one_line(self):
+        first, _ = cart.add(self.customer.pk, self.product.pk, self.sizes[0].pk, 2)
+        second, quantity = cart.add(self.customer.pk, self.product.pk, self.sizes[0].pk, 3)
+        self.assertEqual((first, quantity), (second, 5))
+        cart.add(self.customer.pk, self.product.pk, None)
+        cart.add(self.customer.pk, self.product.pk, None)
+        self.assertEqual(models.CartItem.objects.count(), 2)
+
+    def test_cap_is_enforced_in_sql(self):
+        line, _ = cart.add(self.customer.pk, self.product.pk, None, 19)
+        with self.assertRaises(ValidationError):
+            cart.add(self.customer.pk, self.product.pk, None, 2)
+        with self.assertRaises(ValidationError):
+            cart.increment(self.customer.pk, line, 2)
+        self.assertEqual(cart.increment(self.customer.pk, line), 20)
+
+    def test_merge_folds_lines_from_before_the_constraint(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE "{models.CartItem._meta.db_table}" DROP CONSTRAINT cartitem_user_product_size_uniq'
+            )
+        oldest, _, newest = [
+            models.CartItem.objects.create(user=self.customer, product=self.product, quantity=quantity)
+            for quantity in (9, 8, 7)
+        ]
+        order = place_order(self.customer, [])
+        order.products.add(oldest)
+
+        self.assertEqual(cart.merge_duplicate_lines(), 2)
+        line = models.CartItem.objects.get()
+        self.assertEqual((line.pk, line.quantity), (newest.pk, cart.MAX_QUANTITY))
+        # The order keeps the 9 it was placed with, as a snapshot, instead of the merged line
+        self.assertFalse(order.products.exists())
+        self.assertEqual(
+            [(item["name"], item["quantity"]) for item in read_models.order_lines([order.pk])[order.pk]],
+            [(self.product.name, 9)],
+        )
+
+    def test_reduce_deletes_at_zero(self):
+        line, _ = cart.add(self.customer.pk, self.product.pk, None, 2)
+        self.assertEqual(cart.decrement(self.customer.pk, line), 1)
+        self.assertEqual(cart.decrement(self.customer.pk, line), 0)
+        self.assertFalse(models.CartItem.objects.exists())
+
+    def test_cannot_touch_another_customers_line(self):
+        line, _ = cart.add(make_customer("ravi").pk, self.product.pk, None)
+        with self.assertRaises(models.CartItem.DoesNotExist):
+            cart.increment(self.customer.pk, line)
+
+    def test_cart_view_returns_the_new_cart(self):
+        line, _ = cart.add(self.customer.pk, self.product.pk, None, 1)
+        response = self.client.post(reverse("cart_items"), {"cartID": line, "action": "r"})
+        self.assertEqual(response.json()["message"], "Item Deleted")
+        self.assertEqual(response.json()["cart"], [])
+        response = self.client.post(reverse("add_to_cart"), {"product": self.product.pk, "size": self.sizes[0].pk, "quantity": 21})
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkCartTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.shirt, self.jeans, self.cap = self.products(3)
+
+    def post(self, operations):
+        return self.client.post(reverse("bulk_cart"), {"operations": operations}, format="json")
+
+    def test_merges_a_guest_cart(self):
+        cart.add(self.customer.pk, self.shirt.pk, self.sizes[0].pk, 2)
+        cart.add(self.customer.pk, self.cap.pk, None, 1)
+        response = self.post([
+            {"product": self.shirt.pk, "size": self.sizes[0].pk, "quantity": 3},
+            {"product": self.jeans.pk, "size": self.sizes[1].pk, "quantity": 1},
+            {"op": "remove", "product": self.cap.pk},
+        ])
+        self.assertEqual(response.json()["created"], 1)
+        self.assertEqual(
+            dict(models.CartItem.objects.values_list("product_id", "quantity")),
+            {self.shirt.pk: 5, self.jeans.pk: 1},
+        )
+
+    def test_writes_are_bulk_regardless_of_line_count(self):
+        items = self.products(10)
+        with CaptureQueriesContext(connection) as queries:
+            cart.apply_operations(self.customer.pk, [{"product": p.pk, "quantity": 2} for p in items])
+        self.assertEqual(len(queries), 5)  # products check, locked read, insert, plus the savepoint pair
+        self.assertEqual(models.CartItem.objects.count(), 10)
+
+    def test_batch_is_all_or_nothing(self):
+        response = self.post([
+            {"product": self.shirt.pk, "quantity": 1},
+            {"product": self.jeans.pk, "quantity": 15},
+            {"op": "add", "product": self.jeans.pk, "quantity": 6},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.CartItem.objects.exists())
+
+
+    def test_variants_must_belong_to_their_product(self):
+        jeans_variant = self.jeans.variants.get()
+        for variant in (jeans_variant.pk, 999999):
+            with self.subTest(variant):
+                response = self.post([
+                    {"product": self.shirt.pk, "quantity": 1},
+                    {"product": self.shirt.pk, "variant": variant, "quantity": 1},
+                ])
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("Operation 1", response.json()["error"])
+        self.assertFalse(models.CartItem.objects.exists())
+
+        self.assertEqual(self.post([{"product": self.jeans.pk, "variant": jeans_variant.pk}]).status_code, 200)
+        self.assertEqual(models.CartItem.objects.get().variant, jeans_variant)
+
+
+class PricingTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.shirt, self.jeans = self.products(2)  # selling 800, market 1000, variant at 700
+        cart.add(self.customer.pk, self.shirt.pk, None, 2)
+        cart.add(self.customer.pk, self.jeans.pk, None, 1, variant_id=self.jeans.variants.get().pk)
+
+    def test_summary_is_one_query(self):
+        with self.assertNumQueries(1):
+            summary = pricing.cart_summary(self.customer.pk)
+        self.assertEqual(summary["subtotal"], Decimal("2300.00"))  # 2 x 800 + 1 x 700 (variant price)
+        self.assertEqual(summary["list_total"], Decimal("2700.00"))  # variant has no market price
+        self.assertEqual(summary["discount"], Decimal("400.00"))
+        self.assertEqual((summary["item_count"], summary["line_count"]), (3, 2))
+
+    def test_empty_cart(self):
+        summary = pricing.cart_summary(make_customer("ravi").pk)
+        self.assertEqual((summary["subtotal"], summary["item_count"]), (Decimal("0.00"), 0))
+
+    def test_order_keeps_its_prices_after_the_catalog_changes(self):
+        response = self.client.post(reverse("create_cod_order"))
+        order = models.Order.objects.get(pk=response.json()["order_id"])
+        self.assertEqual(order.total_price, Decimal("2300.00"))
+        self.assertFalse(models.CartItem.objects.exists())
+
+        models.Product.objects.update(selling_price=5000)
+        models.ProductVariant.objects.all().delete()
+        items = {item.name: item for item in order.items.all()}
+        self.assertEqual(items["Shirt 0"].line_total, Decimal("1600.00"))
+        self.assertEqual(items["Shirt 1"].price, Decimal("700.00"))
+        self.assertIsNone(items["Shirt 1"].variant_id)
+        self.assertEqual(order.cart_total, Decimal("2300.00"))
+
+
+class CheckoutTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.shirt, self.jeans = self.products(2)
+        self.variant = self.jeans.variants.get()
+        cart.add(self.customer.pk, self.shirt.pk, self.sizes[0].pk, 3)
+        cart.add(self.customer.pk, self.jeans.pk, None, 2, variant_id=self.variant.pk)
+
+    def stock(self):
+        self.shirt.refresh_from_db()
+        self.variant.refresh_from_db()
+        return self.shirt.stock, self.variant.stock
+
+    def test_decrements_product_and_variant_stock(self):
+        order, created = checkout.place_order(self.customer, payment="cod")
+        self.assertTrue(created)
+        self.assertEqual(self.stock(), (47, 48))
+        self.assertEqual(order.items.count(), 2)
+        self.assertFalse(models.CartItem.objects.exists())
+
+    def test_short_stock_refuses_the_whole_order(self):
+        models.ProductVariant.objects.filter(pk=self.variant.pk).update(stock=1)
+        with self.assertRaises(checkout.OutOfStock):
+            checkout.place_order(self.customer, payment="cod")
+        self.assertEqual(self.stock(), (50, 1))
+        self.assertEqual(models.CartItem.objects.count(), 2)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_replayed_payment_returns_the_same_order(self):
+        order, _ = checkout.place_order(self.customer, payment="online", payment_reference="pay_123")
+        cart.add(self.customer.pk, self.shirt.pk, None, 1)
+        again, created = checkout.place_order(self.customer, payment="online", payment_reference="pay_123")
+        self.assertEqual((again.pk, created), (order.pk, False))
+        self.assertEqual(self.stock(), (47, 48))
+
+    def test_empty_cart(self):
+        checkout.place_order(self.customer, payment="cod")
+        with self.assertRaises(checkout.EmptyCart):
+            checkout.place_order(self.customer, payment="cod")
+
+    def test_query_count_does_not_scale_with_lines(self):
+        with CaptureQueriesContext(connection) as two_lines:
+            checkout.place_order(self.customer, payment="cod")
+        for product in self.products(8):
+            cart.add(self.customer.pk, product.pk, self.sizes[0].pk, 1)
+            cart.add(self.customer.pk, product.pk, self.sizes[1].pk, 1, variant_id=product.variants.get().pk)
+        with CaptureQueriesContext(connection) as sixteen_lines:
+            checkout.place_order(self.customer, payment="cod")
+        self.assertEqual(len(two_lines), len(sixteen_lines))
+
+    def cart_lines(self):
+        return sorted(models.CartItem.objects.values_list("product_id", "quantity"))
+
+    def test_buy_now_takes_stock_for_one_product_only(self):
+        # The cart already holds 3 of the same shirt in the same size; they stay there
+        order = checkout.buy_now(self.customer, self.shirt.pk, self.sizes[0].pk, 1)
+        self.assertEqual(self.stock(), (49, 50))
+        self.assertEqual(list(order.items.values_list("name", "quantity")), [("Shirt 0", 1)])
+        self.assertEqual(order.total_price, Decimal("800.00"))
+        self.assertEqual(self.cart_lines(), [(self.shirt.pk, 3), (self.jeans.pk, 2)])
+
+    def test_buy_now_drafts_reuse_one_order_and_hold_no_stock(self):
+        first = checkout.draft_order(self.customer, self.shirt.pk, self.sizes[0].pk)
+        second = checkout.draft_order(self.customer, self.jeans.pk, None)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(list(second.items.values_list("name", "quantity")), [("Shirt 1", 1)])
+        self.assertEqual(second.total_price, Decimal("800.00"))
+        self.assertEqual(self.stock(), (50, 50))
+        self.assertEqual(self.cart_lines(), [(self.shirt.pk, 3), (self.jeans.pk, 2)])
+
+
+class IdempotencyTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.products(1)[0]
+        cart.add(self.customer.pk, self.product.pk, None, 2)
+
+    def place(self, key, **data):
+        return self.client.post(reverse("create_cod_order"), data, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_the_stored_response_without_rerunning(self):
+        first = self.place("checkout-1")
+        cart.add(self.customer.pk, self.product.pk, None, 1)
+        with self.assertNumQueries(3):  # savepoint, locked key lookup, release: the view doesn't run
+            second = self.place("checkout-1")
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(models.Order.objects.count(), 1)
+        self.assertEqual(models.CartItem.objects.get().quantity, 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.place("checkout-1")
+        self.assertEqual(self.place("checkout-1", note="different").status_code, 422)
+
+    def test_without_a_key_requests_run_normally(self):
+        self.place("")
+        self.assertEqual(self.place("").status_code, 400)  # the cart is already empty
+
+    def test_expired_keys_run_again_and_are_evicted(self):
+        self.place("checkout-1")
+        models.IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(idempotency.evict_expired(), 1)
+        cart.add(self.customer.pk, self.product.pk, None, 1)
+        self.place("checkout-1")
+        self.assertEqual(models.Order.objects.count(), 2)
+
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    def test_concurrent_duplicates_create_one_order(self):
+        customer = make_customer()
+        product = make_products(1, stock=10)[0]
+        cart.add(customer.pk, product.pk, None, 1)
+        barrier = threading.Barrier(8)
+        order_ids = []
+
+        def run():
+            client = APIClient()
+            client.force_authenticate(customer)
+            barrier.wait()
+            try:
+                response = client.post(reverse("create_cod_order"), HTTP_IDEMPOTENCY_KEY="tap-tap-tap")
+                order_ids.append(response.json().get("order_id"))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(models.Order.objects.count(), 1)
+        self.assertEqual(set(order_ids), {models.Order.objects.get().pk})
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.product = make_products(1)[0]
+
+    def hammer(self, threads, calls, action):
+        """Run ``action`` ``calls`` times on each of ``threads`` threads at once; returns how many were refused."""
+        barrier = threading.Barrier(threads)
+        refused = []
+
+        def run():
+            barrier.wait()
+            try:
+                for _ in range(calls):
+                    try:
+                        action()
+                    except (ValidationError, models.CartItem.DoesNotExist):
+                        refused.append(1)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return len(refused)
+
+    def test_parallel_adds_are_not_lost_and_stop_at_the_cap(self):
+        refused = self.hammer(6, 5, lambda: cart.add(self.customer.pk, self.product.pk, None))
+        self.assertEqual(models.CartItem.objects.get().quantity, 20)
+        self.assertEqual(refused, 30 - 20)
+
+    def test_parallel_reductions_never_go_below_zero(self):
+        line, _ = cart.add(self.customer.pk, self.product.pk, None, 10)
+        refused = self.hammer(8, 2, lambda: cart.decrement(self.customer.pk, line))
+        self.assertFalse(models.CartItem.objects.exists())
+        self.assertEqual(refused, 16 - 10)
+
+
+class CheckoutStressTests(TransactionTestCase):
+    def test_concurrent_checkouts_never_oversell(self):
+        stock, buyers, threads = 25, 200, 40
+        product = make_products(1, stock=stock)[0]
+        customers = [
+            models.Customer.objects.create(username=f"buyer{index}", phone="+919876543210")  # skip password hashing
+            for index in range(buyers)
+        ]
+        for customer in customers:
+            cart.add(customer.pk, product.pk, None, 1)
+
+        barrier = threading.Barrier(threads)
+        outcomes = []
+
+        def run(batch):
+            barrier.wait()
+            try:
+                for customer in batch:
+                    try:
+                        checkout.place_order(customer, payment="cod")
+                        outcomes.append("ordered")
+                    except checkout.OutOfStock:
+                        outcomes.append("refused")
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(customers[index::threads],)) for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(outcomes.count("ordered"), stock)
+        self.assertEqual(outcomes.count("refused"), buyers - stock)
+        self.assertEqual(models.Order.objects.count(), stock)
+        self.assertEqual(sum(models.OrderItem.objects.values_list("quantity", flat=True)), stock)
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Just enough SMTP for smtplib: counts connections and accepted messages.
+    RCPT to an address in ``refuse`` gets 550; DATA for one in ``defer`` gets 451.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, refuse=(), defer=()):
+        super().__init__(("127.0.0.1", 0), StubSMTPHandler)
+        self.refuse, self.defer = set(refuse), set(defer)
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 stub ESMTP")
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().rstrip("\r\n")
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250-stub")
+                self.reply("250 8BITMIME")
+            elif command == "HELO":
+                self.reply("250 stub")
+            elif command == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                address = line.split(":", 1)[1].strip().strip("<>")
+                if address in server.refuse:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                if server.defer.intersection(recipients):
+                    self.reply("451 Try again later")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline().rstrip(b"\r\n") != b".":
+                    pass
+                with server.lock:
+                    server.messages.extend(recipients)
+                self.reply("250 Queued")
+            elif command in ("RSET", "NOOP"):
+                recipients = []
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def smtp_settings(server):
+    return override_settings(
+        MAIL_QUEUE_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+        EMAIL_HOST="127.0.0.1",
+        EMAIL_PORT=server.port,
+        EMAIL_USE_TLS=False,
+        EMAIL_HOST_USER="",
+        EMAIL_HOST_PASSWORD="",
+        DEFAULT_FROM_EMAIL="shop@example.com",
+    )
+
+
+class MailQueueTests(TestCase):
+    def test_newsletter_subscription_only_enqueues(self):
+        response = APIClient().post(reverse("newsletter_subscription"), {"email": "reader@example.com"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        job = models.EmailJob.objects.get()
+        self.assertEqual((job.to_email, job.status), ("reader@example.com", models.EmailJob.QUEUED))
+        self.assertEqual(mail.outbox, [])
+
+    @override_settings(MAIL_RETRY_DELAY=30, MAIL_MAX_RETRY_DELAY=600)
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        self.assertTrue(24 <= mailer.retry_delay(1) <= 36)
+        self.assertTrue(96 <= mailer.retry_delay(3) <= 144)
+        self.assertTrue(480 <= mailer.retry_delay(10) <= 720)
+
+    @override_settings(MAIL_LOCK_TIMEOUT=timedelta(minutes=2), EMAIL_TIMEOUT=30)
+    def test_batches_fit_within_the_lock_timeout(self):
+        for index in range(10):
+            mailer.enqueue(f"reader{index}@example.com", "Hello", text_body="Hi")
+        self.assertEqual(len(mailer.claim(50)), 3)
+
+    def test_each_outcome_is_saved_before_the_next_send(self):
+        for index in range(3):
+            mailer.enqueue(f"reader{index}@example.com", "Hello", text_body="Hi")
+        sent_before = []
+
+        class Sender:
+            def send(self, message):
+                sent_before.append(models.EmailJob.objects.filter(status=models.EmailJob.SENT).count())
+
+        self.assertEqual(mailer.deliver(mailer.claim(10), Sender()), 3)
+        self.assertEqual(sent_before, [0, 1, 2])
+
+
+class MailWorkerTests(TransactionTestCase):
+    def test_workers_reuse_one_connection_each(self):
+        for index in range(120):
+            mailer.enqueue(f"reader{index}@example.com", "Hello", text_body="Hi")
+        with StubSMTPServer() as server, smtp_settings(server):
+            sent = mailer.run_workers(workers=2, batch_size=20, drain=True)
+        self.assertEqual(sent, 120)
+        self.assertEqual(len(server.messages), 120)
+        self.assertLessEqual(server.connections, 2)
+        self.assertEqual(models.EmailJob.objects.filter(status=models.EmailJob.SENT).count(), 120)
+
+    def test_failures_back_off_or_fail_permanently(self):
+        flaky = mailer.enqueue("flaky@example.com", "Hello", text_body="Hi")
+        gone = mailer.enqueue("gone@example.com", "Hello", text_body="Hi")
+        fine = mailer.enqueue("fine@example.com", "Hello", text_body="Hi")
+        with StubSMTPServer(refuse={"gone@example.com"}, defer={"flaky@example.com"}) as server, smtp_settings(server):
+            sent = mailer.run_workers(workers=1, drain=True)
+        self.assertEqual(sent, 1)
+        self.assertEqual(server.messages, ["fine@example.com"])
+
+        flaky.refresh_from_db()
+        self.assertEqual((flaky.status, flaky.attempts), (models.EmailJob.QUEUED, 1))
+        self.assertGreater(flaky.available_at, timezone.now())
+        self.assertIn("SMTPDataError", flaky.last_error)
+        gone.refresh_from_db()
+        self.assertEqual((gone.status, gone.attempts), (models.EmailJob.FAILED, 1))
+        fine.refresh_from_db()
+        self.assertEqual(fine.status, models.EmailJob.SENT)
+
+    @override_settings(MAIL_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        job = mailer.enqueue("flaky@example.com", "Hello", text_body="Hi")
+        with StubSMTPServer(defer={"flaky@example.com"}) as server, smtp_settings(server):
+            mailer.run_workers(workers=1, drain=True)
+            models.EmailJob.objects.update(available_at=timezone.now())
+            mailer.run_workers(workers=1, drain=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.EmailJob.FAILED, 2))
+
+    def test_stale_sending_jobs_are_reclaimed(self):
+        job = mailer.enqueue("reader@example.com", "Hello", text_body="Hi")
+        models.EmailJob.objects.update(status=models.EmailJob.SENDING, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual([claimed.pk for claimed in mailer.claim(10)], [job.pk])
+        self.assertEqual(mailer.claim(10), [])
+
+
+class CampaignTests(TestCase):
+    def setUp(self):
+        models.Subscription.objects.bulk_create(
+            [models.Subscription(email=f"reader{index}@example.com") for index in range(240)]
+            + [models.Subscription(email=f"lapsed{index}@example.com", is_active=False) for index in range(10)]
+        )
+
+    def test_admin_action_only_queues_the_selected_subscribers(self):
+        admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin)
+        selected = list(models.Subscription.objects.order_by("id").values_list("id", flat=True)[:30])
+        selected += list(models.Subscription.objects.filter(is_active=False).values_list("id", flat=True)[:5])
+        response = self.client.post(
+            reverse("admin:Main_subscription_changelist"),
+            {"action": "send_bulk_confirmation_email", "_selected_action": selected},
+        )
+        self.assertEqual(response.status_code, 302)
+        campaign = models.EmailCampaign.objects.get()
+        self.assertEqual((campaign.status, campaign.total), (models.EmailCampaign.QUEUED, 30))
+        self.assertEqual(campaign.recipients.filter(status=models.CampaignRecipient.PENDING).count(), 30)
+        self.assertEqual(mail.outbox, [])
+
+    def test_sends_every_active_subscriber_over_one_connection(self):
+        campaign = models.EmailCampaign.objects.create(subject="News", text_body="Hi", all_subscribers=True)
+        campaigns.queue(campaign)
+        with StubSMTPServer() as server, smtp_settings(server):
+            sent = campaigns.send_pending(batch_size=50, rate=0)
+        self.assertEqual(sent, 240)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 240)
+        self.assertNotIn("lapsed0@example.com", server.messages)
+        campaign.refresh_from_db()
+        self.assertEqual((campaign.status, campaign.total, campaign.sent_count), (models.EmailCampaign.DONE, 240, 240))
+        self.assertEqual(campaign.progress, 100)
+
+    def test_records_failed_recipients_and_retries_them(self):
+        campaign = models.EmailCampaign.objects.create(subject="News", text_body="Hi")
+        campaigns.queue(campaign, models.Subscription.objects.filter(email__in=["reader1@example.com", "reader2@example.com"]))
+        with StubSMTPServer(refuse={"reader2@example.com"}) as server, smtp_settings(server):
+            campaigns.send_pending(rate=0)
+            failed = campaign.recipients.get(status=models.CampaignRecipient.FAILED)
+            self.assertEqual(failed.email, "reader2@example.com")
+            self.assertIn("SMTPRecipientsRefused", failed.error)
+            campaign.refresh_from_db()
+            self.assertEqual((campaign.status, campaign.sent_count, campaign.failed_count), (models.EmailCampaign.DONE, 1, 1))
+
+            server.refuse.clear()
+            self.assertEqual(campaigns.retry_failed(campaign), 1)
+            campaigns.send_pending(rate=0)
+        campaign.refresh_from_db()
+        self.assertEqual((campaign.status, campaign.sent_count, campaign.failed_count), (models.EmailCampaign.DONE, 2, 0))
+
+    def test_paused_campaign_is_not_sent(self):
+        campaign = models.EmailCampaign.objects.create(subject="News", text_body="Hi", all_subscribers=True)
+        campaigns.queue(campaign)
+        models.EmailCampaign.objects.filter(pk=campaign.pk).update(status=models.EmailCampaign.PAUSED)
+        with StubSMTPServer() as server, smtp_settings(server):
+            self.assertEqual(campaigns.send_pending(rate=0), 0)
+        self.assertEqual(server.connections, 0)
+
+    def test_throttle_keeps_to_the_rate(self):
+        throttle = campaigns.Throttle(rate=500)
+        started = time.monotonic()
+        for _ in range(5):
+            throttle.wait(20)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+
+class OrderNotificationTests(AccountFixtureMixin, QueryScalingMixin, TestCase):
+    def place_order(self, lines=2):
+        for product in self.products(lines):
+            cart.add(self.customer.pk, product.pk, self.sizes[0].pk, 2, variant_id=product.variants.get().pk)
+        order, _ = checkout.place_order(self.customer, payment="cod")
+        return order
+
+    def test_snapshot_lists_every_line(self):
+        order = self.place_order(3)
+        snapshot = notifications.order_snapshots([order.pk])[order.pk]
+        self.assertEqual(len(snapshot.lines), 3)
+        self.assertEqual(snapshot.total, Decimal("4200.00"))
+        self.assertEqual(snapshot.email, self.customer.email)
+
+    def test_snapshots_take_two_queries(self):
+        orders = [self.place_order() for _ in range(3)]
+        with self.assertNumQueries(2):
+            notifications.order_snapshots([order.pk for order in orders])
+
+    def test_rendering_runs_no_queries_and_inlines_css(self):
+        order = self.place_order(3)
+        snapshot = notifications.order_snapshots([order.pk])[order.pk]
+        with self.assertNumQueries(0):
+            subject, text, html = notifications.order_confirmation(snapshot)
+        self.assertEqual(subject, f"Order #{order.pk} confirmed")
+        self.assertNotIn("class=", html)
+        self.assertIn('style="', html)
+        self.assertEqual(html.count("<tr>"), 3 + 2)
+        for line in snapshot.lines:
+            self.assertIn(line.name, html)
+            self.assertIn(line.name, text)
+        self.assertIn("₹4,200.00", html)
+
+    def test_values_are_escaped(self):
+        snapshot = notifications.OrderSnapshot(
+            order_id=1, customer_name="<b>Asha</b>", email="asha@example.com", status="Shipped",
+            ordered_at=timezone.now(), total=Decimal("10"),
+            lines=(notifications.OrderLine(name="Tee & <Co>", quantity=1, unit_price=Decimal("10"), line_total=Decimal("10")),),
+        )
+        _, _, html = notifications.order_update(snapshot)
+        self.assertIn("&lt;b&gt;Asha&lt;/b&gt;", html)
+        self.assertIn("Tee &amp; &lt;Co&gt;", html)
+
+    def test_order_update_email_is_queued(self):
+        order = self.place_order()
+        request = APIRequestFactory().post("/", {"order_id": order.pk}, format="json")
+        force_authenticate(request, user=self.customer)
+        response = views.send_order_update_email(request)
+        self.assertEqual(response.status_code, 200)
+        job = models.EmailJob.objects.get()
+        self.assertEqual((job.to_email, job.subject), (self.customer.email, "Order Update - Pending"))
+        self.assertTrue(job.text_body)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(TestCase):
+    def test_opens_after_threshold_and_recovers_after_a_good_trial(self):
+        clock = FakeClock()
+        breaker = payments.CircuitBreaker(threshold=3, reset_after=30, clock=clock)
+        for _ in range(3):
+            breaker.before_call()
+            breaker.failed()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        with self.assertRaises(payments.GatewayUnavailable):
+            breaker.before_call()
+
+        clock.now = 30
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        breaker.before_call()
+        with self.assertRaises(payments.GatewayUnavailable):
+            breaker.before_call()  # only one trial at a time
+        breaker.succeeded()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_failed_trial_reopens(self):
+        clock = FakeClock()
+        breaker = payments.CircuitBreaker(threshold=1, reset_after=10, clock=clock)
+        breaker.failed()
+        clock.now = 10
+        breaker.before_call()
+        breaker.failed()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+
+class RecordingAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        self.timeout = kwargs["timeout"]
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"{}"
+        response.request = request
+        return response
+
+
+class TimeoutSessionTests(TestCase):
+    def test_requests_get_the_default_timeout(self):
+        session = payments.TimeoutSession((1, 2), pool_size=4)
+        adapter = RecordingAdapter()
+        session.mount("https://", adapter)
+        session.post("https://api.example.com/v1/orders", json={})
+        self.assertEqual(adapter.timeout, (1, 2))
+        session.post("https://api.example.com/v1/orders", json={}, timeout=5)
+        self.assertEqual(adapter.timeout, 5)
+
+
+@override_settings(PAYMENT_GATEWAY="fake", PAYMENT_BREAKER_THRESHOLD=2, PAYMENT_BREAKER_RESET=60)
+class FakeGatewayCheckoutTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        payments.reset_gateways()
+        payments.LATENCY.reset()
+        self.addCleanup(payments.reset_gateways)
+        self.gateway = payments.get_gateway()
+        for product in self.products(2):
+            cart.add(self.customer.pk, product.pk, self.sizes[0].pk, 1, variant_id=product.variants.get().pk)
+
+    def test_gateway_is_shared(self):
+        self.assertIs(payments.get_gateway(), self.gateway)
+        self.assertIsInstance(self.gateway, payments.FakeGateway)
+
+    def test_pay_and_verify_without_network(self):
+        response = self.client.post(reverse("create_razorpay_order"), {"amount": 1400}, format="json")
+        self.assertEqual(response.status_code, 200)
+        gateway_order = response.json()
+        self.assertEqual((gateway_order["amount"], gateway_order["key"]), (140000, "rzp_test_fake"))
+
+        paid = self.gateway.pay(gateway_order["order_id"])
+        response = self.client.post(reverse("verify_payment"), paid, format="json")
+        self.assertEqual(response.status_code, 200)
+        order = models.Order.objects.get(pk=response.json()["order_id"])
+        self.assertEqual(order.payment_reference, paid["razorpay_payment_id"])
+        self.assertEqual(payments.LATENCY.snapshot()["fake.create_order"]["count"], 1)
+
+    def test_bad_signature_is_refused(self):
+        order = self.gateway.create_order(1000)
+        paid = self.gateway.pay(order["id"])
+        paid["razorpay_signature"] = "0" * 64
+        response = self.client.post(reverse("verify_payment"), paid, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_outage_opens_the_breaker(self):
+        self.gateway.fail_next(5)
+        statuses = [
+            self.client.post(reverse("create_razorpay_order"), {"amount": 10}, format="json").status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [503, 503, 503])
+        self.assertEqual(self.gateway.failures, 3)  # the third call never reached the gateway
+        self.assertEqual(payments.breaker_states(), {"fake": "open"})
+        self.assertEqual(payments.LATENCY.snapshot()["fake.create_order"]["errors"], 2)
+
+
+@override_settings(PAYMENT_GATEWAY="fake")
+class PaymentReconciliationTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        payments.reset_gateways()
+        self.addCleanup(payments.reset_gateways)
+        self.gateway = payments.get_gateway()
+        self.shirt, self.jeans = self.products(2)
+        for product in (self.shirt, self.jeans):
+            cart.add(self.customer.pk, product.pk, self.sizes[0].pk, 1, variant_id=product.variants.get().pk)
+        # The amount is priced from the cart, whatever the client sends
+        response = self.client.post(reverse("create_razorpay_order"), {"amount": 1}, format="json")
+        self.gateway_order_id = response.json()["order_id"]
+
+    def deliver(self, payment_id, event="payment.captured", event_id=None):
+        body, headers = self.gateway.webhook(payment_id, event)
+        return APIClient().post(
+            reverse("payment_webhook"), data=body, content_type="application/json",
+            HTTP_X_RAZORPAY_SIGNATURE=headers["X-Razorpay-Signature"],
+            HTTP_X_RAZORPAY_EVENT_ID=event_id or headers["X-Razorpay-Event-Id"],
+        )
+
+    def test_checkout_records_an_intent(self):
+        intent = models.PaymentIntent.objects.get()
+        self.assertEqual((intent.gateway_order_id, intent.amount), (self.gateway_order_id, Decimal("1400")))
+        self.assertEqual(intent.status, models.PaymentIntent.CREATED)
+
+    def test_webhook_only_stores_the_event(self):
+        payment_id = self.gateway.pay(self.gateway_order_id)["razorpay_payment_id"]
+        self.assertEqual(self.deliver(payment_id, event_id="evt_1").status_code, 200)
+        self.assertEqual(self.deliver(payment_id, event_id="evt_1").status_code, 200)
+        self.assertEqual(models.PaymentEvent.objects.count(), 1)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_webhook_signature_is_checked(self):
+        payment_id = self.gateway.pay(self.gateway_order_id)["razorpay_payment_id"]
+        body, _ = self.gateway.webhook(payment_id)
+        response = APIClient().post(
+            reverse("payment_webhook"), data=body, content_type="application/json", HTTP_X_RAZORPAY_SIGNATURE="0" * 64
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.PaymentEvent.objects.exists())
+
+    def test_reconciler_places_a_paid_but_unverified_order(self):
+        payment_id = self.gateway.pay(self.gateway_order_id)["razorpay_payment_id"]
+        self.deliver(payment_id)
+        self.assertEqual(reconcile.process_all(), 1)
+
+        order = models.Order.objects.get()
+        self.assertEqual((order.payment_reference, order.status), (payment_id, "confirmed"))
+        self.assertEqual(order.items.count(), 2)
+        payment = models.Payment.objects.get()
+        self.assertEqual((payment.order, payment.status, payment.amount), (order, "Paid", Decimal("1400")))
+        intent = models.PaymentIntent.objects.get()
+        self.assertEqual((intent.status, intent.order), (models.PaymentIntent.PAID, order))
+        self.assertIsNotNone(models.PaymentEvent.objects.get().processed_at)
+
+    def test_verified_payment_is_not_applied_twice(self):
+        paid = self.gateway.pay(self.gateway_order_id)
+        self.assertEqual(self.client.post(reverse("verify_payment"), paid, format="json").status_code, 200)
+        self.assertEqual(models.Payment.objects.get().status, "Paid")
+
+        self.deliver(paid["razorpay_payment_id"])
+        reconcile.process_all()
+        self.assertEqual(models.Order.objects.count(), 1)
+        self.assertEqual(models.Payment.objects.count(), 1)
+
+    def test_unfulfillable_payment_is_flagged_and_retried(self):
+        payment_id = self.gateway.pay(self.gateway_order_id)["razorpay_payment_id"]
+        models.ProductVariant.objects.filter(product=self.shirt).update(stock=0)
+        self.deliver(payment_id)
+        reconcile.process_all()
+
+        self.assertFalse(models.Order.objects.exists())
+        self.assertEqual(models.PaymentIntent.objects.get().status, models.PaymentIntent.NEEDS_REVIEW)
+        event = models.PaymentEvent.objects.get()
+        self.assertIsNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("Not enough stock", event.error)
+
+    def test_underpaid_cart_is_held_for_review(self):
+        paid = self.gateway.pay(self.gateway_order_id)
+        # Items added after the gateway order was priced aren't covered by the payment
+        shoes = self.products(1)[0]
+        cart.add(self.customer.pk, shoes.pk, self.sizes[0].pk, 1, variant_id=shoes.variants.get().pk)
+        response = self.client.post(reverse("verify_payment"), paid, format="json")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(models.Order.objects.exists())
+        self.assertFalse(models.Payment.objects.exists())
+        intent = models.PaymentIntent.objects.get()
+        self.assertEqual(intent.status, models.PaymentIntent.NEEDS_REVIEW)
+        self.assertIn("2100", intent.note)
+        self.assertEqual(models.ProductVariant.objects.get(product=self.shirt).stock, 50)
+
+    def test_payment_short_of_the_order_total_confirms_nothing(self):
+        order, _ = checkout.place_order(self.customer, payment="online", payment_reference="pay_short")
+        errors = reconcile.settle([reconcile.GatewayPayment(
+            id="pay_short", order_id=self.gateway_order_id, amount=Decimal("1"), method="upi",
+            status=reconcile.CAPTURED,
+        )])
+
+        self.assertIn("pay_short", errors)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "pending")
+        self.assertFalse(models.Payment.objects.exists())
+        intent = models.PaymentIntent.objects.get()
+        self.assertEqual((intent.status, intent.order), (models.PaymentIntent.NEEDS_REVIEW, order))
+
+    def test_another_customers_gateway_order_is_refused(self):
+        paid = self.gateway.pay(self.gateway_order_id)
+        other = make_customer(username="ravi")
+        cart.add(other.pk, self.jeans.pk, self.sizes[0].pk, 1, variant_id=self.jeans.variants.get().pk)
+        client = APIClient()
+        client.force_authenticate(other)
+
+        self.assertEqual(client.post(reverse("verify_payment"), paid, format="json").status_code, 404)
+        self.assertFalse(models.Order.objects.exists())
+        self.assertEqual(models.PaymentIntent.objects.get().status, models.PaymentIntent.CREATED)
+
+    def test_settled_intent_cannot_be_verified_again(self):
+        paid = self.gateway.pay(self.gateway_order_id)
+        self.assertEqual(self.client.post(reverse("verify_payment"), paid, format="json").status_code, 200)
+        # A second payment id on the same gateway order
+        paid["razorpay_payment_id"] = "pay_again"
+        paid["razorpay_signature"] = self.gateway.sign(self.gateway_order_id, "pay_again")
+        self.assertEqual(self.client.post(reverse("verify_payment"), paid, format="json").status_code, 409)
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_sweep_settles_payments_whose_webhook_never_came(self):
+        payment_id = self.gateway.pay(self.gateway_order_id)["razorpay_payment_id"]
+        self.assertEqual(reconcile.sweep(), (0, 0))  # too recent to sweep
+
+        models.PaymentIntent.objects.update(created_at=timezone.now() - timedelta(minutes=20))
+        self.assertEqual(reconcile.sweep(), (1, 0))
+        self.assertEqual(models.Order.objects.get().payment_reference, payment_id)
+
+    def test_sweep_expires_abandoned_intents(self):
+        models.PaymentIntent.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(reconcile.sweep(), (0, 1))
+        self.assertEqual(models.PaymentIntent.objects.get().status, models.PaymentIntent.EXPIRED)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.local.clear()
+        self.customer = make_customer()
+        self.token = Token.objects.get_or_create(user=self.customer)[0]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def authenticate(self):
+        request = Request(APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Token {self.token.key}"))
+        return request, CachedTokenAuthentication().authenticate(request)
+
+    def test_resolves_the_customer_in_one_query_then_none(self):
+        with self.assertNumQueries(1):
+            request, (user, token) = self.authenticate()
+        self.assertIsInstance(user, models.Customer)
+        self.assertEqual((user.pk, token.key), (self.customer.pk, self.token.key))
+        self.assertEqual(request.customer, user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse("check_auth")).status_code, 200)
+
+    def test_shared_cache_backs_the_local_one(self):
+        self.authenticate()
+        token_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_views_get_their_own_copy(self):
+        _, (user, _) = self.authenticate()
+        user.first_name = "Changed"
+        _, (again, _) = self.authenticate()
+        self.assertEqual(again.first_name, "")
+
+    def test_logout_revokes_at_once(self):
+        self.authenticate()
+        self.assertEqual(self.client.get(reverse("logout")).status_code, 200)
+        self.assertEqual(self.client.get(reverse("check_auth")).status_code, 401)
+
+    def test_password_reset_drops_the_entry(self):
+        self.authenticate()
+        response = self.client.post(
+            reverse("reset_password"),
+            {"old_password": "pass12345", "new_password": "N3w-pass-word!", "confirm_password": "N3w-pass-word!"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+    def test_deactivated_user_is_refused(self):
+        self.authenticate()
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertEqual(self.client.get(reverse("check_auth")).status_code, 401)
+
+    def test_local_lru_evicts_oldest_and_expires(self):
+        lru = LocalLRU(size=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+        lru.ttl = -1
+        lru.set("d", 4)
+        self.assertIsNone(lru.get("d"))
+
+
+class CustomerResolutionTests(AccountFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        token_cache.local.clear()
+        self.token = Token.objects.get_or_create(user=self.customer)[0]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.product = self.products(1)[0]
+
+    def endpoints(self):
+        factory = APIRequestFactory()
+        auth = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        line = {"product": self.product.pk, "size": self.sizes[0].pk, "quantity": 1}
+        return {
+            "cart_items": lambda: self.client.get(reverse("cart_items")),
+            "add_to_cart": lambda: self.client.post(reverse("add_to_cart"), line, format="json"),
+            "bulk_cart": lambda: self.client.post(reverse("bulk_cart"), {"operations": [line]}, format="json"),
+            "user_orders": lambda: self.client.get(reverse("user_orders")),
+            "create_cod_order": lambda: self.client.post(reverse("create_cod_order")),
+            "wishlist": lambda: self.client.get(reverse("wishlist")),
+            "profile": lambda: views.profile(factory.get("/", **auth)),
+            "is_wholesale": lambda: views.isWholeSaleUser(factory.get("/", **auth)),
+            "check_wishlist_status": lambda: views.check_wishlist_status(factory.get("/", **auth), self.product.pk),
+        }
+
+    @staticmethod
+    def customer_lookups(queries):
+        return [
+            query["sql"] for query in queries.captured_queries
+            if '"username" =' in query["sql"] or 'FROM "Main_customer"' in query["sql"]
+        ]
+
+    def test_endpoints_do_not_look_the_customer_up(self):
+        endpoints = self.endpoints()
+        endpoints["cart_items"]()  # authenticate once; the token cache holds the Customer from here on
+        for name, call in endpoints.items():
+            with self.subTest(name), CaptureQueriesContext(connection) as queries:
+                response = call()
+                self.assertLess(response.status_code, 300, getattr(response, "data", response))
+            self.assertEqual(self.customer_lookups(queries), [])
+
+    def test_wishlist_items_are_found_by_product(self):
+        self.client.post(reverse("wishlist"), {"product_id": self.product.pk}, format="json")
+        factory = APIRequestFactory()
+        auth = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        response = views.check_wishlist_status(factory.get("/", **auth), self.product.pk)
+        self.assertTrue(response.data["is_in_wishlist"])
+
+        response = views.remove_from_wishlist(factory.delete("/", **auth), self.product.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(models.WishlistItem.objects.exists())
+        response = views.remove_from_wishlist(factory.delete("/", **auth), self.product.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_session_users_resolve_lazily_by_primary_key(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=self.customer.pk))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(reverse("cart_items")).status_code, 200)
+        lookups = self.customer_lookups(queries)
+        self.assertEqual(len(lookups), 1)
+        self.assertNotIn('"username" =', lookups[0])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(reverse("check_auth")).status_code, 200)
+        self.assertEqual(self.customer_lookups(queries), [])
+
+    def test_users_without_a_customer_get_the_same_404(self):
+        staff = User.objects.create_user(username="staff", password="pass12345")
+        self.token = Token.objects.get(user=staff)  # created by the post_save receiver
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        for name, call in self.endpoints().items():
+            with self.subTest(name):
+                response = call()
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data, {"error": "Customer not found"})
+
+
+class LoginIdentifierTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.customer.email = "Asha.K@Example.com"
+        self.customer.save()
+
+    def identifiers(self, user):
+        return set(models.LoginIdentifier.objects.filter(user=user).values_list("kind", "value"))
+
+    def test_saves_keep_the_identifiers_normalized(self):
+        self.assertEqual(self.identifiers(self.customer), {
+            ("username", "asha"), ("email", "asha.k@example.com"), ("phone", "+919876543210"),
+        })
+        self.customer.email = "asha@example.org"
+        self.customer.save()
+        self.assertIn(("email", "asha@example.org"), self.identifiers(self.customer))
+        self.assertNotIn(("email", "asha.k@example.com"), self.identifiers(self.customer))
+
+        with self.assertNumQueries(1):
+            self.customer.save(update_fields=["last_login"])
+
+    def test_logs_in_with_any_identifier(self):
+        for login in ("asha", "ASHA.K@example.com", "+91 98765 43210"):
+            with self.subTest(login):
+                with self.assertNumQueries(1):
+                    user = identifiers.find_user(login)
+                self.assertEqual(user.pk, self.customer.pk)
+                response = self.client.post(reverse("login"), {"username": login, "password": "pass12345"})
+                self.assertEqual(response.status_code, 200)
+        self.assertIsNone(authenticate(username="asha", password="wrong"))
+
+    def test_a_miss_still_hashes_once(self):
+        with mock.patch.object(User, "set_password", autospec=True) as set_password:
+            self.assertIsNone(authenticate(username="nobody@example.com", password="pass12345"))
+        set_password.assert_called_once()
+
+    def test_username_wins_and_shared_emails_name_nobody(self):
+        shadow = User.objects.create_user(username="asha.k@example.com", password="pass12345")
+        self.assertEqual(identifiers.find_user("asha.k@example.com").pk, shadow.pk)
+
+        User.objects.create_user(username="ravi", email="ASHA.K@example.com", password="pass12345")
+        self.assertIsNone(identifiers.find_user("Asha.K@example.com"))
+
+    def test_inactive_users_cannot_log_in(self):
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertIsNone(authenticate(username="asha", password="pass12345"))
+
+    def test_migrate_backfills_an_empty_table(self):
+        models.LoginIdentifier.objects.all().delete()
+        self.assertIsNone(identifiers.find_user("asha"))
+        signals.backfill_login_identifiers(sender=apps.get_app_config("Main"))
+        self.assertEqual(identifiers.find_user("asha").pk, self.customer.pk)
+        self.assertEqual(authenticate(username="+919876543210", password="pass12345").pk, self.customer.pk)
+
+    def test_rebuild_catches_writes_that_skip_signals(self):
+        User.objects.filter(pk=self.customer.pk).update(email="new@example.com")
+        self.assertIsNone(identifiers.find_user("new@example.com"))
+        call_command("rebuild_login_identifiers", stdout=StringIO())
+        self.assertEqual(identifiers.find_user("new@example.com").pk, self.customer.pk)
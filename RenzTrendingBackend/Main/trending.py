@@ -0,0 +1,119 @@
+"""
+Time-decayed popularity ("trending") scores.
+
+A product's score is the sum of its event weights, each decayed by
+``exp(-λ·age)``. Rather than decaying every row as time passes, an event at
+time ``t`` adds ``weight·exp(λ·(t - EPOCH))`` to ``Product.trending_score``.
+Every stored score is then the true score scaled by the same factor
+``exp(λ·(now - EPOCH))``, so ordering by the column is ordering by the decayed
+score, and applying events is a pure increment. Divide by that factor
+(``current_score``) to show the real value.
+
+With a three-day half-life the stored values double every three days, which
+stays well inside float range for years; move EPOCH forward (and rescale the
+column) long before then.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from . import caching, models
+
+NAMESPACE = "trending"
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HALF_LIFE = timedelta(days=3)
+DECAY_RATE = math.log(2) / HALF_LIFE.total_seconds()
+
+WEIGHTS = {
+    models.ProductEvent.VIEW: 1.0,
+    models.ProductEvent.WISHLIST: 3.0,
+    models.ProductEvent.ORDER: 10.0,
+}
+
+# Applied events older than this are deleted; their weight lives on in the score.
+EVENT_RETENTION = timedelta(days=30)
+
+
+def growth(moment):
+    return math.exp(DECAY_RATE * (moment - EPOCH).total_seconds())
+
+
+def event_value(kind, quantity, created_at):
+    return WEIGHTS[kind] * quantity * growth(created_at)
+
+
+def current_score(stored_score, now=None):
+    return stored_score / growth(now or timezone.now())
+
+
+def record_event(product_id, kind, quantity=1):
+    models.ProductEvent.objects.create(product_id=product_id, kind=kind, quantity=quantity)
+
+
+def record_events(product_quantities, kind):
+    """Record one event per ``(product_id, quantity)`` pair in a single INSERT."""
+    models.ProductEvent.objects.bulk_create(
+        [models.ProductEvent(product_id=pk, kind=kind, quantity=qty) for pk, qty in product_quantities]
+    )
+
+
+def apply_events(batch_size=10_000):
+    """
+    Fold unapplied events into ``Product.trending_score``; returns how many.
+
+    Events are claimed by their ``applied_at`` flag rather than an id
+    high-water mark: checkout records events inside its own transaction, so a
+    lower id can commit after a higher one, and a mark would skip it. Each
+    batch is claimed with ``SKIP LOCKED``, applied in one UPDATE for all
+    products it touches and flagged, in one transaction, so a crash never
+    applies a batch twice.
+    """
+    applied = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                models.ProductEvent.objects.filter(applied_at__isnull=True)
+                .order_by("id")
+                .select_for_update(skip_locked=True)
+                .values_list("id", "product_id", "kind", "quantity", "created_at")[:batch_size]
+            )
+            if not events:
+                break
+
+            deltas = {}
+            for _, product_id, kind, quantity, created_at in events:
+                deltas[product_id] = deltas.get(product_id, 0.0) + event_value(kind, quantity, created_at)
+            models.Product.objects.filter(pk__in=deltas).update(
+                trending_score=F("trending_score") + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                )
+            )
+            models.ProductEvent.objects.filter(pk__in=[event[0] for event in events]).update(
+                applied_at=timezone.now()
+            )
+            applied += len(events)
+
+    if applied:
+        caching.bump_version(NAMESPACE)
+    models.ProductEvent.objects.filter(
+        created_at__lt=timezone.now() - EVENT_RETENTION, applied_at__isnull=False
+    ).delete()
+    return applied
+
+
+def trending_ids(category=None, limit=24):
+    """Top product ids by trending score, optionally under ``category``, cached per version."""
+    def build():
+        products = models.Product.objects.filter(trending_score__gt=0)
+        if category is not None:
+            products = products.filter(**category.get_descendant_filter(prefix="category__"))
+        return list(products.order_by("-trending_score", "-id").values_list("id", flat=True)[:limit])
+
+    key = f"top:{category.pk if category else 'all'}:{limit}"
+    return caching.get_or_build(NAMESPACE, key, build, timeout=60 * 5)
@@ -2,5 +2,31 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+    path("auth/login/", views.CustomAuthToken.as_view(), name="login"),
+    path("auth/logout/", views.logout, name="logout"),
+    path("auth/check/", views.checkAuth, name="check_auth"),
+    path("auth/reset-password/", views.resetPassword, name="reset_password"),
     path("home/",views.Home, name="home"),
-]
\ No newline at end of file
+    path("categories/", views.getCategories, name="categories"),
+    path("categories/tree/", views.getCategoryTree, name="category_tree"),
+    path("products/", views.ProductListView.as_view(), name="product_list"),
+    path("products/search/", views.searchProducts, name="product_search"),
+    path("products/trending/", views.trendingProducts, name="trending_products"),
+    path("products/<slug:slug>/related/", views.getRelatedProducts, name="related_products"),
+    path("products/<slug:slug>/bought-together/", views.frequentlyBoughtTogether, name="bought_together"),
+    path("products/<slug:slug>/", views.getProduct, name="product_detail"),
+    path("cart/", views.get_cart, name="cart"),
+    path("cart/items/", views.Cart, name="cart_items"),
+    path("cart/add/", views.AddToCart, name="add_to_cart"),
+    path("cart/bulk/", views.bulkUpdateCart, name="bulk_cart"),
+    path("orders/", views.user_orders, name="user_orders"),
+    path("orders/cod/", views.create_cod_order, name="create_cod_order"),
+    path("orders/<int:oid>/", views.getorder, name="order_detail"),
+    path("payments/razorpay/order/", views.create_razorpay_order, name="create_razorpay_order"),
+    path("payments/verify/", views.verify_payment, name="verify_payment"),
+    path("payments/webhook/", views.payment_webhook, name="payment_webhook"),
+    path("payments/metrics/", views.payment_metrics, name="payment_metrics"),
+    path("wishlist/", views.wishlist, name="wishlist"),
+    path("newsletter/subscribe/", views.newsletter_subscription, name="newsletter_subscription"),
+    path("newsletter/unsubscribe/", views.newsletter_unsubscribe, name="newsletter_unsubscribe"),
+]
@@ -1,21 +1,26 @@
 import random
 from icecream import ic
-from . import models, serializers, filters
+from . import models, serializers, filters, cards, pagination, search, caching, facets
+from . import recommendations, bought_together, trending, read_models, pricing, checkout, idempotency
+from . import mailer, notifications, payments, reconcile, customers
+from . import categories as categories_service
+from . import cart as cart_service
 from django.contrib.auth.models import User
 from django.contrib.auth.models import Group
 from django.contrib.auth import authenticate
 from django.utils import timezone
 from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import OrderingFilter
 from rest_framework.authtoken.models import Token
 from django.core.exceptions import ValidationError
 from django.contrib.auth.password_validation import validate_password
+from django.db import IntegrityError, transaction
 
 # ic.disable()
 
@@ -109,7 +114,7 @@ def checkAuth(request):
 def resetPassword(req):
     if req.method == "POST":
         try:
-            user_obj = models.Customer.objects.get(username=req.user.username)
+            user_obj = req.user
             old_pass = req.data.get("old_password")
             new_pass = req.data.get("new_password")
             confirm_pass = req.data.get("confirm_password")
@@ -143,10 +148,6 @@ def resetPassword(req):
             return Response(
                 {"message": "Password has been reset"}, status=status.HTTP_200_OK
             )
-        except models.Customer.DoesNotExist:
-            return Response(
-                {"error": "User not found"}, status=status.HTTP_404_NOT_FOUND
-            )
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -156,7 +157,7 @@ def resetPassword(req):
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def getCategories(request):
-    categories = models.Category.objects.all()
+    categories = categories_service.annotated_categories()
     serializer = serializers.CategorySerializer(categories, many=True)
     cont = {
         "message": "Success",
@@ -165,49 +166,56 @@ def getCategories(request):
     return Response(cont)
 
 
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def getCategoryTree(request):
+    slug = request.query_params.get("slug")
+    if not slug:
+        tree = categories_service.get_category_tree()
+        return Response({"message": "Success", "data": tree["roots"]})
+
+    node, ancestors = categories_service.get_subtree(slug)
+    if node is None:
+        return Response({"error": "Category not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"message": "Success", "data": node, "path": ancestors})
+
+
 class ProductListView(generics.ListAPIView):
     queryset = models.Product.objects.all()
     serializer_class = serializers.ProductSerializer
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filter_backends = [DjangoFilterBackend]
     filterset_class = filters.ProductFilter
+    pagination_class = pagination.ProductCursorPagination
     permission_classes = [AllowAny]
 
     def get_queryset(self):
         queryset = super().get_queryset()
         query = self.request.query_params.get("search", None)
         if query:
-            queryset = queryset.filter(name__icontains=query)
+            queryset = search.match_products(queryset, query)
         return queryset
 
-    def format_product(self, product):
-        images = models.ProductImages.objects.filter(product=product)
-        discount_percentage = (
-            1 - (float(product.selling_price) / float(product.market_price))
-        ) * 100
-        badge = (
-            "Hot"
-            if product.buy_count > 100
-            else f"-{int(discount_percentage)}%" if discount_percentage > 0 else None
-        )
-        return {
-            "id": product.id,
-            "slug": product.slug,
-            "img1": str(images[0].image.url) if len(images) > 0 else None,
-            "img2": str(images[1].image.url) if len(images) > 1 else None,
-            "rating": random.randint(1, 5),
-            "oldPrice": product.market_price,
-            "newPrice": product.selling_price,
-            "badge": badge,
-            "category": (
-                product.categories[0].name if product.categories else "Uncategorized"
-            ),
-            "name": product.name,
-        }
-
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        formatted_products = [self.format_product(product) for product in queryset]
-        return Response({"products": formatted_products})
+        queryset = cards.card_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(cards.build_product_cards(page))
+        if request.query_params.get("facets") in ("1", "true"):
+            response.data["facets"] = facets.get_facets(
+                self.filterset_class, request.query_params, self.get_queryset()
+            )
+        return response
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def searchProducts(request):
+    query = request.query_params.get("q", "").strip()
+    if not query:
+        return Response({"error": "Search query is required"}, status=status.HTTP_400_BAD_REQUEST)
+    paginator = pagination.SearchPagination()
+    results = search.search_products(cards.card_queryset(models.Product.objects.all()), query)
+    page = paginator.paginate_queryset(results, request)
+    return paginator.get_paginated_response(cards.build_product_cards(page))
 
 
 @api_view(["POST"])
@@ -227,10 +235,13 @@ def getProduct(request, slug):
     if request.method == "GET":
         cont = {}
         try:
-            product = models.Product.objects.get(slug=slug)
+            product = serializers.ProductSerializer.setup_queryset(models.Product.objects.all()).get(slug=slug)
             cont["product"] = serializers.ProductSerializer(product).data
-            product_variants = models.ProductGroup.objects.filter(product=product).first()
-            cont["variants"] = serializers.ProductGroupSerial(product_variants).data
+            product_variants = serializers.ProductGroupSerializer.setup_queryset(
+                models.ProductGroup.objects.filter(product=product)
+            ).first()
+            cont["variants"] = serializers.ProductGroupSerializer(product_variants).data
+            trending.record_event(product.id, models.ProductEvent.VIEW)
             return Response(cont)
         except models.Product.DoesNotExist: return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e: return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -239,141 +250,168 @@ def getProduct(request, slug):
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def getRelatedProducts(request, slug):
-    """Get related products - simplified version that always works"""
+    """Related products from the precomputed neighbour table"""
     try:
-        # Get the current product
-        current_product = models.Product.objects.get(slug=slug)
-        
-        # Get 8 random products excluding the current one
-        related_products = models.Product.objects.exclude(id=current_product.id).order_by('?')[:8]
-        
-        # Format products
-        formatted_products = []
-        for product in related_products:
-            try:
-                # Get product images
-                product_images = list(product.product_images.all())
-                
-                # Calculate discount
-                discount_percentage = 0
-                if product.market_price > 0:
-                    discount_percentage = ((product.market_price - product.selling_price) / product.market_price) * 100
-                
-                # Determine badge
-                badge = None
-                if product.buy_count > 100:
-                    badge = "Hot"
-                elif discount_percentage > 5:
-                    badge = f"-{int(discount_percentage)}%"
-                
-                # Get category name
-                category_name = "Fashion"
-                try:
-                    categories = product.categories
-                    if categories:
-                        category_name = categories[0].name
-                except:
-                    pass
-                
-                formatted_product = {
-                    "id": product.id,
-                    "slug": product.slug,
-                    "img1": product_images[0].image.url if len(product_images) > 0 else None,
-                    "img2": product_images[1].image.url if len(product_images) > 1 else None,
-                    "rating": int(product.rating) if product.rating else 4,
-                    "oldPrice": float(product.market_price),
-                    "newPrice": float(product.selling_price),
-                    "badge": badge,
-                    "category": category_name,
-                    "name": product.name,
-                    "stock": product.stock,
-                }
-                formatted_products.append(formatted_product)
-            except Exception as e:
-                # Skip products that can't be formatted
-                continue
-        
+        products = cards.card_queryset(models.Product.objects.all())
+        related_products = list(recommendations.related_products(products, slug))
+
+        # No neighbours yet (new product, or the batch job hasn't run)
+        if not related_products:
+            current_product = models.Product.objects.only("id").get(slug=slug)
+            related_products = recommendations.sample_products(products, current_product.id)
+
+        formatted_products = cards.build_product_cards(related_products)
         return Response({
             "success": True,
             "related_products": formatted_products,
             "count": len(formatted_products)
         })
-        
+
     except models.Product.DoesNotExist:
         return Response({"error": "Product not found"}, status=404)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
-        
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def trendingProducts(request):
+    category = None
+    if request.query_params.get("category"):
+        try:
+            category = models.Category.objects.get(slug=request.query_params["category"])
+        except models.Category.DoesNotExist:
+            return Response({"error": "Category not found"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", 12)), 48))
+    except ValueError:
+        return Response({"error": "Limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = trending.trending_ids(category, limit)
+    index = cards.build_card_index(cards.card_queryset(models.Product.objects.filter(id__in=ids)))
+    formatted_products = [cards.with_type(index[pk], "Trending") for pk in ids if pk in index]
+    return Response({
+        "success": True,
+        "trending": formatted_products,
+        "count": len(formatted_products)
+    })
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def frequentlyBoughtTogether(request, slug):
+    products = cards.card_queryset(models.Product.objects.all())
+    formatted_products = cards.build_product_cards(bought_together.bought_together(products, slug))
+    if not formatted_products and not models.Product.objects.filter(slug=slug).exists():
+        return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        "success": True,
+        "bought_together": formatted_products,
+        "count": len(formatted_products)
+    })
+
+
+def serialize_cart(customer_id):
+    items = serializers.CartItemDetailSerializer.setup_queryset(
+        pricing.priced(models.CartItem.objects.filter(user_id=customer_id))
+    )
+    return serializers.CartItemDetailSerializer(items, many=True).data
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def addCartItem(request):
     if request.method == "POST":
-        ciSerial = serializers.CartItemSerializer(data=request.data)
-        user = models.Customer.objects.get(user=request.user)
-        product = models.Product.objects.get(id=request.data["product"])
-        size = request.data["size"]
-        if user.cart.filter(product=product, size=size).exists():
-            ciid = user.cart.get(product=product, size=size).id
-            cartItem = models.CartItem.objects.get(id=ciid)
-            cartItem.quantity += 1
-            cartItem.save()
-            return Response({"message": "Success"})
-        elif ciSerial.is_valid():
-            ciSerial.save()
-            user.cart.add(ciSerial.instance)
-            user.save()
-            return Response({"message": "Success"})
-        return Response(ciSerial.errors)
+        try:
+            user = request.customer
+            with transaction.atomic():
+                cart_service.add(
+                    user.pk,
+                    request.data["product"],
+                    request.data.get("size"),
+                    int(request.data.get("quantity", 1)),
+                    request.data.get("variant"),
+                )
+                cart = serialize_cart(user.pk)
+            return Response({"message": "Success", "cartItems": cart})
+        except IntegrityError:
+            return Response({"error": "Product or size not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def updateCartItem(request):
     if request.method == "POST":
-        user = models.Customer.objects.get(user=request.user)
-        cartItem = models.CartItem.objects.get(id=request.data["id"])
-        quantity = request.data["quantity"]
-        cd = request.data["cd"]
-        if cd or quantity == 0:
-            user.cart.remove(cartItem)
-            cartItem.delete()
-            cart = user.cart.all()
-            cartSerial = serializers.SendCartItemSerializer(cart, many=True)
-            cont = {
-                "message": "Deleted",
-                "cartItems": cartSerial.data,
-            }
-            return Response(cont)
-        elif quantity > 0:
-            cartItem.quantity = quantity
-            cartItem.save()
-            cart = user.cart.all()
-            cartSerial = serializers.SendCartItemSerializer(cart, many=True)
-            cont = {
-                "message": "Updated",
-                "cartItems": cartSerial.data,
-            }
+        try:
+            user = request.customer
+            with transaction.atomic():
+                if request.data.get("cd"):
+                    cart_service.remove(user.pk, request.data["id"])
+                    quantity = 0
+                else:
+                    quantity = cart_service.set_quantity(user.pk, request.data["id"], int(request.data["quantity"]))
+                cont = {
+                    "message": "Deleted" if quantity == 0 else "Updated",
+                    "cartItems": serialize_cart(user.pk),
+                }
             return Response(cont)
+        except models.CartItem.DoesNotExist:
+            return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@customers.customer_required
+def bulkUpdateCart(request):
+    """Apply a list of add/set/remove line operations in one transaction and return the cart once."""
+    operations = request.data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return Response({"error": "A non-empty list of operations is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        user = request.customer
+        with transaction.atomic():
+            created, updated, deleted = cart_service.apply_operations(user.pk, operations)
+            cart = serialize_cart(user.pk)
+        return Response({
+            "message": "Cart Updated",
+            "created": created,
+            "updated": updated,
+            "deleted": deleted,
+            "cartItems": cart,
+        })
+    except ValidationError as e:
+        return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError:
+        return Response({"error": "Cart changed during the update, please retry"}, status=status.HTTP_409_CONFLICT)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_cart(requset):
     if requset.method == "GET":
-        user = models.Customer.objects.get(user=requset.user)
-        cart = user.cart.all()
-        serializer = serializers.SendCartItemSerializer(cart, many=True)
+        if read_models.wants_compact(requset):
+            return Response(read_models.cart_lines(requset.user.pk))
+        cart = serializers.CartItemDetailSerializer.setup_queryset(
+            models.CartItem.objects.filter(user_id=requset.user.pk)
+        )
+        serializer = serializers.CartItemDetailSerializer(cart, many=True)
         return Response(serializer.data)
 
 
 @api_view(["GET", "POST", "PUT"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
+@idempotency.idempotent
 def order(request):
     if request.method == "POST" and request.data["type"] == "single-product":
         try:
-            user = models.Customer.objects.get(username=request.user.username)
+            user = request.customer
             product = models.Product.objects.get(id=request.data["product"])
             size = models.Size.objects.get(id=request.data["size"])
             qty = int(request.data["quantity"])
@@ -383,41 +421,22 @@ def order(request):
                     {"error": "Quantity must be greater than zero"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
+            if qty > cart_service.MAX_QUANTITY:
+                return Response(
+                    {"error": f"Quantity cannot exceed {cart_service.MAX_QUANTITY}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-            cartitem, created = models.CartItem.objects.get_or_create(
-                user=user,
-                product=product,
-                size=size,
-            )
-
-            makeorder, created = models.Order.objects.get_or_create(
-                customer=user,
-                status="pending",
-                tracking_number="123",
-                carrier="naane dhan",
-            )
-
-            if created:
-                cartitem.quantity = qty
-                cartitem.save()
-            else:
-                if qty > cartitem.quantity:
-                    cartitem.quantity = qty
-                    cartitem.save()
-
-            makeorder.products.add(cartitem)
-            makeorder.save()
+            # Retries are deduplicated by the Idempotency-Key header, so every call is a new order
+            makeorder = checkout.buy_now(user, product.pk, size.pk, qty)
 
             return Response(
                 {"message": "Order placed successfully", "order_id": makeorder.id},
                 status=status.HTTP_201_CREATED,
             )
 
-        except models.Customer.DoesNotExist:
-            return Response(
-                {"error": "Customer not found"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
+        except checkout.OutOfStock as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
         except models.Product.DoesNotExist:
             return Response(
                 {"error": "Product not found"},
@@ -462,7 +481,7 @@ def order(request):
 def getorder(request, oid):
     if request.method == "GET":
         try:
-            order = models.Order.objects.get(id=oid)
+            order = serializers.OrderSerializer.setup_queryset(models.Order.objects.all()).get(id=oid)
             serializer = serializers.OrderSerializer(order)
             return Response(serializer.data)
         except models.Order.DoesNotExist:
@@ -478,9 +497,10 @@ def getorder(request, oid):
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def isWholeSaleUser(request):
     if request.method == "GET":
-        user = models.Customer.objects.get(user=request.user)
+        user = request.customer
         return Response({"is_wholeSaleUser": user.is_wholeSaleUser})
 
 
@@ -493,81 +513,52 @@ def getWholeSaleProducts(request):
         return Response(serializer.data)
 
 
+def build_home_sections():
+    """Candidate cards for every Home section, as stored in the catalog cache."""
+    categories = categories_service.annotated_categories()
+    products = cards.card_queryset(models.Product.objects.all())
+
+    newly_added = list(products.order_by("-created_at")[:6])
+    popular = list(products.order_by("-trending_score", "-buy_count")[:6])
+    featured = list(products.order_by("-selling_price")[:6])
+
+    # Build every card once: one image query and one category query in total
+    card_index = cards.build_card_index(newly_added + popular + featured)
+
+    def format_products(products, category_type):
+        return [cards.with_type(card_index[p.pk], category_type) for p in products]
+
+    return {
+        "categories": list(serializers.CategorySerializer(categories, many=True).data),
+        "newly_added": format_products(newly_added, "Newly Added"),
+        "popular": format_products(popular, "Popular"),
+        "featured": format_products(featured, "Featured"),
+    }
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def Home(request):   #-> used
     cont = {}
     cont["login"] = request.user.username if request.user.is_authenticated else None
 
-    # Categories data
-    categories = models.Category.objects.all()
-    serializer = serializers.CategorySerializer(categories, many=True)
-    cont["categories"] = serializer.data
-
-    def get_random_products(queryset, num_items):
-        queryset_list = list(queryset)
-        random.shuffle(queryset_list)
-        return queryset_list[:num_items]
-
-    # Get products for each category
-    newly_added_products = get_random_products(
-        models.Product.objects.order_by("-created_at")[:6], 3
-    )
-    popular_products = get_random_products(
-        models.Product.objects.order_by("buy_count")[:6], 3
-    )
-    featured_products = get_random_products(
-        models.Product.objects.order_by("-selling_price")[:6], 3
-    )
-    newly_added_productss = get_random_products(
-        models.Product.objects.order_by("-created_at")[:6], 6
-    )
+    # Categories and the candidate lists come from the catalog cache; only the
+    # shuffling below runs per request.
+    sections = caching.get_or_build(caching.CATALOG, "home", build_home_sections)
+    cont["categories"] = sections["categories"]
 
-    # Helper function to format product data
-    def format_product(product, category_type):
-        images = models.ProductImages.objects.filter(product=product)
-        # Calculate discount badge if applicable
-        discount_percentage = (
-            1 - (float(product.selling_price) / float(product.market_price))
-        ) * 100
-        badge = (
-            "Hot"
-            if product.buy_count > 100
-            else f"-{int(discount_percentage)}%" if discount_percentage > 0 else None
-        )
-        return {
-            "id": product.pk,
-            "slug": product.slug,
-            "img1": str(images[0].image.url) if len(images) > 0 else None,
-            "img2": str(images[1].image.url) if len(images) > 1 else None,
-            "rating": random.randint(
-                1, 5
-            ),  # Assigning a random rating for demonstration
-            "oldPrice": product.market_price,
-            "newPrice": product.selling_price,
-            "badge": badge,
-            "category": (
-                product.categories[0].name if product.categories else "Uncategorized"
-            ),
-            "name": product.name,
-            "type": category_type,
-        }
+    def get_random_products(candidates, num_items):
+        return random.sample(candidates, min(num_items, len(candidates)))
 
     # Serialize each category separately
-    cont["newly_added"] = [
-        format_product(p, "Newly Added") for p in newly_added_productss
-    ]
-    cont["hot_release"] = [
-        format_product(p, "Newly Added") for p in newly_added_products
-    ]
-    cont["trendy"] = [format_product(p, "Popular") for p in popular_products]
-    cont["best_deal"] = [format_product(p, "Featured") for p in featured_products]
+    cont["newly_added"] = get_random_products(sections["newly_added"], 6)
+    cont["hot_release"] = get_random_products(sections["newly_added"], 3)
+    cont["trendy"] = get_random_products(sections["popular"], 3)
+    cont["best_deal"] = get_random_products(sections["featured"], 3)
 
     # Combine all products with their respective types
     cont["products"] = (
-        [format_product(p, "Newly Added") for p in newly_added_products]
-        + [format_product(p, "Popular") for p in popular_products]
-        + [format_product(p, "Featured") for p in featured_products]
+        cont["hot_release"] + cont["trendy"] + cont["best_deal"]
     )
 
     return Response(cont)
@@ -575,13 +566,14 @@ def Home(request):   #-> used
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def Review(req):
     if req.method == "POST":
         ic(req.data)
         serializer = serializers.PostReviewSerial(data=req.data)
         if serializer.is_valid():
             review_data = {
-                "user": models.Customer.objects.get(username=req.user.username),
+                "user": req.customer,
                 "product": models.Product.objects.get(slug=req.data["product"]),
                 "rating": str(req.data["rating"]).strip(),
                 "review": req.data["review"],
@@ -604,98 +596,88 @@ def GetReview(req, pid):
 
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def Cart(req):
-    user = models.Customer.objects.get(username=req.user.username)
+    user = req.customer
     if req.method == "GET":
         cont = {}
-        cartitem = models.CartItem.objects.filter(user=user)
-        cont["cart"] = serializers.SendCartItemSerializer(cartitem, many=True).data
+        if read_models.wants_compact(req):
+            cont["cart"] = read_models.cart_lines(user.pk)
+            return Response(cont)
+        cartitem = serializers.CartItemDetailSerializer.setup_queryset(
+            pricing.priced(models.CartItem.objects.filter(user=user))
+        )
+        cont["cart"] = serializers.CartItemDetailSerializer(cartitem, many=True).data
+        cont["summary"] = pricing.cart_summary(user.pk)
         return Response(cont)
 
     if req.method == "POST":
         cont = {}
-        cart = models.CartItem.objects.get(pk=req.data["cartID"])
-        if req.data["action"] == "r":
-            cont["message"] = "One Item Reduced"
-            if cart.quantity == 1:
-                cont["message"] = "Item Deleted"
-                cart.delete()
-            cart.quantity -= 1
-            cart.save()
-        elif req.data["action"] == "a":
-            cont["message"] = "One Item Added"
-            cart.quantity += 1
-            cart.save()
-        elif req.data["action"] == "d":
-            cont["message"] = "Item Deleted"
-            cart.delete()
-        cont["cart"] = serializers.SendCartItemSerializer(
-            models.CartItem.objects.filter(user=user),
-            many=True,
-        ).data
+        actions = {
+            "r": lambda line: cart_service.decrement(user.pk, line),
+            "a": lambda line: cart_service.increment(user.pk, line),
+            "d": lambda line: cart_service.remove(user.pk, line),
+        }
+        if req.data.get("action") not in actions:
+            return Response({"error": "Invalid action"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                quantity = actions[req.data["action"]](req.data["cartID"])
+                if req.data["action"] == "a":
+                    cont["message"] = "One Item Added"
+                elif quantity:
+                    cont["message"] = "One Item Reduced"
+                else:
+                    cont["message"] = "Item Deleted"
+                cont["cart"] = serialize_cart(user.pk)
+                cont["summary"] = pricing.cart_summary(user.pk)
+        except models.CartItem.DoesNotExist:
+            return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
         return Response(cont)
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def AddToCart(req):
     if req.method == "POST":
         ic(req.data)
         try:
-            product = models.Product.objects.get(pk=req.data["product"])
-            user = models.Customer.objects.get(username=req.user.username)
-            qty = int(req.data["quantity"])
-            size = models.Size.objects.get(pk=req.data["size"])
-
-            if qty <= 0: return Response({"error": "Quantity must be greater than zero"},status=status.HTTP_400_BAD_REQUEST,)
-
-            cartItem, created = models.CartItem.objects.get_or_create(user=user, product=product, size=size)
-
-            if created:
-                if qty > 20: return Response({"error": "Quantity cannot exceed 20"},status=status.HTTP_400_BAD_REQUEST,)
-                cartItem.quantity = qty
-                cartItem.color = (product.product_color)  # ithu irukardhala error varala, working good
-                cartItem.save()
-            else:
-                if cartItem.quantity + qty > 20: return Response({"error": "Total quantity cannot exceed 20"},status=status.HTTP_400_BAD_REQUEST,)
-                cartItem.quantity += qty
-                cartItem.save()
+            user = req.customer
+            with transaction.atomic():
+                cart_service.add(user.pk, req.data["product"], req.data["size"], int(req.data["quantity"]))
 
             return Response({"message": "Item added to cart successfully"},status=status.HTTP_200_OK,)
 
-        except models.Product.DoesNotExist: return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
-        except models.Size.DoesNotExist: return Response({"error": "Size not found"}, status=status.HTTP_404_NOT_FOUND)
+        except IntegrityError: return Response({"error": "Product or size not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e: return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e: return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
+@idempotency.idempotent
 def BuyNow(req):
     ic(req.data)
     if req.method == "POST" and req.data.get("type") == "PP": # PP - Product Page
         try:
-            customer = models.Customer.objects.get(username=req.user.username)
+            customer = req.customer
             product = models.Product.objects.get(pk=req.data.get("pid"))
             size = models.Size.objects.get(pk=req.data.get("sid"))
 
-            item, created = models.CartItem.objects.get_or_create(user=customer, product=product, size=size)
-            if created: item.save()
-            order = models.Order.objects.create(customer=customer, status="Not Placed")
-            order.products.add(item)
-            order.save()
+            order = checkout.draft_order(customer, product.pk, size.pk)
 
             return Response({"message": "Order Created Successfully", "order_id": order.id},status=status.HTTP_201_CREATED)
-        except models.Customer.DoesNotExist:return Response({"error": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
         except models.Product.DoesNotExist:return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
         except models.Size.DoesNotExist:return Response({"error": "Size not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     if req.method == "POST" and req.data.get("type") == "MP": # MP - Main Page
         cont = {}
-        try:
-            customer = models.Customer.objects.get(username=req.user.username)
-        except models.Customer.DoesNotExist:
-            return Response({"error": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
+        customer = req.customer
         
         pass
     
@@ -704,11 +686,12 @@ def BuyNow(req):
 
 @api_view(["GET", "POST", "PUT", "DELETE"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def profile(request):
     ic(request.data)
     if request.method == "GET":
-        user = models.Customer.objects.get(username=request.user.username)
-        piserializer = serializers.ProfileInfoSerial(user)
+        user = request.customer
+        piserializer = serializers.ProfileInfoSerializer(user)
         shippingAddresses = models.ShippingAddress.objects.filter(user=user)
         saserial = serializers.ShippingAddressSerializer(shippingAddresses, many=True)
         cont = {
@@ -718,8 +701,8 @@ def profile(request):
         return Response(cont)
 
     if request.method == "PUT" and request.data["type"] == "profileinfo":
-        user = models.Customer.objects.get(username=request.user.username)
-        serializer = serializers.ProfileInfoSerial(user, data=request.data)
+        user = request.customer
+        serializer = serializers.ProfileInfoSerializer(user, data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response({"message": "Profile Updated Successfully"})
@@ -728,7 +711,7 @@ def profile(request):
     if request.method == "PUT" and request.data["type"] == "addressUpdate":
         try:
             address_id = request.data.get("id")
-            user = models.Customer.objects.get(username=request.user.username)
+            user = request.customer
             address = models.ShippingAddress.objects.get(user=user, id=address_id)
             ic(address)
             serial = serializers.ShippingAddressSerializer(address, data=request.data)
@@ -751,7 +734,7 @@ def profile(request):
 
     if request.method == "POST" and request.data["type"] == "addressUpdate":
         try:
-            user = models.Customer.objects.get(username=request.user.username)
+            user = request.customer
             request.data["user"] = user.id
             serial = serializers.ShippingAddressSerializer(data=request.data)
             if serial.is_valid():
@@ -787,59 +770,58 @@ def profile(request):
 
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-import razorpay
-from django.conf import settings
+from django.views.decorators.http import require_POST
+import hashlib
 import json
 
 
 @csrf_exempt
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
+@idempotency.idempotent
 def verify_payment(request):
     if request.method == "POST":
         try:
             razorpay_payment_id = request.data.get("razorpay_payment_id")
             razorpay_order_id = request.data.get("razorpay_order_id")
-            razorpay_signature = request.data.get("razorpay_signature")            # Initialize Razorpay client with your secret key
-            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
-            # Verify the payment signature
-            params_dict = {
-                "razorpay_order_id": razorpay_order_id,
-                "razorpay_payment_id": razorpay_payment_id,
-                "razorpay_signature": razorpay_signature,
-            }
+            razorpay_signature = request.data.get("razorpay_signature")
+
+            # Verify the payment signature (local HMAC, no gateway round trip)
+            payments.get_gateway().verify_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature)
+
+            customer = request.customer
+            intent = models.PaymentIntent.objects.filter(gateway_order_id=razorpay_order_id, user=customer).first()
+            if intent is None:
+                return JsonResponse({"success": False, "message": "Unknown payment order"}, status=404)
+            order = models.Order.objects.filter(payment_reference=razorpay_payment_id, user=customer).first()
+            if order is not None and intent.status == models.PaymentIntent.PAID:
+                # A replayed payment id returns its order
+                return JsonResponse(
+                    {"success": True, "message": "Payment verified successfully", "order_id": order.id}
+                )
+            if intent.status not in (models.PaymentIntent.CREATED, models.PaymentIntent.FAILED):
+                return JsonResponse(
+                    {"success": False, "message": intent.note or "Payment order is already settled"}, status=409
+                )
 
-            client.utility.verify_payment_signature(params_dict)
+            # The gateway captures the whole gateway order, whose amount create_razorpay_order priced;
+            # settle places the order from the cart and confirms it only if that amount pays for it.
+            # The webhook for this payment then finds nothing left to do.
+            with transaction.atomic():
+                errors = reconcile.settle([reconcile.GatewayPayment(
+                    id=razorpay_payment_id, order_id=razorpay_order_id, amount=intent.amount, method="online",
+                    status=reconcile.CAPTURED,
+                )])
+            if errors:
+                return JsonResponse({"success": False, "message": errors[razorpay_payment_id]}, status=409)
+            order = models.Order.objects.get(payment_reference=razorpay_payment_id)
 
-            # Get customer and create order from cart items
-            customer = models.Customer.objects.get(username=request.user.username)
-            cart_items = models.CartItem.objects.filter(user=customer)
-            
-            if cart_items.exists():
-                # Create order
-                order = models.Order.objects.create(
-                    customer=customer,
-                    status="confirmed",
-                    payment="online",
-                    tracking_number=f"AG{razorpay_payment_id[-8:]}"
-                )
-                
-                # Add cart items to order
-                for item in cart_items:
-                    order.products.add(item)
-                
-                order.save()
-                
-                # Clear cart
-                cart_items.delete()
-
-            # If the signature is verified, handle payment success logic here
             return JsonResponse(
-                {"success": True, "message": "Payment verified successfully", "order_id": order.id if 'order' in locals() else None}
+                {"success": True, "message": "Payment verified successfully", "order_id": order.id}
             )
 
-        except razorpay.errors.SignatureVerificationError:
+        except payments.SignatureError:
             return JsonResponse(
                 {"success": False, "message": "Payment verification failed"}, status=400
             )
@@ -849,70 +831,90 @@ def verify_payment(request):
     # return JsonResponse({"success": False, "message": "Invalid request method"}, status=400)
 
 
+@api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 @csrf_exempt
 def create_razorpay_order(request):
     if request.method == "POST":
-        client = razorpay.Client(
-            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
-        )
+        gateway = payments.get_gateway()
         try:
-            data = json.loads(request.body)
-            amount = data.get("amount")
-            if not amount or not isinstance(amount, (int, float)):
-                return JsonResponse({"error": "Valid amount is required"}, status=400)
-
-            amount_in_paise = int(amount * 100)
-            order = client.order.create(
-                {
-                    "amount": amount_in_paise,
-                    "currency": "INR",
-                    "payment_capture": "1",
-                }
+            # Charge what the cart costs now; an amount sent by the client is ignored
+            customer = request.customer
+            summary = pricing.cart_summary(customer.pk)
+            if not summary["line_count"]:
+                return JsonResponse({"error": "Cart is empty"}, status=400)
+
+            amount_in_paise = int((summary["subtotal"] * 100).to_integral_value(ROUND_HALF_UP))
+            order = gateway.create_order(amount_in_paise, currency="INR")
+            # Lets the reconciler place the order if the customer pays but never comes back to verify
+            models.PaymentIntent.objects.create(
+                user=customer, gateway_order_id=order["id"], amount=Decimal(order["amount"]) / 100,
+                currency=order["currency"],
             )
 
-            ic(order)
             return JsonResponse(
                 {
                     "order_id": order["id"],
-                    "key": settings.RAZORPAY_KEY_ID,
+                    "key": gateway.public_key,
                     "amount": order["amount"],
                     "currency": order["currency"],
                 }
             )
 
+        except payments.GatewayUnavailable as e:
+            return JsonResponse({"error": str(e)}, status=503)
+        except payments.GatewayError as e:
+            return JsonResponse({"error": str(e)}, status=502)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
     return JsonResponse({"error": "Invalid method"}, status=405)
 
 
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """
+    Razorpay webhook: check the signature and store the event; the
+    reconcile_payments command applies it. Redeliveries are acknowledged too.
+    """
+    try:
+        payments.get_gateway().verify_webhook(request.body, request.headers.get("X-Razorpay-Signature"))
+    except payments.SignatureError:
+        return JsonResponse({"error": "Invalid signature"}, status=400)
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    event_id = request.headers.get("X-Razorpay-Event-Id") or hashlib.sha256(request.body).hexdigest()
+    reconcile.ingest(event_id, body)
+    return JsonResponse({"status": "ok"})
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def payment_metrics(request):
+    """Latency histograms per gateway call and the state of each gateway's circuit breaker"""
+    return Response({
+        "latency": payments.LATENCY.snapshot(),
+        "breakers": payments.breaker_states(),
+    })
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
+@idempotency.idempotent
 def create_cod_order(request):
     if request.method == "POST":
         try:
-            customer = models.Customer.objects.get(username=request.user.username)
-            cart_items = models.CartItem.objects.filter(user=customer)
-            
-            if not cart_items.exists():
-                return JsonResponse({"success": False, "message": "Cart is empty"}, status=400)
-            
-            # Create order
-            order = models.Order.objects.create(
-                customer=customer,
-                status="pending",
+            customer = request.customer
+            order, _ = checkout.place_order(
+                customer,
                 payment="cod",
-                tracking_number=f"AG{random.randint(10000000, 99999999)}"
+                status="pending",
+                tracking_number=f"AG{random.randint(10000000, 99999999)}",
             )
-            
-            # Add cart items to order
-            for item in cart_items:
-                order.products.add(item)
-            
-            order.save()
-            
-            # Clear cart
-            cart_items.delete()
 
             return JsonResponse({
                 "success": True, 
@@ -920,8 +922,10 @@ def create_cod_order(request):
                 "order_id": order.id
             })
 
-        except models.Customer.DoesNotExist:
-            return JsonResponse({"success": False, "message": "Customer not found"}, status=404)
+        except checkout.EmptyCart as e:
+            return JsonResponse({"success": False, "message": str(e)}, status=400)
+        except checkout.OutOfStock as e:
+            return JsonResponse({"success": False, "message": str(e)}, status=409)
         except Exception as e:
             return JsonResponse({"success": False, "message": str(e)}, status=500)
     
@@ -929,16 +933,18 @@ def create_cod_order(request):
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def user_orders(request):
     """Get all orders for the authenticated user"""
     if request.method == "GET":
         try:
-            customer = models.Customer.objects.get(username=request.user.username)
+            customer = request.customer
             orders = models.Order.objects.filter(customer=customer).exclude(status="not_placed").order_by('-created_at')
+            if read_models.wants_compact(request):
+                return Response(read_models.order_summaries(orders))
+            orders = serializers.OrderSerializer.setup_queryset(orders)
             serializer = serializers.OrderSerializer(orders, many=True)
             return Response(serializer.data)
-        except models.Customer.DoesNotExist:
-            return Response({"error": "Customer not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -982,17 +988,23 @@ def update_order_tracking(request):
 
 @api_view(["GET", "POST", "DELETE"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def wishlist(request):
     """
     GET: Get user's wishlist
     POST: Add product to wishlist
     DELETE: Remove product from wishlist
     """
-    user = models.Customer.objects.get(username=request.user.username)
+    user = request.customer
     
     if request.method == "GET":
+        if read_models.wants_compact(request):
+            items = read_models.wishlist_items(user.pk)
+            return Response({"success": True, "items": items, "count": len(items)})
         try:
-            wishlist_items = models.Wishlist.objects.filter(user=user).order_by('-created_at')
+            wishlist_items = serializers.WishlistSerializer.setup_queryset(
+                models.Wishlist.objects.filter(user=user).order_by('-created_at')
+            )
             serializer = serializers.WishlistSerializer(wishlist_items, many=True)
             return Response({
                 "success": True,
@@ -1010,13 +1022,13 @@ def wishlist(request):
             
             product = models.Product.objects.get(id=product_id)
             
-            # Check if already in wishlist
-            if models.Wishlist.objects.filter(user=user, product=product).exists():
+            # Add to wishlist unless it is already there
+            user_wishlist, _ = models.Wishlist.objects.get_or_create(user=user)
+            wishlist_item, created = models.WishlistItem.objects.get_or_create(wishlist=user_wishlist, product=product)
+            if not created:
                 return Response({"message": "Product already in wishlist"}, status=status.HTTP_200_OK)
-            
-            # Add to wishlist
-            wishlist_item = models.Wishlist.objects.create(user=user, product=product)
-            serializer = serializers.WishlistSerializer(wishlist_item)
+            trending.record_event(product.id, models.ProductEvent.WISHLIST)
+            serializer = serializers.WishlistItemSerializer(wishlist_item)
             return Response({
                 "success": True,
                 "message": "Product added to wishlist",
@@ -1035,7 +1047,7 @@ def wishlist(request):
                 return Response({"error": "Product ID is required"}, status=status.HTTP_400_BAD_REQUEST)
             
             product = models.Product.objects.get(id=product_id)
-            wishlist_item = models.Wishlist.objects.get(user=user, product=product)
+            wishlist_item = models.WishlistItem.objects.get(wishlist__user=user, product=product)
             wishlist_item.delete()
             
             return Response({
@@ -1045,7 +1057,7 @@ def wishlist(request):
             
         except models.Product.DoesNotExist:
             return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
-        except models.Wishlist.DoesNotExist:
+        except models.WishlistItem.DoesNotExist:
             return Response({"error": "Product not in wishlist"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1053,10 +1065,11 @@ def wishlist(request):
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def add_to_wishlist(request):
     """Add a product to user's wishlist"""
     try:
-        user = models.Customer.objects.get(username=request.user.username)
+        user = request.customer
         product_id = request.data.get('product_id')
         
         if not product_id:
@@ -1064,12 +1077,12 @@ def add_to_wishlist(request):
         
         product = models.Product.objects.get(id=product_id)
         
-        # Check if already in wishlist
-        if models.Wishlist.objects.filter(user=user, product=product).exists():
+        # Add to wishlist unless it is already there
+        user_wishlist, _ = models.Wishlist.objects.get_or_create(user=user)
+        _, created = models.WishlistItem.objects.get_or_create(wishlist=user_wishlist, product=product)
+        if not created:
             return Response({"message": "Product already in wishlist"})
-        
-        # Add to wishlist
-        wishlist_item = models.Wishlist.objects.create(user=user, product=product)
+        trending.record_event(product.id, models.ProductEvent.WISHLIST)
         return Response({
             "success": True,
             "message": "Product added to wishlist successfully"
@@ -1083,13 +1096,14 @@ def add_to_wishlist(request):
 
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def remove_from_wishlist(request, product_id):
     """Remove a product from user's wishlist"""
     try:
-        user = models.Customer.objects.get(username=request.user.username)
+        user = request.customer
         product = models.Product.objects.get(id=product_id)
         
-        wishlist_item = models.Wishlist.objects.get(user=user, product=product)
+        wishlist_item = models.WishlistItem.objects.get(wishlist__user=user, product=product)
         wishlist_item.delete()
         
         return Response({
@@ -1099,7 +1113,7 @@ def remove_from_wishlist(request, product_id):
         
     except models.Product.DoesNotExist:
         return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
-    except models.Wishlist.DoesNotExist:
+    except models.WishlistItem.DoesNotExist:
         return Response({"error": "Product not in wishlist"}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1107,13 +1121,14 @@ def remove_from_wishlist(request, product_id):
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@customers.customer_required
 def check_wishlist_status(request, product_id):
     """Check if a product is in user's wishlist"""
     try:
-        user = models.Customer.objects.get(username=request.user.username)
+        user = request.customer
         product = models.Product.objects.get(id=product_id)
         
-        is_in_wishlist = models.Wishlist.objects.filter(user=user, product=product).exists()
+        is_in_wishlist = models.WishlistItem.objects.filter(wishlist__user=user, product=product).exists()
         
         return Response({
             "success": True,
@@ -1144,18 +1159,12 @@ def newsletter_subscription(request):
         # Create subscription
         subscription = models.Subscription.objects.create(email=email)
         
-        # Send confirmation email (optional)
-        try:
-            from django.core.mail import send_mail
-            send_mail(
-                'Newsletter Subscription Confirmed',
-                f'Thank you for subscribing to our newsletter! You will now receive updates about our latest products and offers.',
-                settings.EMAIL_HOST_USER,
-                [email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            print(f"Email sending failed: {e}")
+        # Confirmation is queued; the mail workers send it
+        mailer.enqueue(
+            email,
+            'Newsletter Subscription Confirmed',
+            text_body='Thank you for subscribing to our newsletter! You will now receive updates about our latest products and offers.',
+        )
         
         return Response({'success': True, 'message': 'Successfully subscribed to newsletter'})
     except Exception as e:
@@ -1190,32 +1199,13 @@ def send_order_update_email(request):
         if not order_id:
             return Response({'error': 'Order ID is required'}, status=400)
         
-        order = models.Order.objects.get(id=order_id)
-        
-        # Get the first item for email template
-        first_item = order.products.first()
-        product_name = first_item.product.name if first_item else "Your order"
-        
-        # Send email notification
-        from .needs import send_email
-        from django.utils import timezone
-        send_email(
-            to_email=order.customer.email,
-            subject=f"Order Update - {order.status.replace('_', ' ').title()}",
-            username=order.customer.first_name or order.customer.username,
-            product_name=product_name,
-            quantity=order.total_products,
-            price=f"₹{first_item.price}" if first_item else "N/A",
-            total=f"₹{order.cart_total}",
-            address=f"{order.shipping_address.address}, {order.shipping_address.city}" if order.shipping_address else "N/A",
-            phone=order.shipping_address.phone if order.shipping_address else "N/A",
-            landmark=order.shipping_address.landmark if hasattr(order.shipping_address, 'landmark') and order.shipping_address.landmark else "N/A",
-            order_date=order.created_at
-        )
+        snapshot = notifications.order_snapshots([order_id]).get(int(order_id))
+        if snapshot is None:
+            return Response({'error': 'Order not found'}, status=404)
+        subject, text, html = notifications.order_update(snapshot)
+        mailer.enqueue(snapshot.email, subject, html_body=html, text_body=text)
         
-        return Response({'success': True, 'message': 'Email sent successfully'})
-    except models.Order.DoesNotExist:
-        return Response({'error': 'Order not found'}, status=404)
+        return Response({'success': True, 'message': 'Email queued'})
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
@@ -1225,7 +1215,7 @@ def get_order_analytics(request):
     """Get order analytics for admin dashboard"""
     try:
         from django.db.models import Count, Sum, Q
-        from datetime import datetime, timedelta
+        from datetime import timedelta
         from django.utils import timezone
         
         # Get date range (last 30 days)
@@ -1237,15 +1227,12 @@ def get_order_analytics(request):
         recent_orders = models.Order.objects.filter(created_at__gte=start_date).count()
         
         # Revenue statistics
-        total_revenue = models.Order.objects.aggregate(
-            total=Sum('cart_total')
-        )['total'] or 0
-        
-        recent_revenue = models.Order.objects.filter(
-            created_at__gte=start_date
-        ).aggregate(
-            total=Sum('cart_total')
-        )['total'] or 0
+        revenue = models.Order.objects.exclude(status="not_placed").aggregate(
+            total=Sum('total_price'),
+            recent=Sum('total_price', filter=Q(created_at__gte=start_date)),
+        )
+        total_revenue = revenue['total'] or 0
+        recent_revenue = revenue['recent'] or 0
         
         # Status breakdown
         status_breakdown = models.Order.objects.values('status').annotate(
@@ -1253,11 +1240,12 @@ def get_order_analytics(request):
         ).order_by('status')
         
         # Top products
-        top_products = models.CartItem.objects.values(
-            'product__name'
+        top_products = models.OrderItem.objects.values(
+            'product_id', 'name'
         ).annotate(
             total_quantity=Sum('quantity'),
-            total_orders=Count('order', distinct=True)
+            total_orders=Count('order', distinct=True),
+            revenue=Sum('line_total'),
         ).order_by('-total_quantity')[:5]
         
         return Response({
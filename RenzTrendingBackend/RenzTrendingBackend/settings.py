@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -20,6 +21,17 @@ load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
+# "razorpay", or "fake" for the in-process gateway used in tests and load runs (see Main/payments.py)
+PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'razorpay')
+PAYMENT_GATEWAY_TIMEOUT = (3.05, 10)  # connect, read seconds
+PAYMENT_GATEWAY_POOL_SIZE = 20
+PAYMENT_BREAKER_THRESHOLD = 5  # consecutive failures before calls fail fast
+PAYMENT_BREAKER_RESET = 30  # seconds before a trial call is let through
+# Reconciliation of webhooks and unverified payments (see Main/reconcile.py)
+PAYMENT_EVENT_MAX_ATTEMPTS = 5
+PAYMENT_SWEEP_AFTER = timedelta(minutes=15)
+PAYMENT_INTENT_EXPIRY = timedelta(days=1)
 SHIPROCKET_EMAIL = os.getenv('SHIPROCKET_EMAIL', '')
 SHIPROCKET_PASSWORD = os.getenv('SHIPROCKET_PASSWORD', '')
 SHIPROCKET_API_KEY = os.getenv('SHIPROCKET_API_KEY', '')
@@ -42,11 +54,15 @@ CORS_ALLOW_HEADERS = (
     "accept",
     "authorization",
     "content-type",
+    "idempotency-key",
     "user-agent",
     "x-csrftoken",
     "x-requested-with",
 )
 
+# Set on replayed idempotent responses (see Main/idempotency.py)
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed"]
+
 CORS_ALLOW_METHODS = (
     "DELETE",
     "GET",
@@ -67,6 +83,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     "Main.apps.MainConfig",
     'rest_framework',
     'rest_framework.authtoken',
@@ -82,6 +99,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Main.customers.CustomerMiddleware',  # lazy request.customer (see Main/customers.py)
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -106,9 +124,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'RenzTrendingBackend.wsgi.application'
 
+# Username, email or phone login; also handles permissions like ModelBackend.
+# It reads only Main.LoginIdentifier, which migrate backfills for existing users
+# (see Main/identifiers.py); rebuild_login_identifiers redoes it by hand.
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
-    'Main.authentications.CustomAuthBackend',  # Add this line
+    'Main.authentications.CustomAuthBackend',
 ]
 
 # Database
@@ -126,6 +146,59 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Swap the backend for django.core.cache.backends.redis.RedisCache to share
+# the catalog cache between processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'renz-trending',
+    }
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Frequently-bought-together mining stays this far behind the newest order, so
+# checkouts still in their transaction are not skipped (see Main/bought_together.py)
+BOUGHT_TOGETHER_SAFETY_LAG = timedelta(minutes=10)
+
+# How long a stored Idempotency-Key response is replayed (see Main/idempotency.py)
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+
+# Email
+# Handlers only queue mail; `manage.py run_mail_worker` sends it (see Main/mailer.py)
+
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'true').lower() == 'true'
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
+
+MAIL_QUEUE_BACKEND = os.getenv('MAIL_QUEUE_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+MAIL_MAX_ATTEMPTS = 5
+MAIL_RETRY_DELAY = 30  # seconds before the first retry, doubling per attempt
+MAIL_MAX_RETRY_DELAY = 60 * 60
+MAIL_LOCK_TIMEOUT = timedelta(minutes=10)  # also caps a worker's batch at this / EMAIL_TIMEOUT - 1 jobs
+
+# Newsletter campaigns (see Main/campaigns.py)
+CAMPAIGN_BATCH_SIZE = 100
+CAMPAIGN_RATE_LIMIT = float(os.getenv('CAMPAIGN_RATE_LIMIT', '10'))  # messages per second; 0 for no limit
+
+
+# Token authentication cache (see Main/authentications.py). A logout or
+# password change reaches other processes' local copies within AUTH_TOKEN_LOCAL_TTL.
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = 60 * 5
+AUTH_TOKEN_LOCAL_TTL = 5
+AUTH_TOKEN_LOCAL_SIZE = 10000
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -146,7 +219,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "Main.authentications.CachedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"